@@ -0,0 +1,319 @@
+"""
+Benchmarks of the TsDB and of the MCP tool hot paths.
+
+    uv run python benchmarks/run.py --output results.json
+    uv run python benchmarks/run.py --quick --compare results.json
+
+Results are written as JSON. With --compare, every metric is compared to a
+previous result file and the regressions beyond --threshold are reported,
+the exit status is 1 if there is any.
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from hrm.bt_client import DeviceSession
+from hrm.measurement import HeartRateMeasurement, decode_measurement, encode_measurement
+from hrm.ts_db import TsDB
+
+# metrics where a larger value is better, the others are latencies
+THROUGHPUT_SUFFIX = "_per_s"
+
+
+def latency(fn: Callable, repeat: int) -> dict:
+    """
+    Call fn repeat times, return the latency percentiles in microseconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    return _stats(timings)
+
+
+async def async_latency(fn: Callable, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        timings.append(time.perf_counter() - t0)
+    return _stats(timings)
+
+
+def _stats(timings: list[float]) -> dict:
+    timings.sort()
+
+    def pick(q):
+        return round(timings[min(int(q * len(timings)), len(timings) - 1)] * 1e6, 2)
+
+    return {
+        "mean_us": round(sum(timings) / len(timings) * 1e6, 2),
+        "p50_us": pick(0.5),
+        "p99_us": pick(0.99),
+    }
+
+
+def throughput(fn: Callable, count: int) -> float:
+    """
+    Run fn, which processes count items, return the items per second.
+    """
+    gc.collect()
+    t0 = time.perf_counter()
+    fn()
+    return round(count / (time.perf_counter() - t0), 1)
+
+
+def filled_db(size: int, rollups=True) -> TsDB:
+    """A 1 Hz heart rate series of the given size, ending now."""
+    db = TsDB(size, value_type="H") if rollups else TsDB(size, "H", rollups=())
+    start = time.time() - size
+    rnd = random.Random(size)
+    for i in range(size):
+        db.insert(start + i, rnd.randint(60, 180))
+    return db
+
+
+def bench_insert(size: int) -> dict:
+    rnd = random.Random(0)
+    values = [rnd.randint(60, 180) for _ in range(size)]
+
+    def insert(db):
+        def run():
+            for ts, value in enumerate(values):
+                db.insert(float(ts), value)
+
+        return run
+
+    return {
+        "insert_per_s": throughput(insert(TsDB(size, value_type="H")), size),
+        "insert_no_rollups_per_s": throughput(
+            insert(TsDB(size, value_type="H", rollups=())), size
+        ),
+    }
+
+
+def bench_query(sizes: list[int], repeat: int) -> dict:
+    results = {}
+    for size in sizes:
+        db = filled_db(size, rollups=False)
+        first, last = db.data[0][0], db.latest()[0]
+        rnd = random.Random(size)
+
+        def random_window():
+            start = rnd.uniform(first, last - 60)
+            db.query(start, start + 60)
+
+        results[f"query_60s_{size}"] = latency(random_window, repeat)
+        results[f"latest_window_avg_{size}"] = latency(
+            lambda: db.avg(last - 10, last), repeat
+        )
+    return results
+
+
+def bench_time_bucket(repeat: int) -> dict:
+    db = filled_db(24 * 60 * 60)
+    end = db.latest()[0]
+    aligned = (end // 60) * 60 - 24 * 60 * 60
+    return {
+        # served by the 60 s rollup
+        "time_bucket_24h_60s": latency(
+            lambda: db.time_bucket(aligned, end, 60), repeat
+        ),
+        # unaligned, scans the raw samples
+        "time_bucket_24h_7s": latency(
+            lambda: db.time_bucket(end - 24 * 60 * 60, end, 7), repeat
+        ),
+        "time_bucket_10min_1s": latency(
+            lambda: db.time_bucket(end - 600, end, 1), repeat
+        ),
+    }
+
+
+def bench_decode(count: int) -> dict:
+    rnd = random.Random(0)
+    payloads = [
+        encode_measurement(
+            HeartRateMeasurement(
+                rnd.randint(60, 180),
+                True,
+                rnd.randint(0, 1000) if i % 10 == 0 else None,
+                tuple(rnd.uniform(400, 1000) for _ in range(rnd.randint(0, 3))),
+            )
+        )
+        for i in range(count)
+    ]
+
+    def decode():
+        for data in payloads:
+            decode_measurement(data)
+
+    session = DeviceSession("bench")
+
+    def put():
+        for data in payloads:
+            session.count_heart_rate(None, data)
+
+    # a burst of notifications timestamped on arrival would have overlapping
+    # RR intervals, commit them 1 second apart like a real strap instead
+    now = time.time() - count
+    batch = [(now + i, data) for i, data in enumerate(payloads)]
+    fresh = DeviceSession("bench")
+    return {
+        "decode_per_s": throughput(decode, count),
+        "count_heart_rate_per_s": throughput(put, count),
+        "commit_heart_rate_per_s": throughput(
+            lambda: fresh.commit_heart_rate(batch), count
+        ),
+    }
+
+
+async def bench_tools(repeat: int) -> dict:
+    """
+    End-to-end latency of the tools through an in-memory FastMCP client.
+    """
+    from fastmcp import Client
+
+    from hrm import server
+
+    session = DeviceSession("bench")
+    now = time.time()
+    batch = [
+        (now - 3600 + i, encode_measurement(HeartRateMeasurement(60 + i % 90)))
+        for i in range(3600)
+    ]
+    session.commit_heart_rate(batch)
+    server.cli.sessions["bench"] = session
+    server.cli.default_device = "bench"
+
+    calls = {
+        "get_heart_rate": {},
+        "evaluate_active_heart_rate": {},
+        "get_heart_rate_bucket": {"since_from": 600, "bucket_size": 10},
+        "get_session_summary": {},
+        "get_hrv": {},
+    }
+    results = {}
+    async with Client(server.mcp) as client:
+        for name, arguments in calls.items():
+            results[f"tool_{name}"] = await async_latency(
+                lambda: client.call_tool(name, arguments), repeat
+            )
+    return results
+
+
+def bench_import(repeat: int) -> dict:
+    """
+    Cold import time of the server, from -X importtime in fresh interpreters.
+    """
+    timings = []
+    for _ in range(repeat):
+        stderr = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import hrm.server"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stderr
+        for line in stderr.splitlines():
+            # import time: self [us] | cumulative | imported package
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == "hrm.server":
+                timings.append(int(fields[1]) / 1e6)
+    return {"import_hrm_server": _stats(timings)}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(quick: bool = False) -> dict:
+    sizes = [10_000, 50_000] if quick else [10_000, 50_000, 1_000_000]
+    repeat = 200 if quick else 2000
+    results = {}
+    results.update(bench_insert(100_000 if quick else 1_000_000))
+    results.update(bench_query(sizes, repeat))
+    results.update(bench_time_bucket(10 if quick else 50))
+    results.update(bench_decode(20_000 if quick else 200_000))
+    results.update(asyncio.run(bench_tools(50 if quick else 500)))
+    results.update(bench_import(3 if quick else 10))
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def _metrics(results: dict):
+    """Flatten the results to (name, value, higher is better) triples."""
+    for name, value in results.items():
+        if isinstance(value, dict):
+            yield f"{name}.p50_us", value["p50_us"], False
+        else:
+            yield name, value, name.endswith(THROUGHPUT_SUFFIX)
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    The metrics of current worse than baseline by more than threshold (a ratio).
+    """
+    previous = {name: value for name, value, _ in _metrics(baseline["results"])}
+    regressions = []
+    for name, value, higher_is_better in _metrics(current["results"]):
+        old = previous.get(name)
+        if not old or not value:
+            continue
+        ratio = old / value if higher_is_better else value / old
+        if ratio > 1 + threshold:
+            regressions.append(f"{name}: {old} -> {value} ({ratio:.2f}x worse)")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes")
+    parser.add_argument("--compare", help="a previous JSON result file")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="regression ratio, default 0.25"
+    )
+    args = parser.parse_args(argv)
+    result = run(args.quick)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
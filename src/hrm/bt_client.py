@@ -1,154 +1,460 @@
 import asyncio
-import io
+import atexit
 import logging
 import math
 import os
+import re
 import tempfile
 import time
-from datetime import datetime
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Optional, Union
 
-import matplotlib.pyplot as plt
-from bleak import BleakClient, BleakScanner
+from bleak import BleakClient
 from dotenv import load_dotenv
 from pydantic import Field
-from qiniu import Auth as QiniuAuth
-from qiniu import put_file as QiniuPutFile
 
+from hrm.chart import ChartCache, ChartRenderer
+from hrm.discovery import HEART_RATE_SERVICE_UUID, DeviceScanner
+from hrm.export import EXPORT_FORMATS, bucket_columns, export_columns, raw_columns
+from hrm.filters import HeartRateFilter
+from hrm.hrv import HrvWindow, frequency_domain
+from hrm.ingest import Batch, NotificationBuffer
+from hrm.live import LiveFeed
+from hrm.measurement import decode_measurement, rr_timestamps
+from hrm.metrics import ArrivalStats, Metrics
+from hrm.simulator import Simulator
 from hrm.ts_db import TsDB
-
-# Heart Rate Service UUID (16-bit: 0x180D, full 128-bit form)
-HEART_RATE_SERVICE_UUID = "0000180d-0000-1000-8000-00805f9b34fb"
+from hrm.ts_store import SegmentStore
+from hrm.upload import Uploader, chart_key, uploader_from_env
+from hrm.workload import WorkloadTracker
 
 # Heart Rate Measurement Characteristic UUID (16-bit: 0x2a37, full 128-bit form)
 HR_MEASUREMENT_CHAR_UUID = "00002a37-0000-1000-8000-00805f9b34fb"
 
+# Max number of samples kept in memory per device, overridden by the HRM_DB_MAXLEN env var
+HRM_DB_MAXLEN = 24 * 60 * 60
+# Max number of RR intervals kept in memory per device, about 24 hours at 2 beats/s,
+# overridden by the HRM_RR_DB_MAXLEN env var
+HRM_RR_DB_MAXLEN = 2 * HRM_DB_MAXLEN
+# Backoff (seconds) between reconnection attempts after a dropout, doubled up to the max
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 30.0
+# bucket sizes (seconds) picked for max_points, multiples of the rollup resolutions
+BUCKET_SIZES = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600, 900, 1800, 3600)
+
 
 # Set up logging
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
 
-def upload_file(file_path: str) -> Optional[str]:
-    """Upload a file to QINIU Storage, it will let DeepChat to download the file."""
-    load_dotenv()
-    QINIU_ACCESS_KEY = os.getenv("QINIU_ACCESS_KEY")
-    QINIU_SECRET_KEY = os.getenv("QINIU_SECRET_KEY")
-    QINIU_BUCKET_NAME = os.getenv("QINIU_BUCKET_NAME")
-    QINIU_BUCKET_DOMAIN = os.getenv("QINIU_BUCKET_DOMAIN")
-    # if file_path is not a PNG file, return none
-    if not file_path.endswith(".png"):
-        return None
-
-    # Check if all QINIU keys are defined
-    if not all(
-        [QINIU_ACCESS_KEY, QINIU_SECRET_KEY, QINIU_BUCKET_NAME, QINIU_BUCKET_DOMAIN]
+def maxlen_from_env(name: str, default: int) -> int:
+    """The positive integer of the env var name, default when it is unset."""
+    value = os.getenv(name)
+    if not value:
+        return default
+    maxlen = int(value)
+    if maxlen <= 0:
+        raise ValueError(f"{name} must be greater than 0")
+    return maxlen
+
+
+class DeviceSession:
+    """Monitoring state of one HRM device: its BLE client, the TsDB series of its samples
+    and the queue of its notifications."""
+
+    def __init__(
+        self,
+        device_id: str,
+        data_dir: Optional[str] = None,
+        hr_filter: Optional[HeartRateFilter] = None,
     ):
-        logger.warning("QINIU keys are not defined. Skipping upload.")
-        return None
+        self.device_id = device_id
+        store = rr_store = None
+        if data_dir:
+            device_dir = os.path.join(data_dir, re.sub(r"[^\w.-]", "_", device_id))
+            store = SegmentStore(os.path.join(device_dir, "hr"))
+            rr_store = SegmentStore(os.path.join(device_dir, "rr"))
+            atexit.register(store.close)
+            atexit.register(rr_store.close)
+        # keep 24 hours of 1 Hz samples by default, bpm is stored as uint16, the
+        # memory is allocated as samples arrive
+        self.db = TsDB(
+            maxlen_from_env("HRM_DB_MAXLEN", HRM_DB_MAXLEN), value_type="H", store=store
+        )
+        # RR intervals in milliseconds, they are not bucketed so no rollups
+        self.rr_db = TsDB(
+            maxlen_from_env("HRM_RR_DB_MAXLEN", HRM_RR_DB_MAXLEN),
+            rollups=(),
+            store=rr_store,
+        )
+        # drops the artifacts before they are stored and records the gaps
+        self.hr_filter = hr_filter if hr_filter is not None else HeartRateFilter()
+        # latest sensor contact status and energy expended (kJ) reported
+        self.sensor_contact: Optional[bool] = None
+        self.energy_expended: Optional[int] = None
+        # rolling windows behind get_heart_rate and evaluate_active_heart_rate
+        self.avg_window = self.db.register_window(10)
+        self.active_window = self.db.register_window(60)
+        # short-term (5 minutes) time-domain HRV, updated as RR intervals arrive
+        self.hrv_window = self.rr_db.attach_window(HrvWindow(300))
+        # time in zone, TRIMP and calories of the current monitoring session
+        self.workload = WorkloadTracker()
+        self.client: Optional[BleakClient] = None
+        self.task: Optional[asyncio.Task] = None
+        # connection state: idle, connecting, connected, reconnecting or stopped
+        self.state = "idle"
+        self.reconnects = 0
+        self.connected_since: Optional[float] = None
+        self.monitoring_until: Optional[float] = None
+        # notifications received and arrival time of the last one
+        self.samples_received = 0
+        self.last_packet: Optional[float] = None
+        # notification rate and jitter, and the payloads that failed to decode
+        self.arrivals = ArrivalStats()
+        self.malformed = 0
+        self._disconnected: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # notifications are queued by the BLE callback and committed in batches
+        self.ingest = NotificationBuffer(self.commit_heart_rate)
+        # live updates pushed to the subscribers, one per committed batch
+        self.live = LiveFeed()
+
+    @property
+    def is_monitoring(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def on_disconnect(self, client: BleakClient):
+        """Disconnection callback of the BLE client, wakes up background_monitor to reconnect."""
+        logger.warning(f"Device {self.device_id} disconnected")
+        self.connected_since = None
+        if self._disconnected is not None:
+            self._loop.call_soon_threadsafe(self._disconnected.set)
 
-    q = QiniuAuth(QINIU_ACCESS_KEY, QINIU_SECRET_KEY)
+    async def background_monitor(self, duration: int):
+        """Monitor the device for duration seconds. When the device drops, it is reconnected
+        with exponential backoff and the samples keep going to the same series."""
+        if not self.client:
+            return
+        # a persistent db keeps the history of previous sessions
+        if self.db.store is None:
+            self.db.clear()
+            self.rr_db.clear()
+        self.workload.clear()
+        self.hr_filter.clear()
+        self.reconnects = 0
+        self.samples_received = 0
+        self.last_packet = None
+        self.arrivals.clear()
+        self.malformed = 0
+        self.monitoring_until = time.time() + duration
+        self._loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + duration
+        delay = RECONNECT_MIN_DELAY
+        self.state = "connecting"
+        ingest_task = asyncio.create_task(self.ingest.run())
+        try:
+            while True:
+                self._disconnected = asyncio.Event()
+                try:
+                    async with self.client:
+                        self.state = "connected"
+                        self.connected_since = time.time()
+                        delay = RECONNECT_MIN_DELAY
+                        await self.client.start_notify(
+                            HR_MEASUREMENT_CHAR_UUID, self.count_heart_rate
+                        )
+                        # Keep listening until the end of the duration or a dropout
+                        remaining = max(deadline - time.monotonic(), 0)
+                        try:
+                            await asyncio.wait_for(self._disconnected.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            await self.client.stop_notify(HR_MEASUREMENT_CHAR_UUID)
+                            break
+                except Exception as e:
+                    logger.warning(f"Connection to {self.device_id} failed: {e}")
+                self.connected_since = None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.state = "reconnecting"
+                self.reconnects += 1
+                logger.info(f"Reconnecting to {self.device_id} in {delay:.0f} seconds")
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                if time.monotonic() >= deadline:
+                    break
+        finally:
+            self.state = "stopped"
+            self.connected_since = None
+            self._disconnected = None
+            ingest_task.cancel()
+            self.ingest.drain()
+        if self.db.store is not None:
+            self.db.store.flush(sync=True)
+            self.rr_db.store.flush(sync=True)
+        logger.info(f"Stopped monitoring heart rate of {self.device_id}")
+
+    def status(self) -> dict:
+        """The connection status and ingestion counters of the session."""
+        state = self.state
+        error = None
+        if self.task is not None and self.task.done() and not self.task.cancelled():
+            exception = self.task.exception()
+            if exception is not None:
+                state, error = "failed", str(exception)
+        now = time.time()
+        return {
+            "device_id": self.device_id,
+            "state": state,
+            "error": error,
+            "reconnects": self.reconnects,
+            "connected_for": (
+                now - self.connected_since if self.connected_since is not None else None
+            ),
+            "monitoring_until": self.monitoring_until if self.is_monitoring else None,
+            "samples_received": self.samples_received,
+            "samples_accepted": self.hr_filter.accepted,
+            "last_packet_age": (
+                now - self.last_packet if self.last_packet is not None else None
+            ),
+        }
 
-    key = f"{datetime.now().strftime('%Y%m%d%H%M%S')}.png"
-    token = q.upload_token(QINIU_BUCKET_NAME, key, 3600)
+    def metrics(self) -> dict:
+        """The ingestion and storage counters of the session, see hrm.metrics."""
+        hr_filter = self.hr_filter
+        jitter = self.arrivals.jitter if self.arrivals.interval is not None else None
+        return {
+            "state": self.state,
+            "notifications_total": self.samples_received,
+            "notification_rate": self.arrivals.rate,
+            "jitter_seconds": jitter,
+            "malformed_total": self.malformed,
+            "accepted_total": hr_filter.accepted,
+            "rejected_total": dict(hr_filter.rejected),
+            "queued": len(self.ingest),
+            "db_size": len(self.db),
+            "db_capacity": self.db.maxlen,
+            "db_evictions_total": self.db.evictions,
+            "rr_db_size": len(self.rr_db),
+            "rr_db_evictions_total": self.rr_db.evictions,
+        }
 
-    ret, info = QiniuPutFile(token, key, file_path, version="v2")
+    def configure_workload(self, **profile) -> WorkloadTracker:
+        """Replace the workload tracker with one of the given profile, see WorkloadTracker,
+        unset fields keep their current value. The samples of the current session are
+        replayed into it."""
+        current = self.workload
+        settings = current.profile()
+        if not current.max_hr_explicit:
+            # keep deriving the max heart rate from the age
+            settings["max_hr"] = None
+        settings.update({k: v for k, v in profile.items() if v is not None})
+        workload = WorkloadTracker(max_gap=current.max_gap, **settings)
+        if current.started is not None:
+            for ts, hr in self.db.query(current.started, math.inf):
+                workload.push(ts, hr)
+        self.workload = workload
+        return workload
 
-    base_url = f"{QINIU_BUCKET_DOMAIN}/{key}"
-    # private_url = q.private_download_url(base_url, expires=3600)
-    if ret is not None:
-        return base_url
-    else:
-        return None
+    def count_heart_rate(self, sender: int, data: bytearray):
+        """Queue a heart rate notification, it is decoded and stored with the next batch."""
+        self.ingest.put(sender, data)
+
+    def commit_heart_rate(self, batch: Batch):
+        """Decode a batch of queued notification payloads, filter the artifacts and insert
+        the remaining samples into the db."""
+        process = self.hr_filter.process
+        insert = self.db.insert
+        account = self.workload.push
+        insert_rr = self.rr_db.insert
+        if batch:
+            self.samples_received += len(batch)
+            self.last_packet = batch[-1][0]
+            self.arrivals.observe([ts for ts, _ in batch])
+        last = None
+        batch_rr = []
+        for ts, data in batch:
+            try:
+                measurement = decode_measurement(data)
+            except ValueError:
+                self.malformed += 1
+                logger.warning("Dropped malformed heart rate notification %r", data)
+                continue
+            heart_rate = process(ts, measurement.heart_rate, measurement.sensor_contact)
+            if heart_rate is not None:
+                insert(ts, heart_rate)
+                account(ts, heart_rate)
+                last = (ts, heart_rate)
+            # RR intervals measured without skin contact are noise
+            if measurement.rr_intervals and measurement.sensor_contact is not False:
+                rr_intervals = measurement.rr_intervals
+                for rr_ts, rr in zip(rr_timestamps(ts, rr_intervals), rr_intervals):
+                    insert_rr(rr_ts, rr)
+                batch_rr.extend(rr_intervals)
+            if measurement.sensor_contact is not None:
+                self.sensor_contact = measurement.sensor_contact
+            if measurement.energy_expended is not None:
+                self.energy_expended = measurement.energy_expended
+        if last is not None:
+            self.live.publish(
+                {
+                    "device_id": self.device_id,
+                    "time": last[0],
+                    "heart_rate": last[1],
+                    "rr_intervals": batch_rr,
+                    "sensor_contact": self.sensor_contact,
+                    "energy_expended": self.energy_expended,
+                }
+            )
+        logger.debug("Stored %d heart rate samples of %s", len(batch), self.device_id)
+
+
+def bucket_size_for(
+    since_from: float, max_points: int, bucket_size: float = 0
+) -> float:
+    """The smallest bucket size of BUCKET_SIZES, or a multiple of an hour, of at least
+    bucket_size splitting since_from seconds in at most max_points buckets."""
+    if max_points < 1:
+        raise ValueError("Max points must be at least 1")
+    needed = max(since_from / max_points, bucket_size)
+    for size in BUCKET_SIZES:
+        if size >= needed:
+            return size
+    return math.ceil(needed / 3600) * 3600
+
+
+def bucket_window(
+    since_from: float,
+    bucket_size: float,
+    end_time: float,
+    max_points: Optional[int] = None,
+) -> tuple[float, int]:
+    """The start and the number of buckets of the last since_from seconds before end_time.
+    The start is aligned to the bucket size, so the TsDB rollups can serve it, and the
+    last bucket, partial, holds the latest samples. With max_points, the oldest bucket
+    is dropped when the alignment adds one more."""
+    if bucket_size <= 0:
+        raise ValueError("Bucket size must be greater than 0")
+    start_time = math.floor((end_time - since_from) / bucket_size) * bucket_size
+    num_buckets = max(math.ceil((end_time - start_time) / bucket_size), 1)
+    if max_points is not None and num_buckets > max_points:
+        start_time += bucket_size
+        num_buckets -= 1
+    return start_time, num_buckets
 
 
 class BtClient:
-    def __init__(self):
+    def __init__(self, simulator: Optional[Simulator] = None):
+        """simulator replaces the BLE stack with simulated straps, by default HRM_SIMULATOR
+        straps are simulated when it is set."""
         logger.info("BtClient initialized")
-        # 50000 is the max length of the db
-        self.db = TsDB(50000)
-        self.client: Optional[BleakClient] = None
-
-    async def list_bluetooth_devices(self) -> dict[str, dict]:
+        # persist the samples when HRM_DATA_DIR is set
+        load_dotenv()
+        self.data_dir = os.getenv("HRM_DATA_DIR")
+        if self.data_dir:
+            logger.info(f"Heart rate history is persisted to {self.data_dir}")
+        if simulator is None and os.getenv("HRM_SIMULATOR"):
+            simulator = Simulator(int(os.getenv("HRM_SIMULATOR")))
+            logger.info(f"Simulating {len(simulator.straps)} HRM devices")
+        self.simulator = simulator
+        # one session per monitored device, keyed by device id
+        self.sessions: dict[str, DeviceSession] = {}
+        # the most recently monitored device, used when no device id is given
+        self.default_device: Optional[str] = None
+        # background scanner answering device discovery from its cache
+        if simulator is not None:
+            self.scanner = DeviceScanner(scanner_cls=simulator.scanner)
+        else:
+            self.scanner = DeviceScanner()
+        # charts are rendered in worker processes
+        self.renderer = ChartRenderer()
+        # built charts, reused while their data is unchanged
+        self.chart_cache = ChartCache()
+        # publishes the charts, None when no upload backend is configured
+        self.uploader: Optional[Uploader] = uploader_from_env()
+        # exports are written there before they are uploaded
+        self.export_dir = os.getenv("HRM_EXPORT_DIR") or os.path.join(
+            tempfile.gettempdir(), "hrm-export"
+        )
+        # tool latencies, event loop lag and device counters, dumped to
+        # HRM_METRICS_FILE in the Prometheus text format when it is set
+        self.metrics = Metrics(self.device_metrics, os.getenv("HRM_METRICS_FILE"))
+
+    def get_session(self, device_id: Optional[str] = None) -> DeviceSession:
+        """Return the session of the given device, or of the most recently monitored
+        device when device_id is not given."""
+        if device_id is None:
+            device_id = self.default_device
+            if device_id is None:
+                raise ValueError(
+                    "No device is monitored, start with monitoring_heart_rate"
+                )
+        session = self.sessions.get(device_id)
+        if session is None:
+            raise ValueError(f"Device {device_id} is not monitored")
+        return session
+
+    async def list_bluetooth_devices(
+        self, refresh: bool = False, timeout: Optional[float] = None
+    ) -> dict[str, dict]:
         """Discover Bluetooth devices and filter by HRM profile. Returns a dic, key is the device id,
-        value is a dict of device name and rssi."""
-
-        devices = await BleakScanner.discover(return_adv=True)
-        result = {}
-        for device, adv_data in devices.values():
-            if HEART_RATE_SERVICE_UUID in adv_data.service_uuids:
-                name = device.name or "N/A"
-                logger.info(f"Device: {device.address}, {name}, {device.rssi}")
-                result[device.address] = {
-                    "name": name,
-                    "rssi": device.rssi,
-                }
-        return result
+        value is a dict of device name, rssi and last seen timestamp.
+
+        Devices are answered from the cache of a background scanner, only the first call waits for a scan.
+
+        Args:
+            refresh: bool, wait for a fresh scan and drop the devices not seen during it, default False
+            timeout: float, the scan duration in seconds when a scan is needed, default 5 seconds
+        """
+        devices = await self.scanner.devices(refresh=refresh, timeout=timeout)
+        for address, device in devices.items():
+            logger.debug(f"Device: {address}, {device['name']}, {device['rssi']}")
+        return devices
 
     # Tool: Start Monitoring Heart Rate
     async def monitoring_heart_rate(self, device_id: str, duration: int = 30 * 60):
         """Monitor the heart rate of the device for the given duration, default duration is 1800 seconds (30 minutes).
-        The monitoring will be done in the background.
+            The monitoring will be done in the background, several devices can be monitored at once.
+        If the device drops, it is reconnected with backoff until the end of the duration.
 
         Args:
             device_id: str, the device UUID to monitor
             duration: int, the duration to monitor, default is 1800 seconds (30 minutes)
         """
         logger.debug(f"Monitoring heart rate of {device_id} for {duration} seconds")
-        self.client = BleakClient(device_id)
-        if self.client.is_connected:
-            logger.warning(f"Already connected to {device_id}")
-        else:
-            asyncio.create_task(self.background_monitor(duration))
-        return
-
-    async def background_monitor(self, duration: int):
-        if not self.client:
+        session = self.sessions.get(device_id)
+        if session is None:
+            session = DeviceSession(device_id, self.data_dir)
+            self.sessions[device_id] = session
+        self.default_device = device_id
+        self.metrics.start()
+        if session.is_monitoring:
+            logger.warning(f"Already monitoring {device_id}")
             return
-        async with self.client:
-            self.db.clear()
-            await self.client.start_notify(
-                HR_MEASUREMENT_CHAR_UUID, self.count_heart_rate
-            )
-            # Keep listening for duration seconds
-            await asyncio.sleep(duration)
-            await self.client.stop_notify(HR_MEASUREMENT_CHAR_UUID)
-            logger.info(f"Stopped monitoring heart rate of {self.client.address}")
-
-    def count_heart_rate(self, sender: int, data: bytearray):
-        """Count heart rate value from notification payload."""
-
-        flags = data[0]
-
-        hr_format_uint16 = flags & 0x01
-        index = 1
-
-        # Heart Rate Value
-        if hr_format_uint16:
-            heart_rate = int.from_bytes(data[index : index + 2], byteorder="little")
-            index += 2
-        else:
-            heart_rate = data[index]
-            index += 1
-        logger.debug(f"Heart Rate: {heart_rate} bpm")
-        self.db.insert(time.time(), heart_rate)
+        client_cls = self.simulator.client if self.simulator else BleakClient
+        session.client = client_cls(
+            device_id, disconnected_callback=session.on_disconnect
+        )
+        session.task = asyncio.create_task(session.background_monitor(duration))
+        return
 
     # Tool: Get Heart Rate
-    async def get_heart_rate(self) -> int:
+    async def get_heart_rate(self, device_id: Optional[str] = None) -> int:
         """Get the current HR, use last 10 sec and return the average of HR.
 
+        Args:
+            device_id: str, the device to read, default is the most recently monitored device
+
         Returns:
             dict, the average of HR in the 10 seconds since start_time, e.g.
             {
                 "avg_hr": int
             }
         """
-        # start time is 10 seconds ago
-        start_time = time.time() - 10
-        end_time = start_time + 10
-
+        session = self.get_session(device_id)
+        session.ingest.drain()
         # round up by ceiling to the nearest integer
-        return {"avg_hr": math.ceil(self.db.avg(start_time, end_time))}
+        return {"avg_hr": math.ceil(session.avg_window.mean(time.time()))}
 
     def get_heart_rate_bucket(
         self,
@@ -159,61 +465,463 @@ class BtClient:
         bucket_size: float = Field(
             default=1.0, description="The size of the bucket, default 1 second"
         ),
-    ) -> List[dict]:
+        device_id: Optional[str] = None,
+        compact: bool = False,
+        max_points: Optional[int] = None,
+    ) -> Union[List[dict], dict]:
         """Get the heart rate bucket of the given since_from time in seconds and bucket_size in seconds.
 
         Args:
             since_from: float, the start time of the monitoring, default 10 seconds ago
             bucket_size: float, the size of the bucket, default 1.0
+            device_id: str, the device to read, default is the most recently monitored device
+            compact: bool, return the start time, the bucket size and a flat list of values, default False
+            max_points: int, optional, the max number of buckets, the bucket size is increased to a
+                round size (1, 2, 5, 10, 15, 30 s, 1, 2, 5, 10, 15, 30 min, hours) to fit
 
         Returns:
-            list[dict], the heart rate bucket, e.g.
+            list[dict], the heart rate bucket, value is null for a bucket without data, e.g.
             [
                 {
                     "time": float,
-                    "value": int,
+                    "value": int | None,
                 }
             ]
+            or with compact, the time of the value i is start + i * step, e.g.
+            {
+                "start": float,
+                "step": float,
+                "values": list[int | None]
+            }
         """
-        end_time = time.time()
-        start_time = end_time - since_from
-        buckets = self.db.time_bucket(start_time, end_time, bucket_size)
+        if max_points is not None:
+            bucket_size = bucket_size_for(since_from, max_points, bucket_size)
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        start_time, num_buckets = bucket_window(
+            since_from, bucket_size, time.time(), max_points
+        )
+        buckets = self._heart_rate_buckets(
+            session, start_time, num_buckets, bucket_size
+        )
+        if compact:
+            return {
+                "start": start_time,
+                "step": bucket_size,
+                "values": [v for _, v in buckets],
+            }
         result = []
         for t, v in buckets:
             result.append(
                 {
                     "time": t,
-                    "value": math.ceil(v),
+                    "value": v,
                 }
             )
         return result
 
+    def _heart_rate_buckets(
+        self,
+        session: DeviceSession,
+        start_time: float,
+        num_buckets: int,
+        bucket_size: float,
+    ) -> List[tuple[float, Optional[int]]]:
+        """The (time, heart rate rounded up) of the num_buckets buckets from start_time,
+        the heart rate is None for a bucket without data."""
+        buckets = session.db.time_bucket(
+            start_time, start_time + num_buckets * bucket_size, bucket_size
+        )
+        return [(t, math.ceil(v) if v is not None else None) for t, v in buckets]
+
+    def get_live_heart_rate(self, device_id: Optional[str] = None) -> dict:
+        """Get the latest live heart rate update of the device, without querying the history.
+
+        Args:
+            device_id: str, the device to read, default is the most recently monitored device
+
+        Returns:
+            dict, the latest update, empty before the first notification, e.g.
+            {
+                "device_id": str,
+                "time": float,
+                "heart_rate": int,
+                "rr_intervals": list[float],
+                "sensor_contact": bool | None,
+                "energy_expended": int | None
+            }
+        """
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        return session.live.latest or {}
+
+    async def watch_heart_rate(
+        self,
+        device_id: Optional[str] = None,
+        duration: float = 60.0,
+        on_update: Optional[Callable[[dict], Awaitable[None]]] = None,
+    ) -> dict:
+        """Subscribe to the live heart rate updates of the device for the given duration
+        or until the monitoring stops, on_update is awaited with every update.
+
+        Updates are pushed as notifications are committed, a slow consumer gets the latest
+        ones and the skipped updates are counted as coalesced.
+
+        Args:
+            device_id: str, the device to watch, default is the most recently monitored device
+            duration: float, how long to watch in seconds, default 60 seconds
+
+        Returns:
+            dict, the number of updates received and coalesced, and the latest update, e.g.
+            {
+                "updates": int,
+                "coalesced": int,
+                "latest": dict
+            }
+        """
+        session = self.get_session(device_id)
+        subscription = session.live.subscribe()
+        updates = 0
+        deadline = time.monotonic() + duration
+        try:
+            while session.is_monitoring:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # wake up every second to notice the end of the monitoring
+                update = await subscription.get(timeout=min(remaining, 1.0))
+                if update is None:
+                    continue
+                updates += 1
+                if on_update is not None:
+                    await on_update(update)
+        finally:
+            subscription.close()
+        return {
+            "updates": updates,
+            "coalesced": subscription.coalesced,
+            "latest": session.live.latest or {},
+        }
+
+    def get_hrv(self, device_id: Optional[str] = None) -> dict:
+        """Get the time-domain heart rate variability of the RR intervals of the last 5 minutes.
+
+        Args:
+            device_id: str, the device to read, default is the most recently monitored device
+
+        Returns:
+            dict, RMSSD and SDNN in ms and pNN50 in percent, null with less than 2 RR intervals, e.g.
+            {
+                "rmssd": float | None,
+                "sdnn": float | None,
+                "pnn50": float | None,
+                "mean_rr": float | None,
+                "count": int
+            }
+        """
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        window = session.hrv_window
+        now = time.time()
+        result = {
+            "rmssd": window.rmssd(now),
+            "sdnn": window.sdnn(now),
+            "pnn50": window.pnn50(now),
+            "mean_rr": window.mean(now),
+        }
+        result = {k: round(v, 1) if v is not None else None for k, v in result.items()}
+        result["count"] = window.count()
+        return result
+
+    def get_hrv_frequency(
+        self, since_from: float = 300.0, device_id: Optional[str] = None
+    ) -> dict:
+        """Get the frequency-domain heart rate variability of the RR intervals since the given
+        number of seconds: the LF (0.04-0.15 Hz) and HF (0.15-0.4 Hz) power and the LF/HF ratio.
+
+        Args:
+            since_from: float, how many seconds ago to start, default 300 seconds (5 minutes), at least 60
+            device_id: str, the device to read, default is the most recently monitored device
+
+        Returns:
+            dict, LF and HF power in ms², null with less than 60 seconds of RR intervals, e.g.
+            {
+                "lf": float | None,
+                "hf": float | None,
+                "lf_hf": float | None
+            }
+        """
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        end_time = time.time()
+        rows = session.rr_db.query(end_time - since_from, end_time)
+        result = frequency_domain([ts for ts, _ in rows], [rr for _, rr in rows])
+        if result is None:
+            return {"lf": None, "hf": None, "lf_hf": None}
+        return {k: round(v, 2) if v is not None else None for k, v in result.items()}
+
+    def get_session_summary(self, device_id: Optional[str] = None) -> dict:
+        """Get the summary of the current monitoring session: time in each heart rate zone,
+        training load (Banister TRIMP) and an estimate of the calories burned.
+        The aggregates are updated as samples arrive, so the summary doesn't rescan the session.
+
+        Args:
+            device_id: str, the device to read, default is the most recently monitored device
+
+        Returns:
+            dict, the session aggregates and the profile they are computed with, e.g.
+            {
+                "started": float | None,
+                "duration": float,
+                "active_seconds": float,
+                "samples": int,
+                "avg_hr": float | None,
+                "max_hr": int | None,
+                "zones": [{"zone": int, "min_hr": int, "seconds": float}],
+                "trimp": float,
+                "calories": float,
+                "profile": dict
+            }
+        """
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        summary = session.workload.summary()
+        summary["profile"] = session.workload.profile()
+        return summary
+
+    def configure_heart_rate_zones(
+        self,
+        max_hr: Optional[float] = None,
+        resting_hr: Optional[float] = None,
+        zones: Optional[List[float]] = None,
+        basis: Optional[str] = None,
+        age: Optional[float] = None,
+        weight: Optional[float] = None,
+        sex: Optional[str] = None,
+        device_id: Optional[str] = None,
+    ) -> dict:
+        """Configure the heart rate zones and the profile used by the session summary, unset
+        fields keep their current value. The current session is recomputed with the new profile.
+
+        Args:
+            max_hr: float, the max heart rate, default 220 - age
+            resting_hr: float, the resting heart rate, default 60
+            zones: list[float], the increasing lower bounds of the zones as fractions, default [0.5, 0.6, 0.7, 0.8, 0.9]
+            basis: str, "max" for fractions of max_hr, "reserve" for fractions of max_hr - resting_hr, default "max"
+            age: float, the age in years, default 30
+            weight: float, the weight in kg, default 70
+            sex: str, "male" or "female", selects the TRIMP and calorie formulas, default "male"
+            device_id: str, the device to configure, default is the most recently monitored device
+
+        Returns:
+            dict, the profile in use
+        """
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        workload = session.configure_workload(
+            max_hr=max_hr,
+            resting_hr=resting_hr,
+            zones=zones,
+            basis=basis,
+            age=age,
+            weight=weight,
+            sex=sex,
+        )
+        return workload.profile()
+
+    def get_heart_rate_gaps(
+        self, since_from: float = 600.0, device_id: Optional[str] = None
+    ) -> dict:
+        """Get the gaps of the heart rate data since the given number of seconds, the spans without
+        valid samples, and the counts of the samples rejected by the artifact filter.
+
+        Args:
+            since_from: float, how many seconds ago to start, default 600 seconds (10 minutes)
+            device_id: str, the device to read, default is the most recently monitored device
+
+        Returns:
+            dict, the gaps, end is null for an ongoing gap, reason is one of no_contact, invalid,
+            outlier or dropout, e.g.
+            {
+                "gaps": [{"start": float, "end": float | None, "reason": str}],
+                "accepted": int,
+                "rejected": {"no_contact": int, "invalid": int, "outlier": int}
+            }
+        """
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        end_time = time.time()
+        hr_filter = session.hr_filter
+        return {
+            "gaps": [
+                gap._asdict() for gap in hr_filter.gaps(end_time - since_from, end_time)
+            ],
+            "accepted": hr_filter.accepted,
+            "rejected": dict(hr_filter.rejected),
+        }
+
+    def get_monitoring_status(self, device_id: Optional[str] = None) -> dict:
+        """Get the monitoring status of the device: its connection state, the reconnections after
+        dropouts, the samples received and the age of the last packet.
+
+        Args:
+            device_id: str, the device to read, default is the most recently monitored device
+
+        Returns:
+            dict, state is one of connecting, connected, reconnecting, stopped or failed, e.g.
+            {
+                "device_id": str,
+                "state": str,
+                "error": str | None,
+                "reconnects": int,
+                "connected_for": float | None,
+                "monitoring_until": float | None,
+                "samples_received": int,
+                "samples_accepted": int,
+                "last_packet_age": float | None
+            }
+        """
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        return session.status()
+
+    async def export_heart_rate(
+        self,
+        since_from: float = 3600.0,
+        bucket_size: Optional[float] = None,
+        format: str = "csv",
+        series: str = "hr",
+        device_id: Optional[str] = None,
+    ) -> dict:
+        """Export the heart rate history since the given number of seconds to a file, the raw
+        samples or the bucket stats, instead of returning the data inline. The file is written
+        in chunks in a worker thread, then uploaded when an upload backend is configured.
+
+        Args:
+            since_from: float, how many seconds ago to start, default 3600 seconds (1 hour)
+            bucket_size: float, the bucket size in seconds, default None exports the raw samples
+            format: str, "csv", "npy" (NumPy structured array), "parquet" or "arrow" (these two need pyarrow), default "csv"
+            series: str, "hr" for the heart rate (bpm) or "rr" for the RR intervals (ms), default "hr"
+            device_id: str, the device to export, default is the most recently monitored device
+
+        Returns:
+            dict, the columns are time and value for the raw samples, time, count, mean, min and
+            max for the buckets, url is null without upload backend, e.g.
+            {
+                "path": str,
+                "url": str | None,
+                "format": str,
+                "columns": list[str],
+                "rows": int,
+                "bytes": int,
+                "start": float,
+                "end": float
+            }
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unsupported export format: {format}")
+        if series not in ("hr", "rr"):
+            raise ValueError(f"Unsupported series: {series}")
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        db = session.db if series == "hr" else session.rr_db
+        end_time = time.time()
+        # the in-memory samples and rollup buckets are copied out of the db here, so
+        # the thread doesn't race the inserts, it reads the store and computes the buckets
+        if bucket_size:
+            start_time = math.floor((end_time - since_from) / bucket_size) * bucket_size
+            columns = bucket_columns(db, start_time, end_time, bucket_size)
+        else:
+            start_time = end_time - since_from
+            columns = raw_columns(db, start_time, end_time)
+        suffix, mime_type = EXPORT_FORMATS[format]
+        key = f"{series}-{chart_key(suffix)}"
+        path = os.path.join(self.export_dir, key)
+        size = await asyncio.to_thread(export_columns, path, columns, format)
+        url = None
+        if self.uploader is not None:
+            url = await self.uploader.upload_file(path, key, mime_type)
+            if not url:
+                logger.error(f"Failed to upload the export {path}")
+        logger.info(f"Exported {columns.rows} rows of {series} to {path}")
+        return {
+            "path": path,
+            "url": url,
+            "format": format,
+            "columns": list(columns.types),
+            "rows": columns.rows,
+            "bytes": size,
+            "start": start_time,
+            "end": end_time,
+        }
+
+    def device_metrics(self) -> dict:
+        """The counters of every session by device id, the queued notifications are
+        committed first."""
+        for session in self.sessions.values():
+            session.ingest.drain()
+        return {
+            device_id: session.metrics() for device_id, session in self.sessions.items()
+        }
+
+    def server_metrics(self, format: str = "json"):
+        """Get the metrics of the server itself: the latency of the tools, the event loop lag
+        and, for every device, the notification rate and jitter, the dropped and filtered
+        samples and the size and evictions of its in-memory series.
+
+        Args:
+            format: str, "json" for a dict or "prometheus" for the Prometheus text format, default "json"
+
+        Returns:
+            dict, latencies in ms, or str with the prometheus format, e.g.
+            {
+                "uptime": float,
+                "tools": {"get_heart_rate": {"count": int, "mean_ms": float, "p50_ms": float,
+                    "p95_ms": float, "p99_ms": float, "max_ms": float, "errors": int}},
+                "event_loop_lag": {"count": int, "mean_ms": float, ..., "last_ms": float},
+                "devices": {"<device_id>": {"state": str, "notifications_total": int,
+                    "notification_rate": float, "jitter_seconds": float, "malformed_total": int,
+                    "accepted_total": int, "rejected_total": dict, "queued": int, "db_size": int,
+                    "db_capacity": int, "db_evictions_total": int, "rr_db_size": int,
+                    "rr_db_evictions_total": int}}
+            }
+        """
+        if format == "prometheus":
+            return self.metrics.prometheus()
+        if format != "json":
+            raise ValueError(f"Unsupported metrics format: {format}")
+        return self.metrics.snapshot()
+
     # Tool: Evaluate Active Heart Rate
-    def evaluate_active_heart_rate(self) -> dict:
+    def evaluate_active_heart_rate(self, device_id: Optional[str] = None) -> dict:
         """Evaluate the active heart rate by the max heart rate of last min.
 
+        Args:
+            device_id: str, the device to read, default is the most recently monitored device
+
         Returns:
             dict, the max heart rate of last min, e.g.
             {
                 "max_hr": int
             }
         """
-        start_time = time.time() - 60
-        data = self.db.query(start_time, time.time())
-        if len(data) == 0:
-            return {
-                "max_hr": 0,
-            }
-        max_hr = max(val for ts, val in data)
+        session = self.get_session(device_id)
+        session.ingest.drain()
+        max_hr = session.active_window.max(time.time())
         return {
-            "max_hr": max_hr,
+            "max_hr": max_hr if max_hr is not None else 0,
         }
 
-    def build_heart_rate_chart(self, since_from: float = 600.0) -> str:
+    async def build_heart_rate_chart(
+        self, since_from: float = 600.0, device_id: Optional[str] = None
+    ) -> str:
         """
         Build a heart rate plot chart using heart rate bucket data (bucket size 1s) and overlay the average heart rate line.
+        The chart is rendered in a worker process and uploaded asynchronously, so the event loop keeps serving.
+        Repeated requests for the same window reuse the previous chart while its data is unchanged.
         Args:
             since_from: float, how many seconds ago to start (default 600s = 10min)
+            device_id: str, the device to chart, default is the most recently monitored device
         Returns:
             str: The URL of the chart image (PNG)
         """
@@ -224,45 +932,39 @@ class BtClient:
             bucket_size = math.ceil(since_from / 60)
         else:
             bucket_size = 1
-        data = self.get_heart_rate_bucket(
-            since_from=since_from, bucket_size=bucket_size
-        )
+        session = self.get_session(device_id)
+        # every sample received before the watermark is in the db after the drain
+        watermark = time.time()
+        session.ingest.drain()
+        # the same window as get_heart_rate_bucket, quantized to the bucket size,
+        # computed once so the cached chart covers exactly its key
+        start_time, num_buckets = bucket_window(since_from, bucket_size, time.time())
+        cache_key = (session.device_id, start_time, bucket_size, num_buckets)
+        window_end = start_time + num_buckets * bucket_size
+        key = self.chart_cache.get(cache_key, session.db, window_end)
+        if key is not None:
+            logger.debug(f"Heart rate chart served from cache: {cache_key}")
+            return key
+
+        data = self._heart_rate_buckets(session, start_time, num_buckets, bucket_size)
         if not data:
             logger.warning("No heart rate data available for chart.")
             return ""
-        times = [d["time"] for d in data]
-        # convert to datetime
-        times = [datetime.fromtimestamp(t) for t in times]
-        values = [d["value"] for d in data]
-        if not values:
+        times = [t for t, _ in data]
+        values = [v for _, v in data]
+        if all(v is None for v in values):
             logger.warning("No heart rate values to plot.")
             return ""
-        avg_hr = sum(values) / len(values)
-        plt.figure(figsize=(12, 6))
-        plt.plot(times, values, label="Heart Rate", marker="o")
-        plt.axhline(
-            y=avg_hr, color="r", linestyle="--", label=f"Average HR: {avg_hr:.1f} bpm"
-        )
-        plt.xlabel("Time")
-        plt.ylabel("Heart Rate (bpm)")
-        plt.title("Heart Rate Over Time (bucketed by 10s)")
-        plt.legend()
-        plt.tight_layout()
-        # Save PNG for debugging, the file should in tmp folder
-        tmp_dir = tempfile.gettempdir()
-        debug_file = os.path.join(tmp_dir, f"debug_{time.time()}.png")
-        plt.savefig(debug_file, format="png")
-        # full path of debug.png
-        logger.debug(f"Debug PNG chart saved as {debug_file}")
-        key = upload_file(debug_file)
-        if key:
-            logger.info(f"Debug PNG chart uploaded to {key}")
-            plt.close()
-        else:
-            logger.error("Failed to upload debug PNG chart")
-            svg_buffer = io.StringIO()
-            plt.savefig(svg_buffer, format="svg")
-            plt.close()
-            key = svg_buffer.getvalue()
-            svg_buffer.close()
+        key = None
+        if self.uploader is not None:
+            png = await self.renderer.render(times, values, format="png")
+            key = await self.uploader.upload(png, chart_key(".png"))
+            if key:
+                logger.info(f"PNG chart uploaded to {key}")
+            else:
+                logger.error("Failed to upload PNG chart")
+        if not key:
+            svg = await self.renderer.render(times, values, format="svg")
+            key = svg.decode("utf-8")
+        self.chart_cache.put(cache_key, session.db, key, watermark)
         return key
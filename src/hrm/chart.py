@@ -0,0 +1,322 @@
+import asyncio
+import atexit
+import io
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from typing import Hashable, List, Optional
+
+from hrm.ts_db import TsDB
+
+# default chart size in pixels
+CHART_WIDTH = 1200
+CHART_HEIGHT = 600
+CHART_DPI = 100
+# default size budget of an inline SVG chart, which ends up in the LLM context
+MAX_SVG_BYTES = 16 * 1024
+# markers are only drawn when the points are far enough apart to be told apart
+MAX_MARKERS = 120
+
+
+def decimate(
+    times: List[float], values: List[Optional[float]], max_points: int
+) -> tuple[List[float], List[Optional[float]]]:
+    """
+    Min/max decimation of a series to about max_points points.
+
+    The series is split in max_points / 2 columns of consecutive points, each
+    column keeps its min and max points in time order, so peaks survive. A
+    column with missing values also keeps one None, so gaps stay visible.
+    """
+    if len(times) <= max_points:
+        return times, values
+    columns = max(1, max_points // 2)
+    size = len(times) / columns
+    out_times, out_values = [], []
+    for column in range(columns):
+        lo, hi = int(column * size), int((column + 1) * size)
+        low = high = gap = None
+        for i in range(lo, hi):
+            v = values[i]
+            if v is None:
+                if gap is None:
+                    gap = i
+            else:
+                if low is None or v < values[low]:
+                    low = i
+                if high is None or v > values[high]:
+                    high = i
+        for i in sorted({i for i in (low, high, gap) if i is not None}):
+            out_times.append(times[i])
+            out_values.append(values[i])
+    return out_times, out_values
+
+
+def _average(values: List[Optional[float]]) -> float:
+    present = [v for v in values if v is not None]
+    return sum(present) / len(present)
+
+
+def render_png(
+    times: List[float],
+    values: List[Optional[float]],
+    width: int = CHART_WIDTH,
+    height: int = CHART_HEIGHT,
+    dpi: int = CHART_DPI,
+) -> bytes:
+    """
+    Render the chart as PNG with matplotlib's object-oriented Agg API, which
+    keeps no global state between renders. The series is decimated to the
+    pixel width first.
+    """
+    # matplotlib is slow to import, only pay for it when a chart is rendered
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    avg_hr = _average(values)
+    times, values = decimate(times, values, width)
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(
+        [datetime.fromtimestamp(t) for t in times],
+        [v if v is not None else float("nan") for v in values],
+        label="Heart Rate",
+        marker="o" if len(times) <= MAX_MARKERS else None,
+    )
+    ax.axhline(
+        y=avg_hr, color="r", linestyle="--", label=f"Average HR: {avg_hr:.1f} bpm"
+    )
+    ax.set_xlabel("Time")
+    ax.set_ylabel("Heart Rate (bpm)")
+    ax.set_title("Heart Rate Over Time")
+    ax.legend()
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def _svg(
+    times: List[float],
+    values: List[Optional[float]],
+    avg_hr: float,
+    width: int,
+    height: int,
+) -> str:
+    margin = 40
+    present = [v for v in values if v is not None]
+    low, high = min(present + [avg_hr]), max(present + [avg_hr])
+    if high == low:
+        low, high = low - 1, high + 1
+    start, end = times[0], times[-1]
+    span = (end - start) or 1
+
+    def x(t):
+        return round(margin + (t - start) / span * (width - 2 * margin))
+
+    def y(v):
+        return round(height - margin - (v - low) / (high - low) * (height - 2 * margin))
+
+    # one polyline per run of values, a missing value breaks the line
+    lines, points = [], []
+    for t, v in zip(times, values):
+        if v is None:
+            if points:
+                lines.append(points)
+            points = []
+        else:
+            points.append(f"{x(t)},{y(v)}")
+    if points:
+        lines.append(points)
+
+    def clock(t):
+        return datetime.fromtimestamp(t).strftime("%H:%M:%S")
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        'font-family="sans-serif" font-size="12">',
+        f'<text x="{width // 2}" y="20" text-anchor="middle">'
+        "Heart Rate Over Time</text>",
+        f'<text x="{margin}" y="{y(high) - 4}">{high:.0f} bpm</text>',
+        f'<text x="{margin}" y="{y(low) + 14}">{low:.0f} bpm</text>',
+        f'<text x="{margin}" y="{height - 8}">{clock(start)}</text>',
+        f'<text x="{width - margin}" y="{height - 8}" text-anchor="end">'
+        f"{clock(end)}</text>",
+        f'<line x1="{margin}" y1="{y(avg_hr)}" x2="{width - margin}" y2="{y(avg_hr)}" '
+        'stroke="red" stroke-dasharray="6,4"/>',
+        f'<text x="{width - margin}" y="{y(avg_hr) - 4}" text-anchor="end" '
+        f'fill="red">Average HR: {avg_hr:.1f} bpm</text>',
+    ]
+    for points in lines:
+        parts.append(
+            f'<polyline fill="none" stroke="steelblue" points="{" ".join(points)}"/>'
+        )
+    parts.append("</svg>")
+    return "".join(parts)
+
+
+def render_svg(
+    times: List[float],
+    values: List[Optional[float]],
+    width: int = CHART_WIDTH,
+    height: int = CHART_HEIGHT,
+    max_bytes: int = MAX_SVG_BYTES,
+) -> bytes:
+    """
+    Render a minimal SVG line chart, without matplotlib. The series is
+    decimated to the pixel width, then further until the document fits in
+    max_bytes, so the inline payload stays bounded for any window.
+    """
+    avg_hr = _average(values)
+    max_points = width
+    while True:
+        svg = _svg(*decimate(times, values, max_points), avg_hr, width, height)
+        data = svg.encode("utf-8")
+        if len(data) <= max_bytes or max_points <= 2:
+            return data
+        max_points //= 2
+
+
+def render_chart(
+    times: List[float],
+    values: List[Optional[float]],
+    format: str = "png",
+    width: int = CHART_WIDTH,
+    height: int = CHART_HEIGHT,
+    max_svg_bytes: int = MAX_SVG_BYTES,
+) -> bytes:
+    """
+    Render the heart rate chart of the given bucket times and values, with the
+    average heart rate line, and return the image in the given format ("png"
+    or "svg"). Buckets without a value are drawn as gaps.
+
+    This runs in a worker process, so it only takes and returns plain data.
+    """
+    if format == "svg":
+        return render_svg(times, values, width, height, max_svg_bytes)
+    if format == "png":
+        return render_png(times, values, width, height)
+    raise ValueError(f"Unsupported chart format: {format}")
+
+
+class ChartRenderer:
+    """
+    Renders charts in a pool of worker processes, so matplotlib doesn't block
+    the event loop.
+
+    At most `max_concurrent` renders run at once, further requests wait for a
+    free slot. The pool is started on the first render.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 2,
+        max_concurrent: Optional[int] = None,
+        executor: Optional[Executor] = None,
+        width: int = CHART_WIDTH,
+        height: int = CHART_HEIGHT,
+        max_svg_bytes: int = MAX_SVG_BYTES,
+    ):
+        """
+        max_concurrent defaults to max_workers. An executor can be given to
+        replace the process pool, e.g. a thread pool in tests. width and height
+        are the chart size in pixels, max_svg_bytes the SVG size budget.
+        """
+        self.width = width
+        self.height = height
+        self.max_svg_bytes = max_svg_bytes
+        self.max_workers = max_workers
+        self.max_concurrent = max_concurrent or max_workers
+        self._executor = executor
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            # spawn, forking a process running the event loop and BLE threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(self.shutdown)
+        return self._executor
+
+    async def render(
+        self, times: List[float], values: List[Optional[float]], format: str = "png"
+    ) -> bytes:
+        """
+        Render the chart in a worker, see render_chart.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._get_executor(),
+                render_chart,
+                times,
+                values,
+                format,
+                self.width,
+                self.height,
+                self.max_svg_bytes,
+            )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class ChartCache:
+    """
+    LRU cache of built charts, so repeated requests for the same window return
+    the previous result without rendering or uploading again.
+
+    Entries are keyed by the caller's quantized time window and bucket size,
+    and are only served while the TsDB data of the window is unchanged since
+    the chart was built and for at most `ttl` seconds.
+    """
+
+    def __init__(self, maxsize: int = 32, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, db: TsDB, end: float) -> Optional[str]:
+        """
+        The cached chart of key, if the samples of db before end did not change.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        chart, version, latest, created = entry
+        if time.monotonic() - created > self.ttl or not db.unchanged_before(
+            version, latest, end
+        ):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return chart
+
+    def put(
+        self, key: Hashable, db: TsDB, chart: str, watermark: Optional[float] = None
+    ):
+        """
+        Cache the chart of key, built from the current data of db. watermark is
+        a timestamp up to which db is known to hold all the samples, e.g. the
+        time its ingestion queue was last drained.
+        """
+        latest = db.latest()
+        latest = latest[0] if latest is not None else None
+        if watermark is not None and (latest is None or watermark > latest):
+            latest = watermark
+        self._entries[key] = (chart, db.version, latest, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from bleak import BleakScanner
+
+# Heart Rate Service UUID (16-bit: 0x180D, full 128-bit form)
+HEART_RATE_SERVICE_UUID = "0000180d-0000-1000-8000-00805f9b34fb"
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceScanner:
+    """
+    Long-lived BLE scanner keeping a cache of the HRM devices around.
+
+    The scanner is started on first use and keeps running in the background,
+    every advertisement of the Heart Rate Service refreshes the RSSI and the
+    last seen time of its device. Devices not seen for `ttl` seconds are
+    evicted, so listing the devices is answered from the cache right away.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 60.0,
+        scan_timeout: float = 5.0,
+        scanner_cls=BleakScanner,
+    ):
+        """
+        ttl is how long in seconds a device stays cached after its last
+        advertisement, scan_timeout how long the first or a forced scan lasts.
+        scanner_cls builds the scanner, it can be replaced by a fake in tests.
+        """
+        self.ttl = ttl
+        self.scan_timeout = scan_timeout
+        self.scanner_cls = scanner_cls
+        self._scanner = None
+        self._devices: dict[str, dict] = {}
+
+    @property
+    def is_running(self) -> bool:
+        return self._scanner is not None
+
+    def _on_detection(self, device, adv_data):
+        if HEART_RATE_SERVICE_UUID not in adv_data.service_uuids:
+            return
+        self._devices[device.address] = {
+            "name": device.name or "N/A",
+            "rssi": adv_data.rssi,
+            "last_seen": time.time(),
+        }
+
+    async def start(self) -> bool:
+        """
+        Start the background scanner, return False if it was already running.
+        """
+        if self._scanner is not None:
+            return False
+        # set before awaiting, so concurrent callers don't start a second one
+        self._scanner = self.scanner_cls(
+            detection_callback=self._on_detection,
+            service_uuids=[HEART_RATE_SERVICE_UUID],
+        )
+        try:
+            await self._scanner.start()
+        except BaseException:
+            self._scanner = None
+            raise
+        logger.info("Background HRM scanner started")
+        return True
+
+    async def stop(self):
+        """
+        Stop the background scanner, the cached devices are kept until they expire.
+        """
+        if self._scanner is None:
+            return
+        scanner, self._scanner = self._scanner, None
+        await scanner.stop()
+        logger.info("Background HRM scanner stopped")
+
+    def cached(self) -> dict[str, dict]:
+        """
+        The devices seen in the last ttl seconds, without waiting for a scan.
+        """
+        cutoff = time.time() - self.ttl
+        for address in [a for a, d in self._devices.items() if d["last_seen"] < cutoff]:
+            del self._devices[address]
+        return {address: dict(device) for address, device in self._devices.items()}
+
+    async def devices(
+        self, refresh: bool = False, timeout: Optional[float] = None
+    ) -> dict[str, dict]:
+        """
+        Return the HRM devices around, keyed by address.
+
+        The first call starts the background scanner and waits one scan
+        timeout for advertisements, later calls return the cache at once.
+        With refresh, wait a full scan timeout and drop the devices that were
+        not seen during it.
+        """
+        if timeout is None:
+            timeout = self.scan_timeout
+        started = await self.start()
+        if refresh or started:
+            scan_start = time.time()
+            await asyncio.sleep(timeout)
+            if refresh:
+                for address in [
+                    a for a, d in self._devices.items() if d["last_seen"] < scan_start
+                ]:
+                    del self._devices[address]
+        return self.cached()
@@ -0,0 +1,227 @@
+"""
+Bulk export of a TsDB range to a file: CSV, NumPy .npy, or Parquet and Arrow
+IPC when pyarrow is installed.
+
+The data is streamed to the writers as chunks of typed arrays: the in-memory
+samples and rollup buckets are copied when the export is prepared, then the
+persisted history is read from the store segments and the bucket stats are
+computed chunk by chunk as the file is written. The writing can run in a
+thread while the event loop keeps inserting, and a long history is never held
+in memory at once.
+"""
+
+import csv
+import math
+import os
+from array import array
+from typing import Iterable, NamedTuple
+
+from hrm.ts_db import TsDB
+
+# rows formatted and written at once
+CHUNK_ROWS = 65536
+
+# format: (file suffix, mime type)
+EXPORT_FORMATS = {
+    "csv": (".csv", "text/csv"),
+    "npy": (".npy", "application/octet-stream"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+}
+
+Chunk = dict[str, array]
+
+
+class Columns(NamedTuple):
+    """
+    The data of an export: the array typecode of every column by name, the
+    number of rows, and the rows as chunks of typed arrays by column name.
+    """
+
+    types: dict[str, str]
+    rows: int
+    chunks: Iterable[Chunk]
+
+
+def raw_columns(db: TsDB, start: float, end: float, chunk: int = CHUNK_ROWS) -> Columns:
+    """
+    The samples from the given start timestamp to the given end timestamp,
+    counted first and streamed chunk by chunk, see TsDB.chunks.
+    """
+    return Columns(
+        {"time": "d", "value": db.value_type},
+        db.count(start, end),
+        ({"time": ts, "value": vals} for ts, vals in db.chunks(start, end, chunk)),
+    )
+
+
+def bucket_columns(
+    db: TsDB, start: float, end: float, bucket_size: float, chunk: int = CHUNK_ROWS
+) -> Columns:
+    """
+    The count, mean, min and max of the buckets from the given start timestamp
+    to the given end timestamp, computed chunk by chunk as they are written,
+    see TsDB.bucket_chunks. The stats of an empty bucket are NaN.
+    """
+    if bucket_size <= 0:
+        raise ValueError("Bucket size must be greater than 0")
+    types = {"time": "d", "count": "L", "mean": "d", "min": "d", "max": "d"}
+    total = int((end - start) / bucket_size)
+    if not total:
+        return Columns(types, 0, [])
+    # half a bucket of margin, so float rounding doesn't lose the last bucket
+    end = start + (total + 0.5) * bucket_size
+    buckets = db.bucket_chunks(start, end, bucket_size, chunk)
+
+    def chunks():
+        for chunk_buckets in buckets:
+            columns = {name: array(typecode) for name, typecode in types.items()}
+            times, counts, means, mins, maxs = columns.values()
+            for bucket in chunk_buckets:
+                times.append(bucket.time)
+                counts.append(bucket.count)
+                if bucket.count:
+                    means.append(bucket.mean)
+                    mins.append(bucket.min)
+                    maxs.append(bucket.max)
+                else:
+                    means.append(math.nan)
+                    mins.append(math.nan)
+                    maxs.append(math.nan)
+            yield columns
+
+    return Columns(types, total, chunks())
+
+
+def write_csv(path: str, columns: Columns):
+    """
+    One row per sample or bucket with a header, the stats of an empty bucket
+    are left empty. Floats are written in their shortest exact form.
+    """
+    names = list(columns.types)
+    bucketed = "count" in columns.types
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(names)
+        for chunk in columns.chunks:
+            rows = zip(*chunk.values())
+            if bucketed:
+                blank = ("",) * (len(names) - 2)
+                rows = (row if row[1] else row[:2] + blank for row in rows)
+            writer.writerows(rows)
+
+
+def write_npy(path: str, columns: Columns):
+    """
+    A structured array with one field per column, load it with numpy.load.
+    The file is sized from the row count, then filled chunk by chunk.
+    """
+    import numpy as np
+
+    dtype = np.dtype(list(columns.types.items()))
+    n = columns.rows
+    if not n:
+        # with a file object, np.save doesn't append .npy to the name
+        with open(path, "wb") as f:
+            np.save(f, np.empty(0, dtype))
+        return
+    # the array is written through a memory map, the file is never in memory
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n,))
+    offset = 0
+    for chunk in columns.chunks:
+        size = len(chunk["time"])
+        if offset + size > n:
+            raise ValueError(f"More than the {n} counted rows to export")
+        for name, column in chunk.items():
+            out[name][offset : offset + size] = np.frombuffer(
+                column, dtype=column.typecode
+            )
+        offset += size
+    if offset != n:
+        raise ValueError(f"Exported {offset} rows of the {n} counted")
+    out.flush()
+    del out
+
+
+def _pyarrow(format: str):
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError(
+            f"{format} export requires pyarrow, install it or use csv or npy"
+        ) from None
+    return pyarrow
+
+
+def _record_batches(pa, columns: Columns):
+    import numpy as np
+
+    for chunk in columns.chunks:
+        # from_pandas turns the NaN of the empty buckets into nulls
+        yield pa.record_batch(
+            [
+                pa.array(np.frombuffer(column, dtype=column.typecode), from_pandas=True)
+                for column in chunk.values()
+            ],
+            names=list(chunk),
+        )
+
+
+def _schema(pa, columns: Columns):
+    import numpy as np
+
+    return pa.schema(
+        [
+            (name, pa.from_numpy_dtype(np.dtype(typecode)))
+            for name, typecode in columns.types.items()
+        ]
+    )
+
+
+def write_parquet(path: str, columns: Columns):
+    """
+    A Parquet file with one row group per chunk.
+    """
+    pa = _pyarrow("parquet")
+    import pyarrow.parquet as pq
+
+    with pq.ParquetWriter(path, _schema(pa, columns)) as writer:
+        for batch in _record_batches(pa, columns):
+            writer.write_batch(batch)
+
+
+def write_arrow(path: str, columns: Columns):
+    """
+    An Arrow IPC file with one record batch per chunk.
+    """
+    pa = _pyarrow("arrow")
+    with pa.ipc.new_file(path, _schema(pa, columns)) as writer:
+        for batch in _record_batches(pa, columns):
+            writer.write_batch(batch)
+
+
+WRITERS = {
+    "csv": write_csv,
+    "npy": write_npy,
+    "parquet": write_parquet,
+    "arrow": write_arrow,
+}
+
+
+def export_columns(path: str, columns: Columns, format: str = "csv") -> int:
+    """
+    Write the columns to path in the given format, return the file size.
+    The file is written under a temporary name and renamed when complete.
+    """
+    writer = WRITERS.get(format)
+    if writer is None:
+        raise ValueError(f"Unsupported export format: {format}")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    try:
+        writer(tmp, columns)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return os.path.getsize(path)
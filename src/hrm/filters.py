@@ -0,0 +1,128 @@
+from collections import deque
+from typing import List, NamedTuple, Optional
+
+# plausible heart rate range (bpm), readings outside are sensor errors
+MIN_HEART_RATE = 25
+MAX_HEART_RATE = 250
+# a MAD is scaled by this factor to estimate the standard deviation
+MAD_SCALE = 1.4826
+
+
+class Gap(NamedTuple):
+    """
+    A span without valid heart rate samples, end is None while it lasts.
+
+    reason is why the samples were missing: "no_contact" when the sensor
+    reported no skin contact, "invalid" for readings out of the plausible
+    range (e.g. 0 bpm), "outlier" for rejected spikes, "dropout" when no
+    notification arrived at all.
+    """
+
+    start: float
+    end: Optional[float]
+    reason: str
+
+
+class HeartRateFilter:
+    """
+    Streaming cleaning stage of the heart rate samples, before they are stored.
+
+    Every sample goes through, in O(1):
+    - sensor contact gating: samples reported without skin contact are dropped,
+    - a range check: readings outside [min_hr, max_hr], e.g. the 0 bpm of a
+      lost contact, are dropped,
+    - a Hampel filter: a reading further than `threshold` robust standard
+      deviations (MAD based, at least `min_sigma` bpm) from the median of
+      the last `window` readings is dropped as a spike.
+
+    A span longer than max_gap seconds between two accepted samples is
+    recorded as a Gap, so "no data" can be told apart from a low heart rate.
+    """
+
+    def __init__(
+        self,
+        contact_gating: bool = True,
+        min_hr: float = MIN_HEART_RATE,
+        max_hr: float = MAX_HEART_RATE,
+        window: int = 7,
+        threshold: float = 3.0,
+        min_sigma: float = 5.0,
+        max_gap: float = 5.0,
+        max_gaps: int = 1024,
+    ):
+        """
+        window is the number of recent readings of the Hampel filter, 0
+        disables it. max_gaps is the number of past gaps kept.
+        """
+        if window < 0:
+            raise ValueError("Window must not be negative")
+        self.contact_gating = contact_gating
+        self.min_hr = min_hr
+        self.max_hr = max_hr
+        self.threshold = threshold
+        self.min_sigma = min_sigma
+        self.max_gap = max_gap
+        self._recent = deque(maxlen=window)
+        self._gaps = deque(maxlen=max_gaps)
+        self.clear()
+
+    def clear(self):
+        self._recent.clear()
+        self._gaps.clear()
+        self._last: Optional[float] = None
+        # why the samples since the last accepted one were rejected
+        self._reason: Optional[str] = None
+        self.accepted = 0
+        self.rejected = {"no_contact": 0, "invalid": 0, "outlier": 0}
+
+    def _reject(self, reason: str) -> None:
+        self.rejected[reason] += 1
+        self._reason = reason
+        return None
+
+    def _is_outlier(self, hr: float) -> bool:
+        recent = self._recent
+        if self.threshold <= 0 or len(recent) < 3:
+            return False
+        ordered = sorted(recent)
+        median = ordered[len(ordered) // 2]
+        deviations = sorted(abs(v - median) for v in ordered)
+        sigma = max(MAD_SCALE * deviations[len(deviations) // 2], self.min_sigma)
+        return abs(hr - median) > self.threshold * sigma
+
+    def process(
+        self, timestamp: float, hr: float, sensor_contact: Optional[bool] = None
+    ) -> Optional[float]:
+        """
+        Filter a sample, return the heart rate to store or None if rejected.
+        """
+        if self.contact_gating and sensor_contact is False:
+            return self._reject("no_contact")
+        if not self.min_hr <= hr <= self.max_hr:
+            return self._reject("invalid")
+        outlier = self._is_outlier(hr)
+        # the window holds raw readings, so a lasting level change is
+        # accepted once it makes up the majority of the window
+        if self._recent.maxlen:
+            self._recent.append(hr)
+        if outlier:
+            return self._reject("outlier")
+        last = self._last
+        if last is not None and timestamp - last > self.max_gap:
+            self._gaps.append(Gap(last, timestamp, self._reason or "dropout"))
+        if last is None or timestamp > last:
+            self._last = timestamp
+        self._reason = None
+        self.accepted += 1
+        return hr
+
+    def gaps(self, start: float, end: float) -> List[Gap]:
+        """
+        The gaps overlapping the given time range, including the current one
+        when nothing was accepted for more than max_gap seconds before end.
+        """
+        result = [g for g in self._gaps if g.start < end and g.end > start]
+        last = self._last
+        if last is not None and end - last > self.max_gap and last < end:
+            result.append(Gap(last, None, self._reason or "dropout"))
+        return result
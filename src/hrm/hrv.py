@@ -0,0 +1,172 @@
+from collections import deque
+from typing import List, Optional
+
+# successive RR differences above this many milliseconds count for pNN50
+NN50_THRESHOLD = 50.0
+# frequency bands (Hz) of the short-term HRV power spectrum
+LF_BAND = (0.04, 0.15)
+HF_BAND = (0.15, 0.4)
+# the RR tachogram is resampled at this rate (Hz) for the spectrum
+RESAMPLE_RATE = 4.0
+# Welch segment length in resampled points, 64 seconds at 4 Hz
+WELCH_SEGMENT = 256
+# shortest recording (seconds) giving a meaningful LF estimate
+MIN_SPECTRUM_DURATION = 60.0
+
+
+class HrvWindow:
+    """
+    Time-domain HRV over the RR intervals (ms) of the last `span` seconds.
+
+    The window keeps running sums of the intervals, of their squares, of the
+    squared successive differences and the count of successive differences
+    above 50 ms, updated as intervals are pushed and evicted, so RMSSD, SDNN
+    and pNN50 are O(1) reads. It can be attached to a TsDB to be fed on
+    every insert.
+    """
+
+    def __init__(self, span: float = 300.0):
+        if span <= 0:
+            raise ValueError("Window span must be greater than 0")
+        self.span = span
+        self._samples = deque()
+        self._sum = 0.0
+        self._sumsq = 0.0
+        self._diffsq = 0.0
+        self._nn50 = 0
+
+    def push(self, timestamp: float, rr: float):
+        """
+        Add an RR interval to the window. Intervals older than the newest one
+        already in the window are ignored.
+        """
+        samples = self._samples
+        if samples:
+            last_ts, last_rr = samples[-1]
+            if timestamp < last_ts:
+                return
+            diff = rr - last_rr
+            self._diffsq += diff * diff
+            self._nn50 += abs(diff) > NN50_THRESHOLD
+        samples.append((timestamp, rr))
+        self._sum += rr
+        self._sumsq += rr * rr
+        self.evict(timestamp)
+
+    def evict(self, now: float):
+        """
+        Drop the intervals older than now - span.
+        """
+        cutoff = now - self.span
+        samples = self._samples
+        while samples and samples[0][0] < cutoff:
+            _, rr = samples.popleft()
+            self._sum -= rr
+            self._sumsq -= rr * rr
+            if samples:
+                diff = samples[0][1] - rr
+                self._diffsq -= diff * diff
+                self._nn50 -= abs(diff) > NN50_THRESHOLD
+        if len(samples) < 2:
+            # avoid carrying float rounding drift into the next session
+            self._diffsq = 0.0
+            self._nn50 = 0
+            if not samples:
+                self._sum = self._sumsq = 0.0
+
+    def clear(self):
+        self._samples.clear()
+        self._sum = self._sumsq = self._diffsq = 0.0
+        self._nn50 = 0
+
+    def count(self, now: Optional[float] = None) -> int:
+        if now is not None:
+            self.evict(now)
+        return len(self._samples)
+
+    def rmssd(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Root mean square of the successive differences (ms), None with less
+        than 2 intervals.
+        """
+        n = self.count(now)
+        if n < 2:
+            return None
+        return (max(self._diffsq, 0.0) / (n - 1)) ** 0.5
+
+    def sdnn(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Sample standard deviation of the intervals (ms), None with less than
+        2 intervals.
+        """
+        n = self.count(now)
+        if n < 2:
+            return None
+        variance = (self._sumsq - self._sum * self._sum / n) / (n - 1)
+        return max(variance, 0.0) ** 0.5
+
+    def pnn50(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Percentage of successive differences above 50 ms, None with less than
+        2 intervals.
+        """
+        n = self.count(now)
+        if n < 2:
+            return None
+        return 100.0 * self._nn50 / (n - 1)
+
+    def mean(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Mean interval (ms), None if the window is empty.
+        """
+        n = self.count(now)
+        return self._sum / n if n else None
+
+
+def welch_psd(x, fs: float, segment: int = WELCH_SEGMENT):
+    """
+    Welch power spectral density of an evenly sampled signal: Hann windowed
+    segments overlapping by half, detrended by their mean, all transformed in
+    one vectorized FFT and averaged. Returns (frequencies, one-sided PSD).
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    segment = min(segment, len(x))
+    step = max(segment // 2, 1)
+    segments = np.lib.stride_tricks.sliding_window_view(x, segment)[::step]
+    segments = segments - segments.mean(axis=1, keepdims=True)
+    window = np.hanning(segment)
+    spectrum = np.fft.rfft(segments * window, axis=1)
+    psd = (spectrum.real**2 + spectrum.imag**2).mean(axis=0)
+    psd /= fs * (window * window).sum()
+    # one-sided spectrum, the DC and Nyquist bins have no mirror
+    psd[1 : segment // 2 + (segment % 2)] *= 2
+    return np.fft.rfftfreq(segment, 1 / fs), psd
+
+
+def frequency_domain(
+    times: List[float], rr_intervals: List[float], fs: float = RESAMPLE_RATE
+) -> Optional[dict]:
+    """
+    LF and HF power (ms²) and the LF/HF ratio of RR intervals (ms) ending at
+    the given beat times (s). The tachogram is linearly resampled at fs and
+    its Welch spectrum integrated over the bands. None when the recording is
+    shorter than MIN_SPECTRUM_DURATION.
+    """
+    if len(times) < 3 or times[-1] - times[0] < MIN_SPECTRUM_DURATION:
+        return None
+    # numpy is only imported when a spectrum is computed, to keep the startup fast
+    import numpy as np
+
+    t = np.asarray(times, dtype=float)
+    grid = np.arange(t[0], t[-1], 1 / fs)
+    freqs, psd = welch_psd(np.interp(grid, t, rr_intervals), fs)
+    df = freqs[1] - freqs[0]
+
+    def band_power(band):
+        low, high = band
+        return float(psd[(freqs >= low) & (freqs < high)].sum() * df)
+
+    lf, hf = band_power(LF_BAND), band_power(HF_BAND)
+    return {"lf": lf, "hf": hf, "lf_hf": lf / hf if hf > 0 else None}
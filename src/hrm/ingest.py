@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+# a batch of (arrival timestamp, raw payload) notifications
+Batch = List[tuple[float, bytes]]
+
+
+class NotificationBuffer:
+    """
+    Ingestion stage between the BLE notification callback and the storage.
+
+    `put` only timestamps the payload and appends it to a queue, which keeps
+    the callback path cheap. The queued notifications are handed to `handler`
+    in batches, either by the `run` task every `interval` seconds or by an
+    explicit `drain`, e.g. before answering a query.
+    """
+
+    def __init__(self, handler: Callable[[Batch], None], interval: float = 0.2):
+        self.handler = handler
+        self.interval = interval
+        # deque appends and pops are thread safe, so put can be called from
+        # the BLE backend thread while the event loop drains
+        self._queue = deque()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, sender, data: bytearray):
+        """
+        Notification callback, queue the payload with its arrival time.
+        """
+        self._queue.append((time.time(), bytes(data)))
+
+    def drain(self) -> int:
+        """
+        Hand all the queued notifications to the handler, return the batch size.
+        """
+        queue = self._queue
+        batch = []
+        while queue:
+            batch.append(queue.popleft())
+        if batch:
+            self.handler(batch)
+        return len(batch)
+
+    async def run(self):
+        """
+        Drain the queue every interval seconds until cancelled.
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                try:
+                    self.drain()
+                except Exception:
+                    logger.exception("Failed to process heart rate notifications")
+        finally:
+            self.drain()
@@ -0,0 +1,91 @@
+import asyncio
+from collections import deque
+from typing import Optional
+
+
+class Subscription:
+    """
+    Bounded queue of the live updates of one subscriber.
+
+    When a slow consumer lets `maxsize` updates pile up, the oldest pending
+    update is dropped for the new one, so the consumer never falls further
+    behind and always gets the latest reading. Dropped updates are counted in
+    `coalesced`.
+    """
+
+    def __init__(self, feed: "LiveFeed", maxsize: int = 8):
+        if maxsize <= 0:
+            raise ValueError("Max size must be greater than 0")
+        self.feed = feed
+        self.coalesced = 0
+        self.closed = False
+        self._queue = deque(maxlen=maxsize)
+        self._event = asyncio.Event()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, update: dict):
+        """
+        Queue an update, dropping the oldest pending one when the queue is full.
+        """
+        if len(self._queue) == self._queue.maxlen:
+            self.coalesced += 1
+        self._queue.append(update)
+        self._event.set()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """
+        Wait for the next update, return None on timeout or once closed.
+        """
+        while not self._queue:
+            if self.closed:
+                return None
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._queue.popleft()
+
+    def close(self):
+        """
+        Stop receiving updates, a pending get returns None.
+        """
+        self.closed = True
+        self.feed.unsubscribe(self)
+        self._event.set()
+
+
+class LiveFeed:
+    """
+    Fan-out of the live updates of one device to its subscribers.
+
+    The ingestion path publishes one update per committed batch. Each
+    subscriber has its own bounded queue, so a slow subscriber never blocks
+    the ingestion or the other subscribers.
+    """
+
+    def __init__(self):
+        self._subscribers: set[Subscription] = set()
+        # the last published update, served to the readers of the live resource
+        self.latest: Optional[dict] = None
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def subscribe(self, maxsize: int = 8) -> Subscription:
+        subscription = Subscription(self, maxsize)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, update: dict):
+        """
+        Record the update as the latest and queue it to every subscriber.
+        """
+        self.latest = update
+        for subscription in self._subscribers:
+            subscription.push(update)
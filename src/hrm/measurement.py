@@ -0,0 +1,114 @@
+import struct
+from typing import NamedTuple, Optional
+
+# Heart Rate Measurement (0x2A37) flags
+FLAG_HR_UINT16 = 0x01
+FLAG_SENSOR_CONTACT_DETECTED = 0x02
+FLAG_SENSOR_CONTACT_SUPPORTED = 0x04
+FLAG_ENERGY_EXPENDED = 0x08
+FLAG_RR_INTERVAL = 0x10
+
+# RR intervals are transmitted in 1/1024 second units
+RR_INTERVAL_RESOLUTION = 1024
+
+_UINT16 = struct.Struct("<H")
+
+
+class HeartRateMeasurement(NamedTuple):
+    """
+    A decoded Heart Rate Measurement notification.
+
+    sensor_contact is None when the sensor does not support contact detection,
+    energy_expended (kJ) is None when the field is not present, and
+    rr_intervals are in milliseconds, oldest first.
+    """
+
+    heart_rate: int
+    sensor_contact: Optional[bool] = None
+    energy_expended: Optional[int] = None
+    rr_intervals: tuple[float, ...] = ()
+
+
+def decode_measurement(data) -> HeartRateMeasurement:
+    """
+    Decode every field of a Heart Rate Measurement payload.
+
+    The payload is read through a memoryview without copying it. A trailing
+    odd byte of the RR interval list is ignored, a payload too short for the
+    flagged fields raises ValueError.
+    """
+    view = memoryview(data)
+    try:
+        flags = view[0]
+        index = 1
+        if flags & FLAG_HR_UINT16:
+            heart_rate = _UINT16.unpack_from(view, index)[0]
+            index += 2
+        else:
+            heart_rate = view[index]
+            index += 1
+
+        sensor_contact = None
+        if flags & FLAG_SENSOR_CONTACT_SUPPORTED:
+            sensor_contact = bool(flags & FLAG_SENSOR_CONTACT_DETECTED)
+
+        energy_expended = None
+        if flags & FLAG_ENERGY_EXPENDED:
+            energy_expended = _UINT16.unpack_from(view, index)[0]
+            index += 2
+    except (IndexError, struct.error) as e:
+        raise ValueError(f"Truncated heart rate measurement: {bytes(data)!r}") from e
+
+    rr_intervals = ()
+    if flags & FLAG_RR_INTERVAL:
+        count = (len(view) - index) // 2
+        raw = struct.unpack_from(f"<{count}H", view, index)
+        rr_intervals = tuple(rr * 1000 / RR_INTERVAL_RESOLUTION for rr in raw)
+
+    return HeartRateMeasurement(
+        heart_rate, sensor_contact, energy_expended, rr_intervals
+    )
+
+
+def encode_measurement(
+    measurement: HeartRateMeasurement, uint16: bool = False
+) -> bytes:
+    """
+    Encode a Heart Rate Measurement payload, the inverse of decode_measurement.
+
+    The heart rate is sent as uint16 when uint16 is set or it doesn't fit in a
+    byte. RR intervals are rounded to the 1/1024 second resolution.
+    """
+    flags = 0
+    heart_rate = measurement.heart_rate
+    uint16 = uint16 or heart_rate > 0xFF
+    payload = bytearray(_UINT16.pack(heart_rate) if uint16 else bytes([heart_rate]))
+    if uint16:
+        flags |= FLAG_HR_UINT16
+    if measurement.sensor_contact is not None:
+        flags |= FLAG_SENSOR_CONTACT_SUPPORTED
+        if measurement.sensor_contact:
+            flags |= FLAG_SENSOR_CONTACT_DETECTED
+    if measurement.energy_expended is not None:
+        flags |= FLAG_ENERGY_EXPENDED
+        payload += _UINT16.pack(measurement.energy_expended)
+    if measurement.rr_intervals:
+        flags |= FLAG_RR_INTERVAL
+        for rr in measurement.rr_intervals:
+            payload += _UINT16.pack(round(rr * RR_INTERVAL_RESOLUTION / 1000))
+    return bytes([flags]) + payload
+
+
+def rr_timestamps(timestamp: float, rr_intervals: tuple[float, ...]) -> list[float]:
+    """
+    Assign a timestamp to each RR interval of a notification received at the
+    given timestamp: the last beat is taken to end at the arrival time and
+    every earlier one ends one interval before the next.
+    """
+    result = []
+    ts = timestamp
+    for rr in reversed(rr_intervals):
+        result.append(ts)
+        ts -= rr / 1000
+    result.reverse()
+    return result
@@ -0,0 +1,356 @@
+"""
+Instrumentation of the server itself: tool latency histograms, event loop
+lag, and the per-device ingestion counters, as a JSON snapshot or in the
+Prometheus text exposition format.
+"""
+
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the latency histogram buckets, plus +Inf
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# the event loop lag is sampled every interval seconds
+LOOP_LAG_INTERVAL = 0.5
+# the metrics file is rewritten every interval seconds
+METRICS_DUMP_INTERVAL = 15.0
+# notification intervals longer than this (seconds) are dropouts, not jitter
+MAX_ARRIVAL_INTERVAL = 5.0
+# smoothing factor of the inter-arrival mean and jitter, as in RFC 3550
+ARRIVAL_GAIN = 1 / 16
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, observe is a bisect and an increment.
+    Quantiles are estimated by the upper bound of their bucket.
+    """
+
+    def __init__(self, bounds: Iterable[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        # the last bucket is +Inf
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        The upper bound of the bucket of the q quantile, at most the max
+        observed value. None when nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        """
+        Count, mean, estimated p50/p95/p99 and max, in milliseconds.
+        """
+
+        def ms(value):
+            return round(value * 1000, 3) if value is not None else None
+
+        return {
+            "count": self.count,
+            "mean_ms": ms(self.sum / self.count) if self.count else None,
+            "p50_ms": ms(self.quantile(0.5)),
+            "p95_ms": ms(self.quantile(0.95)),
+            "p99_ms": ms(self.quantile(0.99)),
+            "max_ms": ms(self.max) if self.count else None,
+        }
+
+
+class ArrivalStats:
+    """
+    Notification rate and inter-arrival jitter of a device, smoothed means of
+    the interval between two notifications and of its deviation.
+    """
+
+    def __init__(self, max_interval: float = MAX_ARRIVAL_INTERVAL):
+        self.max_interval = max_interval
+        self.clear()
+
+    def clear(self):
+        self._last: Optional[float] = None
+        self.interval: Optional[float] = None
+        self.jitter = 0.0
+
+    def observe(self, timestamps: Iterable[float]):
+        """
+        Account the arrival times of a batch of notifications.
+        """
+        last, interval, jitter = self._last, self.interval, self.jitter
+        max_interval, gain = self.max_interval, ARRIVAL_GAIN
+        for ts in timestamps:
+            if last is not None:
+                dt = ts - last
+                if 0 <= dt <= max_interval:
+                    if interval is None:
+                        interval = dt
+                    else:
+                        jitter += gain * (abs(dt - interval) - jitter)
+                        interval += gain * (dt - interval)
+            last = ts
+        self._last, self.interval, self.jitter = last, interval, jitter
+
+    @property
+    def rate(self) -> Optional[float]:
+        """Notifications per second, None before two notifications."""
+        if not self.interval:
+            return None
+        return 1 / self.interval
+
+
+class LoopLagMonitor:
+    """
+    Samples the event loop lag: how late a sleep of `interval` seconds wakes up.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.histogram = Histogram()
+        self.last: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last = max(loop.time() - expected, 0.0)
+            self.histogram.observe(self.last)
+
+    def summary(self) -> dict:
+        summary = self.histogram.summary()
+        summary["last_ms"] = (
+            round(self.last * 1000, 3) if self.last is not None else None
+        )
+        return summary
+
+
+class Metrics:
+    """
+    Registry of the server metrics.
+
+    Tools are timed by wrapping them with `timed`. The device counters are
+    not copied on the hot path, `devices` is called when a snapshot is taken
+    and returns the counters of every device by device id.
+    When dump_path is set, the Prometheus text is written to it every
+    dump_interval seconds, e.g. for the node exporter textfile collector.
+    """
+
+    def __init__(
+        self,
+        devices: Optional[Callable[[], dict]] = None,
+        dump_path: Optional[str] = None,
+        dump_interval: float = METRICS_DUMP_INTERVAL,
+    ):
+        self.devices = devices or dict
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.started = time.time()
+        self.tools: dict[str, Histogram] = {}
+        self.tool_errors: dict[str, int] = {}
+        self.loop_lag = LoopLagMonitor()
+        self._dump_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """
+        Start the event loop lag sampling and the file dump on the running
+        loop, if not already running. No-op outside of an event loop.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        monitor = self.loop_lag
+        if not _running(monitor.task, loop):
+            monitor.task = loop.create_task(monitor.run())
+        if self.dump_path and not _running(self._dump_task, loop):
+            self._dump_task = loop.create_task(self._dump_loop())
+
+    def observe_tool(self, name: str, seconds: float, failed: bool = False):
+        histogram = self.tools.get(name)
+        if histogram is None:
+            histogram = self.tools[name] = Histogram()
+            self.tool_errors[name] = 0
+        histogram.observe(seconds)
+        if failed:
+            self.tool_errors[name] += 1
+
+    def timed(self, fn: Callable) -> Callable:
+        """
+        Decorator recording the latency of every call of the tool fn.
+        """
+        name = fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                self.start()
+                t0 = time.perf_counter()
+                failed = True
+                try:
+                    result = await fn(*args, **kwargs)
+                    failed = False
+                    return result
+                finally:
+                    self.observe_tool(name, time.perf_counter() - t0, failed)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            self.start()
+            t0 = time.perf_counter()
+            failed = True
+            try:
+                result = fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                self.observe_tool(name, time.perf_counter() - t0, failed)
+
+        return wrapper
+
+    def snapshot(self) -> dict:
+        return {
+            "uptime": round(time.time() - self.started, 3),
+            "tools": {
+                name: {**h.summary(), "errors": self.tool_errors[name]}
+                for name, h in sorted(self.tools.items())
+            },
+            "event_loop_lag": self.loop_lag.summary(),
+            "devices": self.devices(),
+        }
+
+    def prometheus(self) -> str:
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def header(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, h, labels=""):
+            sep = "," if labels else ""
+            seen = 0
+            for bound, count in zip(h.bounds, h.counts):
+                seen += count
+                lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} {seen}')
+            lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {h.count}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {h.sum}")
+            lines.append(f"{name}_count{suffix} {h.count}")
+
+        header("hrm_uptime_seconds", "gauge", "Seconds since the server started.")
+        lines.append(f"hrm_uptime_seconds {time.time() - self.started}")
+
+        header("hrm_tool_duration_seconds", "histogram", "Latency of the MCP tools.")
+        for name, h in sorted(self.tools.items()):
+            histogram("hrm_tool_duration_seconds", h, f'tool="{name}"')
+        header("hrm_tool_errors_total", "counter", "Tool calls that raised.")
+        for name, errors in sorted(self.tool_errors.items()):
+            lines.append(f'hrm_tool_errors_total{{tool="{name}"}} {errors}')
+
+        header("hrm_event_loop_lag_seconds", "histogram", "Event loop lag.")
+        histogram("hrm_event_loop_lag_seconds", self.loop_lag.histogram)
+
+        devices = self.devices()
+        for key, kind, help_text in DEVICE_METRICS:
+            name = f"hrm_device_{key}"
+            header(name, kind, help_text)
+            for device_id, counters in devices.items():
+                value = counters.get(key)
+                if value is None:
+                    continue
+                labels = f'device="{_escape(device_id)}"'
+                if isinstance(value, dict):
+                    for reason, count in value.items():
+                        lines.append(f'{name}{{{labels},reason="{reason}"}} {count}')
+                else:
+                    lines.append(f"{name}{{{labels}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: Optional[str] = None):
+        """
+        Write the Prometheus text to path, atomically.
+        """
+        path = path or self.dump_path
+        text = self.prometheus()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    async def _dump_loop(self):
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            try:
+                self.dump()
+            except OSError:
+                logger.exception(f"Failed to write the metrics to {self.dump_path}")
+
+
+# the per-device counters exported to Prometheus: key, type and help
+DEVICE_METRICS = (
+    ("notifications_total", "counter", "Notifications received."),
+    ("notification_rate", "gauge", "Notifications per second."),
+    ("jitter_seconds", "gauge", "Inter-arrival jitter of the notifications."),
+    ("malformed_total", "counter", "Malformed notifications dropped."),
+    ("accepted_total", "counter", "Heart rate samples stored."),
+    ("rejected_total", "counter", "Heart rate samples rejected by the filter."),
+    ("queued", "gauge", "Notifications waiting to be committed."),
+    ("db_size", "gauge", "Heart rate samples in memory."),
+    ("db_capacity", "gauge", "Heart rate samples kept in memory at most."),
+    ("db_evictions_total", "counter", "Heart rate samples evicted from memory."),
+    ("rr_db_size", "gauge", "RR intervals in memory."),
+    ("rr_db_evictions_total", "counter", "RR intervals evicted from memory."),
+)
+
+
+def _running(task: Optional[asyncio.Task], loop) -> bool:
+    return task is not None and not task.done() and task.get_loop() is loop
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
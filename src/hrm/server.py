@@ -1,12 +1,23 @@
-from fastmcp import FastMCP
+from contextlib import asynccontextmanager
+
+from fastmcp import Context, FastMCP
 from fastmcp.resources import FunctionResource
 
 from hrm.bt_client import BtClient
 
+
+@asynccontextmanager
+async def lifespan(server):
+    # sample the event loop lag, and dump the metrics file, while serving
+    cli.metrics.start()
+    yield {}
+
+
 mcp = FastMCP(
     name="Bluetooth HRM MCP Server",
     instructions="""MCP server for Bluetooth Heart Rate Monitor. Provides tools and resources for HRM data, evaluation, and statistics results.
 """,
+    lifespan=lifespan,
 )
 
 
@@ -21,17 +32,33 @@ mcp.add_resource(
     )
 )
 
+@mcp.resource("hrm://live/{device_id}")
+def live_heart_rate(device_id: str) -> dict:
+    """The latest live heart rate update of the device, a resource updated notification
+    is sent for it while the device is watched with watch_heart_rate."""
+    return cli.get_live_heart_rate(device_id)
+
 # Wrap the methods as proper tools
 @mcp.tool()
-async def list_bluetooth_devices() -> dict[str, dict]:
+@cli.metrics.timed
+async def list_bluetooth_devices(refresh: bool = False, timeout: float | None = None) -> dict[str, dict]:
     """Discover Bluetooth devices and filter by HRM profile. Returns a dic, key is the device id,
-    value is a dict of device name and rssi."""
-    return await cli.list_bluetooth_devices()
+    value is a dict of device name, rssi and last seen timestamp.
+
+    Devices are answered from the cache of a background scanner, only the first call waits for a scan.
+
+    Args:
+        refresh: bool, wait for a fresh scan and drop the devices not seen during it, default False
+        timeout: float, the scan duration in seconds when a scan is needed, default 5 seconds
+    """
+    return await cli.list_bluetooth_devices(refresh, timeout)
 
 @mcp.tool()
+@cli.metrics.timed
 async def monitoring_heart_rate(device_id: str, duration: int = 30 * 60):
     """Monitor the heart rate of the device for the given duration, default duration is 1800 seconds (30 minutes).
-    The monitoring will be done in the background.
+    The monitoring will be done in the background, several devices can be monitored at once.
+    If the device drops, it is reconnected with backoff until the end of the duration.
 
     Args:
         device_id: str, the device UUID to monitor
@@ -40,55 +67,319 @@ async def monitoring_heart_rate(device_id: str, duration: int = 30 * 60):
     return await cli.monitoring_heart_rate(device_id, duration)
 
 @mcp.tool()
-async def get_heart_rate() -> dict:
+@cli.metrics.timed
+def get_monitoring_status(device_id: str | None = None) -> dict:
+    """Get the monitoring status of the device: its connection state, the reconnections after
+    dropouts, the samples received and the age of the last packet.
+
+    Args:
+        device_id: str, the device to read, default is the most recently monitored device
+
+    Returns:
+        dict, state is one of connecting, connected, reconnecting, stopped or failed, e.g.
+        {
+            "device_id": str,
+            "state": str,
+            "error": str | None,
+            "reconnects": int,
+            "connected_for": float | None,
+            "monitoring_until": float | None,
+            "samples_received": int,
+            "samples_accepted": int,
+            "last_packet_age": float | None
+        }
+    """
+    return cli.get_monitoring_status(device_id)
+
+@mcp.tool()
+@cli.metrics.timed
+async def get_heart_rate(device_id: str | None = None) -> dict:
     """Get the current HR, use last 10 sec and return the average of HR.
 
+    Args:
+        device_id: str, the device to read, default is the most recently monitored device
+
     Returns:
         dict, the average of HR in the 10 seconds since start_time, e.g.
         {
             "avg_hr": int
         }
     """
-    return await cli.get_heart_rate()
+    return await cli.get_heart_rate(device_id)
 
 @mcp.tool()
-def evaluate_active_heart_rate() -> dict:
+@cli.metrics.timed
+def evaluate_active_heart_rate(device_id: str | None = None) -> dict:
     """Evaluate the active heart rate by the max heart rate of last min.
 
+    Args:
+        device_id: str, the device to read, default is the most recently monitored device
+
     Returns:
         dict, the max heart rate of last min, e.g.
         {
             "max_hr": int
         }
     """
-    return cli.evaluate_active_heart_rate()
+    return cli.evaluate_active_heart_rate(device_id)
 
 @mcp.tool()
-def get_heart_rate_bucket(since_from: float = 10.0, bucket_size: float = 1.0) -> list[dict]:
+@cli.metrics.timed
+def get_heart_rate_bucket(
+    since_from: float = 10.0,
+    bucket_size: float = 1.0,
+    device_id: str | None = None,
+    compact: bool = False,
+    max_points: int | None = None,
+) -> list[dict] | dict:
     """Get the heart rate bucket of the given since_from time in seconds and bucket_size in seconds.
+    Use compact and max_points to keep the response small for long ranges.
 
     Args:
         since_from: float, the start time of the monitoring, default 10 seconds ago
         bucket_size: float, the size of the bucket, default 1.0
+        device_id: str, the device to read, default is the most recently monitored device
+        compact: bool, return the start time, the bucket size and a flat list of values, default False
+        max_points: int, optional, the max number of buckets, the bucket size is increased to a
+            round size (1, 2, 5, 10, 15, 30 s, 1, 2, 5, 10, 15, 30 min, hours) to fit
 
     Returns:
-        list[dict], the heart rate bucket, e.g.
+        list[dict], the heart rate bucket, value is null for a bucket without data, e.g.
         [
             {
                 "time": float,
-                "value": int,
+                "value": int | None,
             }
         ]
+        or with compact, the time of the value i is start + i * step, e.g.
+        {
+            "start": float,
+            "step": float,
+            "values": list[int | None]
+        }
+    """
+    return cli.get_heart_rate_bucket(since_from, bucket_size, device_id, compact, max_points)
+
+@mcp.tool()
+@cli.metrics.timed
+def get_heart_rate_gaps(since_from: float = 600.0, device_id: str | None = None) -> dict:
+    """Get the gaps of the heart rate data since the given number of seconds, the spans without
+    valid samples, and the counts of the samples rejected by the artifact filter.
+
+    Args:
+        since_from: float, how many seconds ago to start, default 600 seconds (10 minutes)
+        device_id: str, the device to read, default is the most recently monitored device
+
+    Returns:
+        dict, the gaps, end is null for an ongoing gap, reason is one of no_contact, invalid,
+        outlier or dropout, e.g.
+        {
+            "gaps": [{"start": float, "end": float | None, "reason": str}],
+            "accepted": int,
+            "rejected": {"no_contact": int, "invalid": int, "outlier": int}
+        }
+    """
+    return cli.get_heart_rate_gaps(since_from, device_id)
+
+@mcp.tool()
+@cli.metrics.timed
+def get_hrv(device_id: str | None = None) -> dict:
+    """Get the time-domain heart rate variability of the RR intervals of the last 5 minutes.
+
+    Args:
+        device_id: str, the device to read, default is the most recently monitored device
+
+    Returns:
+        dict, RMSSD and SDNN in ms and pNN50 in percent, null with less than 2 RR intervals, e.g.
+        {
+            "rmssd": float | None,
+            "sdnn": float | None,
+            "pnn50": float | None,
+            "mean_rr": float | None,
+            "count": int
+        }
+    """
+    return cli.get_hrv(device_id)
+
+@mcp.tool()
+@cli.metrics.timed
+def get_hrv_frequency(since_from: float = 300.0, device_id: str | None = None) -> dict:
+    """Get the frequency-domain heart rate variability of the RR intervals since the given
+    number of seconds: the LF (0.04-0.15 Hz) and HF (0.15-0.4 Hz) power and the LF/HF ratio.
+
+    Args:
+        since_from: float, how many seconds ago to start, default 300 seconds (5 minutes), at least 60
+        device_id: str, the device to read, default is the most recently monitored device
+
+    Returns:
+        dict, LF and HF power in ms², null with less than 60 seconds of RR intervals, e.g.
+        {
+            "lf": float | None,
+            "hf": float | None,
+            "lf_hf": float | None
+        }
+    """
+    return cli.get_hrv_frequency(since_from, device_id)
+
+@mcp.tool()
+@cli.metrics.timed
+def get_session_summary(device_id: str | None = None) -> dict:
+    """Get the summary of the current monitoring session: time in each heart rate zone,
+    training load (Banister TRIMP) and an estimate of the calories burned.
+    The aggregates are updated as samples arrive, so the summary doesn't rescan the session.
+
+    Args:
+        device_id: str, the device to read, default is the most recently monitored device
+
+    Returns:
+        dict, the session aggregates and the profile they are computed with, e.g.
+        {
+            "started": float | None,
+            "duration": float,
+            "active_seconds": float,
+            "samples": int,
+            "avg_hr": float | None,
+            "max_hr": int | None,
+            "zones": [{"zone": int, "min_hr": int, "seconds": float}],
+            "trimp": float,
+            "calories": float,
+            "profile": dict
+        }
     """
-    return cli.get_heart_rate_bucket(since_from, bucket_size)
+    return cli.get_session_summary(device_id)
 
 @mcp.tool()
-def build_heart_rate_chart(since_from: float = 600.0) -> str:
+@cli.metrics.timed
+def configure_heart_rate_zones(
+    max_hr: float | None = None,
+    resting_hr: float | None = None,
+    zones: list[float] | None = None,
+    basis: str | None = None,
+    age: float | None = None,
+    weight: float | None = None,
+    sex: str | None = None,
+    device_id: str | None = None,
+) -> dict:
+    """Configure the heart rate zones and the profile used by the session summary, unset
+    fields keep their current value. The current session is recomputed with the new profile.
+
+    Args:
+        max_hr: float, the max heart rate, default 220 - age
+        resting_hr: float, the resting heart rate, default 60
+        zones: list[float], the increasing lower bounds of the zones as fractions, default [0.5, 0.6, 0.7, 0.8, 0.9]
+        basis: str, "max" for fractions of max_hr, "reserve" for fractions of max_hr - resting_hr, default "max"
+        age: float, the age in years, default 30
+        weight: float, the weight in kg, default 70
+        sex: str, "male" or "female", selects the TRIMP and calorie formulas, default "male"
+        device_id: str, the device to configure, default is the most recently monitored device
+
+    Returns:
+        dict, the profile in use
+    """
+    return cli.configure_heart_rate_zones(max_hr, resting_hr, zones, basis, age, weight, sex, device_id)
+
+@mcp.tool()
+@cli.metrics.timed
+async def build_heart_rate_chart(since_from: float = 600.0, device_id: str | None = None) -> str:
     """
     Build a heart rate plot chart using heart rate bucket data (bucket size 1s) and overlay the average heart rate line.
     Args:
         since_from: float, how many seconds ago to start (default 600s = 10min)
+        device_id: str, the device to chart, default is the most recently monitored device
     Returns:
         str: The URL of the chart image (PNG)
     """
-    return cli.build_heart_rate_chart(since_from)
+    return await cli.build_heart_rate_chart(since_from, device_id)
+
+@mcp.tool()
+@cli.metrics.timed
+async def export_heart_rate(
+    since_from: float = 3600.0,
+    bucket_size: float | None = None,
+    format: str = "csv",
+    series: str = "hr",
+    device_id: str | None = None,
+) -> dict:
+    """Export the heart rate history since the given number of seconds to a file, the raw
+    samples or the bucket stats, instead of returning the data inline. The file is written
+    in chunks in a worker thread, then uploaded when an upload backend is configured.
+
+    Args:
+        since_from: float, how many seconds ago to start, default 3600 seconds (1 hour)
+        bucket_size: float, the bucket size in seconds, default None exports the raw samples
+        format: str, "csv", "npy" (NumPy structured array), "parquet" or "arrow" (these two need pyarrow), default "csv"
+        series: str, "hr" for the heart rate (bpm) or "rr" for the RR intervals (ms), default "hr"
+        device_id: str, the device to export, default is the most recently monitored device
+
+    Returns:
+        dict, the columns are time and value for the raw samples, time, count, mean, min and
+        max for the buckets, url is null without upload backend, e.g.
+        {
+            "path": str,
+            "url": str | None,
+            "format": str,
+            "columns": list[str],
+            "rows": int,
+            "bytes": int,
+            "start": float,
+            "end": float
+        }
+    """
+    return await cli.export_heart_rate(since_from, bucket_size, format, series, device_id)
+
+@mcp.tool()
+@cli.metrics.timed
+async def watch_heart_rate(device_id: str | None = None, duration: float = 60.0, ctx: Context = None) -> dict:
+    """Watch the live heart rate of the device for the given duration, instead of polling get_heart_rate.
+    Every update is pushed as a resource updated notification of hrm://live/{device_id} and a progress
+    notification, read the resource to get the latest update.
+
+    Args:
+        device_id: str, the device to watch, default is the most recently monitored device
+        duration: float, how long to watch in seconds, default 60 seconds
+
+    Returns:
+        dict, the number of updates received and coalesced, and the latest update, e.g.
+        {
+            "updates": int,
+            "coalesced": int,
+            "latest": dict
+        }
+    """
+    count = 0
+
+    async def notify(update: dict):
+        nonlocal count
+        count += 1
+        if ctx is None:
+            return
+        await ctx.session.send_resource_updated(f"hrm://live/{update['device_id']}")
+        await ctx.report_progress(count)
+
+    return await cli.watch_heart_rate(device_id, duration, notify)
+
+@mcp.tool()
+@cli.metrics.timed
+def server_metrics(format: str = "json") -> dict | str:
+    """Get the metrics of the server itself: the latency of the tools, the event loop lag
+    and, for every device, the notification rate and jitter, the dropped and filtered
+    samples and the size and evictions of its in-memory series.
+
+    Args:
+        format: str, "json" for a dict or "prometheus" for the Prometheus text format, default "json"
+
+    Returns:
+        dict, latencies in ms, or str with the prometheus format, e.g.
+        {
+            "uptime": float,
+            "tools": {"get_heart_rate": {"count": int, "mean_ms": float, "p50_ms": float,
+                "p95_ms": float, "p99_ms": float, "max_ms": float, "errors": int}},
+            "event_loop_lag": {"count": int, "mean_ms": float, ..., "last_ms": float},
+            "devices": {"<device_id>": {"state": str, "notifications_total": int,
+                "notification_rate": float, "jitter_seconds": float, "malformed_total": int,
+                "accepted_total": int, "rejected_total": dict, "queued": int, "db_size": int,
+                "db_capacity": int, "db_evictions_total": int, "rr_db_size": int,
+                "rr_db_evictions_total": int}}
+        }
+    """
+    return cli.server_metrics(format)
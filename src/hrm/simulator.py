@@ -0,0 +1,381 @@
+"""
+Simulated BLE heart rate straps, standing in for BleakClient and BleakScanner,
+and a load generator running BtClient against hundreds of them.
+
+Run the load generator with e.g.
+
+    python -m hrm.simulator --devices 200 --duration 60
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import time
+from types import SimpleNamespace
+from typing import Callable, NamedTuple, Optional
+
+from bleak.exc import BleakError
+
+from hrm.discovery import HEART_RATE_SERVICE_UUID
+from hrm.measurement import HeartRateMeasurement, encode_measurement
+
+logger = logging.getLogger(__name__)
+
+# the simulated straps are named SIM-0000, SIM-0001, ...
+ADDRESS_PREFIX = "SIM-"
+
+
+class StrapProfile(NamedTuple):
+    """
+    Behaviour of a simulated strap.
+
+    rate is the number of notifications per second. contact_loss and dropout
+    are the probabilities per notification to lose the skin contact for
+    contact_loss_duration seconds (0 bpm readings) or to disconnect and be
+    unreachable for dropout_duration seconds. energy_interval is the number of
+    notifications between two energy expended fields, 0 for none.
+    """
+
+    rate: float = 1.0
+    resting_hr: float = 65.0
+    max_hr: float = 185.0
+    uint16: bool = False
+    rr_intervals: bool = True
+    contact_supported: bool = True
+    contact_loss: float = 0.0
+    contact_loss_duration: float = 5.0
+    dropout: float = 0.0
+    dropout_duration: float = 3.0
+    energy_interval: int = 10
+
+
+class VirtualStrap:
+    """
+    State of one simulated strap: a mean-reverting heart rate random walk
+    towards a target changing like interval training, the beats behind the
+    RR intervals, the skin contact and the reachability.
+    """
+
+    def __init__(self, address: str, profile: StrapProfile, seed=None):
+        self.address = address
+        self.name = f"Simulated HRM {address[len(ADDRESS_PREFIX):]}"
+        self.profile = profile
+        self.random = random.Random(seed)
+        self.heart_rate = profile.resting_hr
+        self.target = profile.resting_hr
+        self.energy = 0.0
+        self.notifications = 0
+        self._phase = 0.0
+        self._contact_lost_until = 0.0
+        self.unreachable_until = 0.0
+
+    def step(self, dt: float) -> HeartRateMeasurement:
+        """
+        Advance the strap by dt seconds and return its next measurement.
+        """
+        profile, rnd = self.profile, self.random
+        now = time.monotonic()
+        self.notifications += 1
+        if rnd.random() < dt / 60:
+            # a new effort, or a recovery, about once a minute
+            self.target = rnd.uniform(profile.resting_hr, profile.max_hr)
+        self.heart_rate += 0.1 * (self.target - self.heart_rate) * dt
+        self.heart_rate += rnd.gauss(0, 1.5) * math.sqrt(dt)
+        self.heart_rate = min(max(self.heart_rate, 35.0), 230.0)
+        self.energy += self.heart_rate * 0.01 * dt
+
+        if now >= self._contact_lost_until and rnd.random() < profile.contact_loss:
+            self._contact_lost_until = now + profile.contact_loss_duration
+        if now < self._contact_lost_until:
+            self._phase = 0.0
+            return HeartRateMeasurement(0, False if profile.contact_supported else None)
+
+        rr_intervals = ()
+        self._phase += dt * self.heart_rate / 60
+        beats = int(self._phase)
+        self._phase -= beats
+        if profile.rr_intervals and beats:
+            mean_rr = 60000 / self.heart_rate
+            rr_intervals = tuple(
+                mean_rr * (1 + rnd.gauss(0, 0.03)) for _ in range(min(beats, 9))
+            )
+        energy = None
+        if (
+            profile.energy_interval
+            and self.notifications % profile.energy_interval == 0
+        ):
+            energy = min(int(self.energy), 0xFFFF)
+        return HeartRateMeasurement(
+            round(self.heart_rate),
+            True if profile.contact_supported else None,
+            energy,
+            rr_intervals,
+        )
+
+    def drops(self) -> bool:
+        """
+        Whether the strap disconnects now, it is then unreachable for a while.
+        """
+        if self.random.random() < self.profile.dropout:
+            self.unreachable_until = time.monotonic() + self.profile.dropout_duration
+            return True
+        return False
+
+
+class SimulatedClient:
+    """
+    Stands in for BleakClient, connected to a strap of the simulator.
+    """
+
+    def __init__(
+        self,
+        simulator: "Simulator",
+        address: str,
+        disconnected_callback: Optional[Callable] = None,
+    ):
+        self.simulator = simulator
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self._connected = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def connect(self):
+        strap = self.simulator.straps.get(self.address)
+        if strap is None or time.monotonic() < strap.unreachable_until:
+            raise BleakError(f"Device with address {self.address} was not found")
+        await asyncio.sleep(0)
+        self._connected = True
+        return True
+
+    async def disconnect(self):
+        self._stop()
+        self._connected = False
+        return True
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    async def start_notify(self, char_specifier, callback: Callable):
+        if not self._connected:
+            raise BleakError("Not connected")
+        self._stop()
+        self._task = asyncio.create_task(self._notify(char_specifier, callback))
+
+    async def stop_notify(self, char_specifier):
+        self._stop()
+
+    def _stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _notify(self, char_specifier, callback: Callable):
+        strap = self.simulator.straps[self.address]
+        interval = 1 / strap.profile.rate
+        # straps don't notify in lockstep
+        await asyncio.sleep(strap.random.uniform(0, interval))
+        while True:
+            await asyncio.sleep(interval)
+            if strap.drops():
+                self._task = None
+                self._connected = False
+                if self.disconnected_callback is not None:
+                    self.disconnected_callback(self)
+                return
+            payload = encode_measurement(strap.step(interval), strap.profile.uint16)
+            self.simulator.notifications += 1
+            callback(char_specifier, bytearray(payload))
+
+
+class SimulatedScanner:
+    """
+    Stands in for BleakScanner, advertises the straps of the simulator every
+    `interval` seconds while started.
+    """
+
+    def __init__(
+        self,
+        simulator: "Simulator",
+        detection_callback: Optional[Callable] = None,
+        service_uuids=None,
+        interval: float = 1.0,
+    ):
+        self.simulator = simulator
+        self.detection_callback = detection_callback
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def advertise(self):
+        if self.detection_callback is None:
+            return
+        for strap in self.simulator.straps.values():
+            device = SimpleNamespace(address=strap.address, name=strap.name)
+            adv_data = SimpleNamespace(
+                service_uuids=[HEART_RATE_SERVICE_UUID],
+                rssi=strap.random.randint(-90, -40),
+            )
+            self.detection_callback(device, adv_data)
+
+    async def _run(self):
+        while True:
+            self.advertise()
+            await asyncio.sleep(self.interval)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class Simulator:
+    """
+    A set of simulated straps, with BleakClient and BleakScanner compatible
+    factories bound to it: `client` and `scanner`.
+    """
+
+    def __init__(
+        self,
+        devices: int = 1,
+        profile: StrapProfile = StrapProfile(),
+        seed: Optional[int] = None,
+    ):
+        rnd = random.Random(seed)
+        self.straps = {}
+        for i in range(devices):
+            address = f"{ADDRESS_PREFIX}{i:04d}"
+            self.straps[address] = VirtualStrap(address, profile, rnd.random())
+        # payloads emitted by all the straps
+        self.notifications = 0
+
+    def client(
+        self, address: str, disconnected_callback: Optional[Callable] = None, **kwargs
+    ) -> SimulatedClient:
+        return SimulatedClient(self, address, disconnected_callback)
+
+    def scanner(
+        self,
+        detection_callback: Optional[Callable] = None,
+        service_uuids=None,
+        **kwargs,
+    ) -> SimulatedScanner:
+        return SimulatedScanner(self, detection_callback, service_uuids)
+
+
+def _percentiles(latencies: list[float]) -> dict:
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+
+    def pick(q):
+        return round(ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "p50_ms": pick(0.5),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+    }
+
+
+async def run_load(
+    devices: int = 100,
+    duration: float = 30.0,
+    profile: StrapProfile = StrapProfile(),
+    query_interval: float = 0.05,
+    seed: Optional[int] = None,
+) -> dict:
+    """
+    Monitor the given number of simulated straps with a BtClient for duration
+    seconds, while a client calls the query tools on random devices every
+    query_interval seconds. Return the ingestion counters and the tool
+    latency percentiles.
+    """
+    from hrm.bt_client import BtClient
+
+    simulator = Simulator(devices, profile, seed)
+    client = BtClient(simulator=simulator)
+    addresses = list(simulator.straps)
+    for address in addresses:
+        await client.monitoring_heart_rate(address, math.ceil(duration))
+
+    rnd = random.Random(seed)
+    tools = {
+        "get_heart_rate": lambda d: client.get_heart_rate(d),
+        "get_heart_rate_bucket": lambda d: client.get_heart_rate_bucket(60.0, 1.0, d),
+        "evaluate_active_heart_rate": client.evaluate_active_heart_rate,
+        "get_session_summary": client.get_session_summary,
+        "get_hrv": client.get_hrv,
+    }
+    latencies = {name: [] for name in tools}
+    started = time.monotonic()
+    while time.monotonic() - started < duration:
+        await asyncio.sleep(query_interval)
+        address = rnd.choice(addresses)
+        for name, tool in tools.items():
+            t0 = time.perf_counter()
+            result = tool(address)
+            if asyncio.iscoroutine(result):
+                await result
+            latencies[name].append(time.perf_counter() - t0)
+    await asyncio.gather(
+        *(s.task for s in client.sessions.values() if s.task is not None)
+    )
+    elapsed = time.monotonic() - started
+    sessions = client.sessions.values()
+    return {
+        "devices": devices,
+        "duration": round(elapsed, 3),
+        "rate": profile.rate,
+        "notifications": simulator.notifications,
+        "notifications_per_second": round(simulator.notifications / elapsed, 1),
+        "samples_received": sum(s.samples_received for s in sessions),
+        "samples_stored": sum(len(s.db) for s in sessions),
+        "rr_intervals_stored": sum(len(s.rr_db) for s in sessions),
+        "reconnects": sum(s.reconnects for s in sessions),
+        "tools": {name: _percentiles(values) for name, values in latencies.items()},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Load test the HRM ingestion and tools with simulated straps."
+    )
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--rate", type=float, default=1.0, help="notifications/s")
+    parser.add_argument("--uint16", action="store_true", help="16-bit heart rates")
+    parser.add_argument("--contact-loss", type=float, default=0.0)
+    parser.add_argument("--dropout", type=float, default=0.0)
+    parser.add_argument("--query-interval", type=float, default=0.05)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args(argv)
+    logging.getLogger("hrm").setLevel(logging.WARNING)
+    profile = StrapProfile(
+        rate=args.rate,
+        uint16=args.uint16,
+        contact_loss=args.contact_loss,
+        dropout=args.dropout,
+    )
+    result = asyncio.run(
+        run_load(args.devices, args.duration, profile, args.query_interval, args.seed)
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,443 @@
+import math
 import time
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import deque
-from typing import List
+from typing import Iterator, List, NamedTuple, Optional
 
+from hrm.ts_store import SegmentStore
 
-class TsDB:
+# rows allocated when a ring is created, the arrays then double up to maxlen
+RING_INITIAL_CAPACITY = 1024
+
+
+class Bucket(NamedTuple):
+    """
+    Aggregates of one time bucket, mean/min/max are None for an empty bucket.
+    """
+
+    time: float
+    count: int
+    mean: Optional[float]
+    min: Optional[float]
+    max: Optional[float]
+
+
+class SlidingWindow:
+    """
+    Running aggregates over the samples of the last `span` seconds.
+
+    The window is fed on every TsDB insert, keeps a running sum for the mean
+    and monotonic deques for the max and min, so every read is amortized O(1).
+    """
+
+    def __init__(self, span: float):
+        if span <= 0:
+            raise ValueError("Window span must be greater than 0")
+        self.span = span
+        self._samples = deque()
+        self._sum = 0.0
+        # values are decreasing in _maxq and increasing in _minq
+        self._maxq = deque()
+        self._minq = deque()
+
+    def push(self, timestamp: float, value: float):
+        """
+        Add a sample to the window. Samples older than the newest one already
+        in the window are ignored, they only live in the raw buffer.
+        """
+        if self._samples and timestamp < self._samples[-1][0]:
+            return
+        self._samples.append((timestamp, value))
+        self._sum += value
+        while self._maxq and self._maxq[-1][1] <= value:
+            self._maxq.pop()
+        self._maxq.append((timestamp, value))
+        while self._minq and self._minq[-1][1] >= value:
+            self._minq.pop()
+        self._minq.append((timestamp, value))
+        self.evict(timestamp)
+
+    def evict(self, now: float):
+        """
+        Drop the samples older than now - span.
+        """
+        cutoff = now - self.span
+        samples = self._samples
+        while samples and samples[0][0] < cutoff:
+            self._sum -= samples.popleft()[1]
+        if not samples:
+            # avoid carrying float rounding drift into the next session
+            self._sum = 0.0
+        while self._maxq and self._maxq[0][0] < cutoff:
+            self._maxq.popleft()
+        while self._minq and self._minq[0][0] < cutoff:
+            self._minq.popleft()
+
+    def clear(self):
+        self._samples.clear()
+        self._sum = 0.0
+        self._maxq.clear()
+        self._minq.clear()
+
+    def count(self, now: Optional[float] = None) -> int:
+        if now is not None:
+            self.evict(now)
+        return len(self._samples)
+
+    def mean(self, now: Optional[float] = None) -> float:
+        """
+        Average value in the window ending at now, 0 if the window is empty.
+        """
+        if now is not None:
+            self.evict(now)
+        if not self._samples:
+            return 0
+        return self._sum / len(self._samples)
+
+    def max(self, now: Optional[float] = None):
+        """
+        Max value in the window ending at now, None if the window is empty.
+        """
+        if now is not None:
+            self.evict(now)
+        return self._maxq[0][1] if self._maxq else None
+
+    def min(self, now: Optional[float] = None):
+        """
+        Min value in the window ending at now, None if the window is empty.
+        """
+        if now is not None:
+            self.evict(now)
+        return self._minq[0][1] if self._minq else None
+
+
+class _Ring:
+    """
+    Bookkeeping shared by the ring buffers: a timestamp column kept in
+    ascending order, plus the head/size of the stored rows.
+
+    The columns start small and double as rows are added, up to maxlen. The
+    ring only wraps once full, so while it grows the rows are at [0, size).
+    """
+
+    # names of the typed array attributes holding one item per row
+    _columns = ("_ts",)
+
+    def __init__(self, maxlen: int):
+        if maxlen <= 0:
+            raise ValueError("Max length must be greater than 0")
+        self.maxlen = maxlen
+        self._capacity = min(maxlen, RING_INITIAL_CAPACITY)
+        self._ts = array("d", [0.0]) * self._capacity
+        # physical index of the oldest row and number of stored rows
+        self._head = 0
+        self._size = 0
+        # rows overwritten by newer ones since the creation
+        self.evictions = 0
+
+    def __len__(self):
+        return self._size
+
+    def first(self) -> Optional[float]:
+        """
+        The timestamp of the oldest row, None if empty.
+        """
+        return self._ts[self._head] if self._size else None
+
+    def _phys(self, i: int) -> int:
+        return (self._head + i) % self.maxlen
+
+    def _segments(self):
+        """
+        The physical (lo, hi) ranges of the ring buffer in logical order.
+        """
+        end = self._head + self._size
+        if end <= self.maxlen:
+            return [(self._head, end)]
+        return [(self._head, self.maxlen), (0, end - self.maxlen)]
+
+    def _bisect(self, timestamp: float, right: bool = False) -> int:
+        """
+        Return the logical index where timestamp would be inserted.
+        """
+        bisect = bisect_right if right else bisect_left
+        offset = 0
+        for lo, hi in self._segments():
+            if lo == hi:
+                continue
+            last = self._ts[hi - 1]
+            if timestamp < last or (not right and timestamp == last):
+                return offset + bisect(self._ts, timestamp, lo, hi) - lo
+            offset += hi - lo
+        return offset
+
+    def _ranges(self, i: int, j: int):
+        """
+        The physical (lo, hi) ranges of the logical indexes i (inclusive) to j (exclusive).
+        """
+        if i >= j:
+            return []
+        lo, hi = self._phys(i), self._phys(j - 1) + 1
+        if lo < hi:
+            return [(lo, hi)]
+        return [(lo, self.maxlen), (0, hi)]
+
+    def _tail(self) -> int:
+        """
+        The physical slot of the next row, when full this is the oldest row.
+        """
+        if self._size == self._capacity < self.maxlen:
+            self._grow()
+        return self._phys(self._size)
+
+    def _grow(self):
+        """
+        Double the capacity of the columns, up to maxlen.
+        """
+        capacity = min(self._capacity * 2, self.maxlen)
+        for name in self._columns:
+            column = getattr(self, name)
+            column.extend(array(column.typecode, [0]) * (capacity - self._capacity))
+        self._capacity = capacity
+
+    def _commit(self):
+        """
+        Account for a row written into the tail slot.
+        """
+        if self._size == self.maxlen:
+            self._head = (self._head + 1) % self.maxlen
+            self.evictions += 1
+        else:
+            self._size += 1
+
+    def clear(self):
+        self._head = 0
+        self._size = 0
+
+
+class Rollup(_Ring):
+    """
+    Downsampled tier of a TsDB: count, sum, min and max of fixed-width time
+    buckets aligned to multiples of `resolution`, updated on every insert.
+
+    A tier keeps its own ring of `maxlen` buckets, so its history outlives the
+    raw samples.
+    """
+
+    _columns = ("_ts", "_count", "_sum", "_min", "_max")
+
+    def __init__(self, resolution: float, maxlen: int):
+        if resolution <= 0:
+            raise ValueError("Rollup resolution must be greater than 0")
+        super().__init__(maxlen)
+        self.resolution = resolution
+        self._count = array("L", [0]) * self._capacity
+        self._sum = array("d", [0.0]) * self._capacity
+        self._min = array("d", [0.0]) * self._capacity
+        self._max = array("d", [0.0]) * self._capacity
+
+    def bucket_start(self, timestamp: float) -> float:
+        return math.floor(timestamp / self.resolution) * self.resolution
+
+    def aligned(self, value: float) -> bool:
+        """
+        Whether value is a whole multiple of the resolution.
+        """
+        ratio = value / self.resolution
+        return abs(ratio - round(ratio)) < 1e-9
+
+    def push(self, timestamp: float, value: float):
+        key = self.bucket_start(timestamp)
+        if self._size:
+            p = self._phys(self._size - 1)
+            if key < self._ts[p]:
+                # out of order sample, only update a bucket that still exists
+                i = self._bisect(key)
+                if i == self._size or self._ts[self._phys(i)] != key:
+                    return
+                p = self._phys(i)
+            if key == self._ts[p]:
+                self._count[p] += 1
+                self._sum[p] += value
+                if value < self._min[p]:
+                    self._min[p] = value
+                if value > self._max[p]:
+                    self._max[p] = value
+                return
+        p = self._tail()
+        self._ts[p] = key
+        self._count[p] = 1
+        self._sum[p] = self._min[p] = self._max[p] = value
+        self._commit()
+
+    def rows(self, start: float, end: float):
+        """
+        Iterate (bucket start, count, sum, min, max) of the buckets starting
+        from the given start timestamp (inclusive) to the given end timestamp (exclusive).
+        """
+        for lo, hi in self._ranges(self._bisect(start), self._bisect(end)):
+            yield from zip(
+                self._ts[lo:hi],
+                self._count[lo:hi],
+                self._sum[lo:hi],
+                self._min[lo:hi],
+                self._max[lo:hi],
+            )
+
+    def columns(self, start: float, end: float) -> List[tuple[array, ...]]:
+        """
+        Copies of the (bucket start, count, sum, min, max) columns of the buckets
+        starting from the given start timestamp (inclusive) to the given end
+        timestamp (exclusive), one tuple of arrays per contiguous range.
+        """
+        return [
+            tuple(getattr(self, name)[lo:hi] for name in self._columns)
+            for lo, hi in self._ranges(self._bisect(start), self._bisect(end))
+        ]
+
+
+# (resolution in seconds, number of buckets) of the default rollup tiers:
+# 1 s for 6 hours, 10 s for a day, 1 min for a week and 10 min for 30 days
+DEFAULT_ROLLUPS = ((1, 6 * 3600), (10, 24 * 360), (60, 7 * 24 * 60), (600, 30 * 144))
+
+
+class TsDB(_Ring):
     """
     A class for storing time-series data in memory.
+
+    Samples are kept in timestamp order in a fixed-size ring buffer, so range
+    lookups are a binary search over the buffer instead of a full scan. The
+    buffer is columnar: timestamps and values live in two typed arrays, which
+    costs 8 bytes per timestamp plus the value item size. The arrays grow with
+    the samples, an idle database takes little memory whatever its maxlen.
+
+    Every insert also feeds the rollup tiers, which bucket queries use when
+    the requested bucket size and start are aligned to a tier.
+
+    With a SegmentStore, every insert is also appended to disk. The in-memory
+    buffer is then a cache of the most recent samples: it is warmed from the
+    store on startup, and queries reaching past it are served by the store.
     """
 
-    def __init__(self, maxlen=50000):
+    _columns = ("_ts", "_vals")
+
+    def __init__(
+        self,
+        maxlen=50000,
+        value_type: str = "d",
+        rollups=DEFAULT_ROLLUPS,
+        store: Optional[SegmentStore] = None,
+    ):
         """
         Initialize the database with the given maximum length.
+
+        value_type is the array typecode of the values, e.g. "d" for floats or
+        "H" for unsigned 16-bit integers such as heart rate bpm.
+        rollups is a sequence of (resolution, number of buckets) tiers.
+        store is an optional SegmentStore persisting the samples.
         """
-        self.data = deque(maxlen=maxlen)
+        super().__init__(maxlen)
+        self.value_type = value_type
+        self._vals = array(value_type, [0]) * self._capacity
+        self._windows: list = []
+        self.rollups = [
+            Rollup(resolution, size) for resolution, size in sorted(rollups)
+        ]
+        # incremented on every change, reorder_version is the version of the
+        # last change that was not an in-order append (out of order insert, clear)
+        self.version = 0
+        self.reorder_version = 0
+        self.store = store
+        if store is not None:
+            # the store keeps the values as floats
+            cast = self._store_cast()
+            for ts, val in store.tail(maxlen):
+                self._append(ts, cast(val))
+
+    def _store_cast(self):
+        """
+        The conversion of the float values of the store to the value type.
+        """
+        return float if self.value_type in "fd" else int
+
+    @property
+    def data(self) -> List[tuple[float, float]]:
+        """
+        All stored samples as (timestamp, value) tuples, oldest first.
+        """
+        return self._slice(0, self._size)
+
+    def _iter(self, i: int, j: int) -> Iterator[tuple[float, float]]:
+        """
+        Iterate the samples between logical indexes i (inclusive) and j (exclusive).
+        """
+        for lo, hi in self._ranges(i, j):
+            yield from zip(self._ts[lo:hi], self._vals[lo:hi])
+
+    def _slice(self, i: int, j: int) -> List[tuple[float, float]]:
+        """
+        Return the samples between logical indexes i (inclusive) and j (exclusive).
+        """
+        return list(self._iter(i, j))
 
     def insert(self, timestamp: float, value: float):
         """
         Insert the data into the database.
         """
-        self.data.append((timestamp, value))
+        self._append(timestamp, value)
+        if self.store is not None:
+            self.store.append(timestamp, value)
+
+    def _append(self, timestamp: float, value: float):
+        tail = self._tail()
+        self._vals[tail] = value
+        self._ts[tail] = timestamp
+        self._commit()
+        for window in self._windows:
+            window.push(timestamp, value)
+        for rollup in self.rollups:
+            rollup.push(timestamp, value)
+        self.version += 1
+        if self._size > 1 and timestamp < self._ts[self._phys(self._size - 2)]:
+            # out of order sample (e.g. clock step), shift it into place
+            self._sift_back(self._size - 1)
+            self.reorder_version = self.version
+
+    def _sift_back(self, i: int):
+        p = self._phys(i)
+        ts, val = self._ts[p], self._vals[p]
+        while i > 0:
+            q = self._phys(i - 1)
+            if self._ts[q] <= ts:
+                break
+            self._ts[p], self._vals[p] = self._ts[q], self._vals[q]
+            p = q
+            i -= 1
+        self._ts[p], self._vals[p] = ts, val
+
+    def register_window(self, span: float) -> SlidingWindow:
+        """
+        Register a sliding window of the given span in seconds, which is kept
+        up to date on every insert. Windows with the same span are shared.
+        """
+        for window in self._windows:
+            if type(window) is SlidingWindow and window.span == span:
+                return window
+        return self.attach_window(SlidingWindow(span))
+
+    def attach_window(self, window):
+        """
+        Attach a window object fed on every insert, e.g. an HrvWindow. It needs
+        a `span` in seconds and `push(timestamp, value)` and `clear()` methods,
+        and is primed with the samples of the last span seconds.
+        """
+        latest = self.latest()
+        if latest is not None:
+            for ts, val in self.query(latest[0] - window.span, latest[0]):
+                window.push(ts, val)
+        self._windows.append(window)
+        return window
 
     def query(self, start: float, end: float):
         """
@@ -27,13 +446,65 @@ class TsDB:
         """
         if start >= end:
             raise ValueError("Start timestamp must be less than end timestamp")
-        return [(ts, val) for ts, val in self.data if start <= ts <= end]
+        return list(self._rows(start, end))
+
+    def _rows(self, start: float, end: float) -> Iterator[tuple[float, float]]:
+        """
+        Iterate the samples from the given start timestamp to the given end timestamp,
+        reading the store when the range starts before the in-memory buffer.
+        """
+        if self._from_store(start):
+            return iter(self.store.query(start, end))
+        return self._iter(self._bisect(start), self._bisect(end, right=True))
+
+    def _from_store(self, start: float) -> bool:
+        """
+        Whether a range from the given start timestamp is read from the store.
+        """
+        return self.store is not None and (
+            self._size == 0 or start < self._ts[self._head]
+        )
+
+    def count(self, start: float, end: float) -> int:
+        """
+        The number of samples from the given start timestamp to the given end
+        timestamp (inclusive), as returned by chunks.
+        """
+        if self._from_store(start):
+            return self.store.count(start, end)
+        return max(self._bisect(end, right=True) - self._bisect(start), 0)
+
+    def chunks(
+        self, start: float, end: float, size: int = 1 << 16
+    ) -> Iterator[tuple[array, array]]:
+        """
+        The timestamps and values from the given start timestamp to the given end
+        timestamp (inclusive) as typed arrays of at most size rows, for bulk reads.
+
+        The in-memory rows are copied when called, the store is read lazily as
+        the chunks are consumed, so they can be consumed in a worker thread
+        while the event loop keeps inserting.
+        """
+        if self._from_store(start):
+            if self.value_type == "d":
+                return self.store.chunks(start, end, size)
+            cast = self._store_cast()
+            return (
+                (ts, array(self.value_type, map(cast, vals)))
+                for ts, vals in self.store.chunks(start, end, size)
+            )
+        chunks = []
+        for lo, hi in self._ranges(self._bisect(start), self._bisect(end, right=True)):
+            for i in range(lo, hi, size):
+                j = min(i + size, hi)
+                chunks.append((self._ts[i:j], self._vals[i:j]))
+        return iter(chunks)
 
     def avg(self, start: float, end: float):
         """
         Calculate the average value of the data from the given start timestamp to the given end timestamp.
         """
-        if len(self.data) == 0:
+        if self._size == 0:
             return 0
         values = [val for ts, val in self.query(start, end)]
         return sum(values) / len(values)
@@ -45,7 +516,10 @@ class TsDB:
     #     return [(ts, val) for ts, val in self.data if ts >= start]
 
     def latest(self):
-        return self.data[-1] if self.data else None
+        if self._size == 0:
+            return None
+        p = self._phys(self._size - 1)
+        return (self._ts[p], self._vals[p])
 
     def avg_from(self, start: float):
         """
@@ -55,32 +529,191 @@ class TsDB:
 
     def clear(self):
         """
-        Clear all data from the database.
+        Clear all data from the database. Samples already persisted to the
+        store are kept on disk.
         """
-        self.data.clear()
+        super().clear()
+        for window in self._windows:
+            window.clear()
+        for rollup in self.rollups:
+            rollup.clear()
+        self.version += 1
+        self.reorder_version = self.version
 
-    def time_bucket(
+    def unchanged_before(
+        self, version: int, latest: Optional[float], end: float
+    ) -> bool:
+        """
+        Whether the samples before the given end timestamp are still the ones
+        the database held at the given version, whose latest timestamp was latest.
+        In-order appends after that version only add samples at or after latest.
+        """
+        if self.version == version:
+            return True
+        return self.reorder_version <= version and latest is not None and latest >= end
+
+    def _pick_rollup(self, start: float, bucket_size: float) -> Optional[Rollup]:
+        """
+        The rollup tier to read for buckets of bucket_size from start: among the
+        tiers whose buckets fit exactly into the requested ones, the coarsest
+        reaching back to start, else the one reaching back the furthest.
+        """
+        best = None
+        for rollup in reversed(self.rollups):
+            if not (rollup.aligned(bucket_size) and rollup.aligned(start)):
+                continue
+            first = rollup.first()
+            if first is None:
+                continue
+            if first <= start:
+                return rollup
+            if best is None or first < best.first():
+                best = rollup
+        return best
+
+    def bucket_stats(
         self, start: float, end: float, bucket_size: float
-    ) -> List[tuple[float, float]]:
+    ) -> List[Bucket]:
         """
-        Bucket the data from the given start timestamp to the given end timestamp into the given time bucket size.
+        Bucket the data from the given start timestamp to the given end timestamp into the given time bucket size,
+        computing count, mean, min and max of every bucket in a single pass over the range.
+
+        When start and bucket_size are both multiples of a rollup resolution,
+        such a tier is read instead of the raw samples. A tier only holds its
+        last maxlen buckets: the head of the range before its oldest bucket is
+        read from the raw samples, or the store.
         """
         if bucket_size <= 0:
             raise ValueError("Bucket size must be greater than 0")
-        num_buckets = int((end - start) / bucket_size)
-        buckets = [[] for _ in range(num_buckets)]
-        data = self.query(start, end)
-        for ts, val in data:
-            index = int((ts - start) // bucket_size)
-            if 0 <= index < num_buckets:
-                buckets[index].append(val)
         result = []
-        time_bucket = start
-        for bucket in buckets:
-            if len(bucket) > 0:
-                result.append((time_bucket, sum(bucket) / len(bucket)))
-            else:
-                result.append((time_bucket, 0.0))
-            time_bucket += bucket_size
+        for chunk in self.bucket_chunks(start, end, bucket_size, size=0):
+            result.extend(chunk)
+        return result
+
+    def bucket_chunks(
+        self, start: float, end: float, bucket_size: float, size: int = 1 << 16
+    ) -> Iterator[List[Bucket]]:
+        """
+        The buckets of bucket_stats in lists of at most size buckets, all of them
+        in one list when size is 0.
+
+        The in-memory samples and rollup buckets of the range are copied when
+        called, the store is read lazily as the chunks are consumed, so they can
+        be consumed in a worker thread while the event loop keeps inserting.
+        """
+        if bucket_size <= 0:
+            raise ValueError("Bucket size must be greater than 0")
+        if start >= end:
+            raise ValueError("Start timestamp must be less than end timestamp")
+        # the tolerance keeps an end on a bucket boundary from losing a bucket
+        num_buckets = int((end - start) / bucket_size + 1e-9)
+        rollup = self._pick_rollup(start, bucket_size)
+        # the raw samples are read from start to split, the tier from split to end
+        split = end
+        if rollup is not None:
+            first = rollup.first()
+            split = start if first <= start else min(first, end)
+        # chunks includes the samples at split, they belong to the tier
+        raw = self.chunks(start, split) if split > start else iter(())
+        tier = rollup.columns(split, end) if split < end else []
+        stop = split if split < end else math.inf
+        return _aggregate(
+            start, bucket_size, num_buckets, size or num_buckets, raw, stop, tier
+        )
+
+    def time_bucket(
+        self, start: float, end: float, bucket_size: float
+    ) -> List[tuple[float, Optional[float]]]:
+        """
+        Bucket the data from the given start timestamp to the given end timestamp into the given time bucket size.
+        Returns (time, mean) pairs, the mean is None for a bucket without data.
+        """
+        return [(b.time, b.mean) for b in self.bucket_stats(start, end, bucket_size)]
 
+
+def _aggregate(
+    start: float,
+    bucket_size: float,
+    num_buckets: int,
+    size: int,
+    raw: Iterator[tuple[array, array]],
+    stop: float,
+    tier: List[tuple[array, ...]],
+) -> Iterator[List[Bucket]]:
+    """
+    Merge the raw samples before stop and the rollup buckets, both in time
+    order, into lists of at most size buckets from start.
+    """
+    first = 0
+    n = min(size, num_buckets)
+    counts, sums, mins, maxs = _empty_stats(n)
+
+    def buckets():
+        result = []
+        for index, count in enumerate(counts):
+            time_bucket = start + (first + index) * bucket_size
+            if count:
+                mean = sums[index] / count
+                result.append(
+                    Bucket(time_bucket, count, mean, mins[index], maxs[index])
+                )
+            else:
+                result.append(Bucket(time_bucket, 0, None, None, None))
         return result
+
+    done = False
+    for ts_column, vals_column in raw:
+        for ts, val in zip(ts_column, vals_column):
+            if ts >= stop:
+                done = True
+                break
+            index = int((ts - start) // bucket_size)
+            if not 0 <= index < num_buckets:
+                continue
+            while index >= first + n:
+                yield buckets()
+                first += n
+                n = min(size, num_buckets - first)
+                counts, sums, mins, maxs = _empty_stats(n)
+            index -= first
+            if counts[index]:
+                if val < mins[index]:
+                    mins[index] = val
+                elif val > maxs[index]:
+                    maxs[index] = val
+            else:
+                mins[index] = maxs[index] = val
+            counts[index] += 1
+            sums[index] += val
+        if done:
+            break
+    for columns in tier:
+        for ts, count, total, low, high in zip(*columns):
+            index = int((ts - start) // bucket_size)
+            if not 0 <= index < num_buckets:
+                continue
+            while index >= first + n:
+                yield buckets()
+                first += n
+                n = min(size, num_buckets - first)
+                counts, sums, mins, maxs = _empty_stats(n)
+            index -= first
+            if counts[index]:
+                mins[index] = min(mins[index], low)
+                maxs[index] = max(maxs[index], high)
+            else:
+                mins[index], maxs[index] = low, high
+            counts[index] += count
+            sums[index] += total
+    while first < num_buckets:
+        yield buckets()
+        first += n
+        n = min(size, num_buckets - first)
+        counts, sums, mins, maxs = _empty_stats(n)
+
+
+def _empty_stats(n: int) -> tuple[list, list, list, list]:
+    """
+    The counts, sums, mins and maxs of n empty buckets.
+    """
+    return [0] * n, [0.0] * n, [0.0] * n, [0.0] * n
@@ -0,0 +1,292 @@
+import mmap
+import os
+import struct
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from typing import Iterator, List
+
+# one (timestamp, value) record, little endian doubles
+RECORD = struct.Struct("<dd")
+
+SEGMENT_SUFFIX = ".seg"
+
+
+class _Segment:
+    """
+    Metadata of one segment file: its path, record count and the timestamps
+    of its first and last record.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self.first = 0.0
+        self.last = 0.0
+
+    def load(self):
+        """
+        Read the metadata from disk, dropping a partially written trailing record.
+        """
+        size = os.path.getsize(self.path)
+        if size % RECORD.size:
+            os.truncate(self.path, size - size % RECORD.size)
+        self.count = size // RECORD.size
+        if self.count:
+            with open(self.path, "rb") as f:
+                self.first = RECORD.unpack(f.read(RECORD.size))[0]
+                f.seek((self.count - 1) * RECORD.size)
+                self.last = RECORD.unpack(f.read(RECORD.size))[0]
+
+    @contextmanager
+    def _map(self, count: int):
+        """
+        Memory-map the first count records.
+        """
+        with (
+            open(self.path, "rb") as f,
+            mmap.mmap(f.fileno(), count * RECORD.size, access=mmap.ACCESS_READ) as mm,
+        ):
+            yield mm
+
+    @staticmethod
+    def _span(mm, start: float, end: float) -> tuple[int, int]:
+        """
+        The indexes (i, j) of the mapped records from the given start timestamp
+        to the given end timestamp (inclusive).
+        """
+        with memoryview(mm) as raw, raw.cast("d") as cols, cols[::2] as ts:
+            return bisect_left(ts, start), bisect_right(ts, end)
+
+    def _overlaps(self, count: int, start: float, end: float) -> bool:
+        return count > 0 and end >= self.first and start <= self.last
+
+    def read(self, start: float, end: float) -> List[tuple[float, float]]:
+        """
+        Return the records from the given start timestamp to the given end
+        timestamp (inclusive), binary searching the memory-mapped file.
+        """
+        if not self._overlaps(self.count, start, end):
+            return []
+        with self._map(self.count) as mm:
+            i, j = self._span(mm, start, end)
+            return list(RECORD.iter_unpack(mm[i * RECORD.size : j * RECORD.size]))
+
+    def span_count(self, start: float, end: float) -> int:
+        """
+        The number of records from the given start timestamp to the given end
+        timestamp (inclusive).
+        """
+        if not self._overlaps(self.count, start, end):
+            return 0
+        with self._map(self.count) as mm:
+            i, j = self._span(mm, start, end)
+        return j - i
+
+    def chunks(
+        self, start: float, end: float, size: int, count: int
+    ) -> Iterator[tuple[array, array]]:
+        """
+        Iterate the (timestamps, values) of the records from the given start
+        timestamp to the given end timestamp (inclusive) among the first count,
+        as arrays of at most size records.
+        """
+        if not self._overlaps(count, start, end):
+            return
+        with self._map(count) as mm:
+            i, j = self._span(mm, start, end)
+            for lo in range(i, j, size):
+                hi = min(lo + size, j)
+                records = array("d", mm[lo * RECORD.size : hi * RECORD.size])
+                yield records[::2], records[1::2]
+
+    def tail(self, n: int) -> List[tuple[float, float]]:
+        """
+        Return the last n records.
+        """
+        n = min(n, self.count)
+        if n <= 0:
+            return []
+        with open(self.path, "rb") as f:
+            f.seek((self.count - n) * RECORD.size)
+            return list(RECORD.iter_unpack(f.read(n * RECORD.size)))
+
+
+class SegmentStore:
+    """
+    Append-only on-disk storage for time-series samples.
+
+    Samples are fixed-width binary records appended to numbered segment files
+    in the given directory. Writes are buffered and flushed in batches, the
+    active segment is fsynced periodically, and range queries binary search
+    the memory-mapped segments, so nothing has to be loaded into RAM.
+    Records are expected to arrive in timestamp order.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        segment_records: int = 1 << 20,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+        fsync_interval: float = 10.0,
+    ):
+        """
+        Open (or create) the store in the given directory.
+
+        segment_records is the soft size limit of a segment file, in records.
+        Buffered records are written once batch_size of them are pending or
+        flush_interval seconds passed, and fsynced every fsync_interval seconds.
+        """
+        if segment_records <= 0:
+            raise ValueError("Segment records must be greater than 0")
+        self.path = path
+        self.segment_records = segment_records
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        os.makedirs(path, exist_ok=True)
+        self._segments: List[_Segment] = []
+        for name in sorted(os.listdir(path)):
+            if name.endswith(SEGMENT_SUFFIX):
+                segment = _Segment(os.path.join(path, name))
+                segment.load()
+                self._segments.append(segment)
+        self._file = None
+        self._buf = bytearray()
+        self._pending = 0
+        self._last_flush = time.monotonic()
+        self._last_sync = self._last_flush
+
+    def __len__(self):
+        return sum(s.count for s in self._segments) + self._pending
+
+    def append(self, timestamp: float, value: float):
+        """
+        Append a record, it is written to disk with the next batch.
+        """
+        self._buf += RECORD.pack(timestamp, value)
+        self._pending += 1
+        if (
+            self._pending >= self.batch_size
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def _active(self) -> _Segment:
+        """
+        The segment to append to, a new one is started when the last is full.
+        """
+        if not self._segments or self._segments[-1].count >= self.segment_records:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+            name = f"{len(self._segments):08d}{SEGMENT_SUFFIX}"
+            self._segments.append(_Segment(os.path.join(self.path, name)))
+        if self._file is None:
+            self._file = open(self._segments[-1].path, "ab")
+        return self._segments[-1]
+
+    def _sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+
+    def flush(self, sync: bool = False):
+        """
+        Write the buffered records to the active segment. The file is fsynced
+        when sync is set or fsync_interval seconds passed since the last fsync.
+        """
+        if self._pending:
+            segment = self._active()
+            self._file.write(self._buf)
+            self._file.flush()
+            if not segment.count:
+                segment.first = RECORD.unpack_from(self._buf)[0]
+            last_offset = len(self._buf) - RECORD.size
+            segment.last = RECORD.unpack_from(self._buf, last_offset)[0]
+            segment.count += self._pending
+            self._buf.clear()
+            self._pending = 0
+        self._last_flush = time.monotonic()
+        if sync or self._last_flush - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def close(self):
+        """
+        Flush and fsync the buffered records and close the active segment.
+        """
+        self.flush(sync=True)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def query(self, start: float, end: float) -> List[tuple[float, float]]:
+        """
+        Query the records from the given start timestamp to the given end timestamp.
+        """
+        if start >= end:
+            raise ValueError("Start timestamp must be less than end timestamp")
+        result = []
+        for segment in self._segments:
+            result.extend(segment.read(start, end))
+        result.extend(
+            (ts, val) for ts, val in RECORD.iter_unpack(self._buf) if start <= ts <= end
+        )
+        return result
+
+    def count(self, start: float, end: float) -> int:
+        """
+        The number of records from the given start timestamp to the given end
+        timestamp (inclusive).
+        """
+        total = sum(segment.span_count(start, end) for segment in self._segments)
+        total += sum(1 for ts, _ in RECORD.iter_unpack(self._buf) if start <= ts <= end)
+        return total
+
+    def chunks(
+        self, start: float, end: float, size: int = 1 << 16
+    ) -> Iterator[tuple[array, array]]:
+        """
+        The (timestamps, values) of the records from the given start timestamp
+        to the given end timestamp (inclusive), as arrays of at most size
+        records. Only the records stored when called are returned, and the
+        segments are read lazily as the chunks are consumed, so a long history
+        can be streamed from a worker thread while new records are appended.
+        """
+        segments = [(segment, segment.count) for segment in self._segments]
+        pending = array("d", self._buf)
+
+        def read():
+            for segment, count in segments:
+                yield from segment.chunks(start, end, size, count)
+            ts, vals = pending[::2], pending[1::2]
+            i, j = bisect_left(ts, start), bisect_right(ts, end)
+            if i < j:
+                yield ts[i:j], vals[i:j]
+
+        return read()
+
+    def tail(self, n: int) -> List[tuple[float, float]]:
+        """
+        Return the last n records, oldest first.
+        """
+        result = list(RECORD.iter_unpack(self._buf))[-n:] if n > 0 else []
+        for segment in reversed(self._segments):
+            if len(result) >= n:
+                break
+            result = segment.tail(n - len(result)) + result
+        return result
+
+    def first(self):
+        """
+        The timestamp of the oldest record, None if the store is empty.
+        """
+        for segment in self._segments:
+            if segment.count:
+                return segment.first
+        if self._pending:
+            return RECORD.unpack_from(self._buf)[0]
+        return None
@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+
+def chart_key(suffix: str = ".png") -> str:
+    """
+    A unique object key for a chart, prefixed with the current time.
+    """
+    return f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}{suffix}"
+
+
+class Uploader(ABC):
+    """
+    Backend publishing chart images and exports, so DeepChat can download them.
+    """
+
+    @abstractmethod
+    async def upload(
+        self, data: bytes, key: str, mime_type: str = "image/png"
+    ) -> Optional[str]:
+        """
+        Upload data under the given key, return its URL or None on failure.
+        """
+
+    async def upload_file(
+        self, path: str, key: str, mime_type: str = "application/octet-stream"
+    ) -> Optional[str]:
+        """
+        Upload the file at path under the given key, return its URL or None on
+        failure. By default the file is read in memory and uploaded as data.
+        """
+        data = await asyncio.to_thread(Path(path).read_bytes)
+        return await self.upload(data, key, mime_type)
+
+
+class QiniuUploader(Uploader):
+    """
+    Uploads to QINIU Storage from memory.
+
+    The auth object is built once and the upload token, scoped to the bucket
+    so it is valid for any new key, is reused until `token_margin` seconds
+    before it expires. qiniu keeps a pooled HTTP session across uploads. The
+    blocking upload runs in a thread, each attempt is bounded by the `timeout`
+    of the HTTP requests and failed attempts are retried up to `retries` times
+    with exponential backoff. An attempt is never abandoned while its thread
+    runs, so a retry can't duplicate an upload still in flight.
+    """
+
+    def __init__(
+        self,
+        access_key: str,
+        secret_key: str,
+        bucket: str,
+        domain: str,
+        timeout: float = 10.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        token_ttl: int = 3600,
+        token_margin: int = 60,
+    ):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.bucket = bucket
+        self.domain = domain.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.token_ttl = token_ttl
+        self.token_margin = token_margin
+        self._auth = None
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+
+    def _get_token(self) -> str:
+        now = time.monotonic()
+        if self._token is None or now >= self._token_expires:
+            if self._auth is None:
+                # qiniu is only imported when a chart is uploaded, to keep the startup fast
+                from qiniu import Auth, config
+
+                config.set_default(connection_timeout=self.timeout)
+                self._auth = Auth(self.access_key, self.secret_key)
+            self._token = self._auth.upload_token(self.bucket, None, self.token_ttl)
+            self._token_expires = now + self.token_ttl - self.token_margin
+        return self._token
+
+    def _put(self, data: bytes, key: str, mime_type: str):
+        from qiniu import put_data
+
+        return put_data(self._get_token(), key, data, mime_type=mime_type)
+
+    def _put_file(self, path: str, key: str, mime_type: str):
+        from qiniu import put_file
+
+        # large files are uploaded in blocks, without reading them in memory
+        return put_file(self._get_token(), key, path, mime_type=mime_type)
+
+    async def upload(
+        self, data: bytes, key: str, mime_type: str = "image/png"
+    ) -> Optional[str]:
+        return await self._upload(self._put, data, key, mime_type)
+
+    async def upload_file(
+        self, path: str, key: str, mime_type: str = "application/octet-stream"
+    ) -> Optional[str]:
+        return await self._upload(self._put_file, path, key, mime_type)
+
+    async def _upload(self, put: Callable, source, key: str, mime_type: str):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                # a timed out request returns an info asking for a retry
+                ret, info = await asyncio.to_thread(put, source, key, mime_type)
+            except Exception:
+                logger.exception(f"Upload of {key} failed")
+                continue
+            if ret is not None:
+                return f"{self.domain}/{key}"
+            logger.warning(f"Upload of {key} failed: {info}")
+            if getattr(info, "status_code", None) == 401:
+                # the token was rejected, mint a new one for the next attempt
+                self._token = None
+            elif info is not None and not info.need_retry():
+                break
+        return None
+
+
+class LocalDirUploader(Uploader):
+    """
+    Writes the charts and exports to a local directory, for offline use and tests.
+
+    The URL is base_url followed by the key when base_url is given, e.g. when
+    the directory is served over HTTP, otherwise the file:// URI of the file.
+    """
+
+    def __init__(self, path: str, base_url: Optional[str] = None):
+        self.path = Path(path)
+        self.base_url = base_url.rstrip("/") if base_url else None
+
+    def _write(self, data: bytes, key: str) -> Path:
+        self.path.mkdir(parents=True, exist_ok=True)
+        file = self.path / key
+        file.write_bytes(data)
+        return file
+
+    def _copy(self, path: str, key: str) -> Path:
+        self.path.mkdir(parents=True, exist_ok=True)
+        file = self.path / key
+        if not file.exists() or not file.samefile(path):
+            shutil.copyfile(path, file)
+        return file
+
+    def _url(self, file: Path, key: str) -> str:
+        if self.base_url:
+            return f"{self.base_url}/{key}"
+        return file.resolve().as_uri()
+
+    async def upload(
+        self, data: bytes, key: str, mime_type: str = "image/png"
+    ) -> Optional[str]:
+        try:
+            file = await asyncio.to_thread(self._write, data, key)
+        except OSError:
+            logger.exception(f"Failed to write {key} to {self.path}")
+            return None
+        return self._url(file, key)
+
+    async def upload_file(
+        self, path: str, key: str, mime_type: str = "application/octet-stream"
+    ) -> Optional[str]:
+        try:
+            file = await asyncio.to_thread(self._copy, path, key)
+        except OSError:
+            logger.exception(f"Failed to copy {path} to {self.path}")
+            return None
+        return self._url(file, key)
+
+
+def uploader_from_env() -> Optional[Uploader]:
+    """
+    Build the uploader configured by the environment: QINIU Storage when all
+    the QINIU keys are defined, else a local directory when HRM_UPLOAD_DIR is
+    set, else None and charts are not uploaded.
+    """
+    load_dotenv()
+    qiniu_keys = [
+        os.getenv("QINIU_ACCESS_KEY"),
+        os.getenv("QINIU_SECRET_KEY"),
+        os.getenv("QINIU_BUCKET_NAME"),
+        os.getenv("QINIU_BUCKET_DOMAIN"),
+    ]
+    if all(qiniu_keys):
+        return QiniuUploader(*qiniu_keys)
+    upload_dir = os.getenv("HRM_UPLOAD_DIR")
+    if upload_dir:
+        return LocalDirUploader(upload_dir)
+    logger.warning("QINIU keys are not defined. Charts will not be uploaded.")
+    return None
@@ -0,0 +1,151 @@
+import math
+from bisect import bisect_right
+from typing import Iterable, Optional
+
+# lower bounds of the training zones 1 to 5, as fractions of the max heart
+# rate ("max" basis) or of the heart rate reserve ("reserve" basis, Karvonen)
+DEFAULT_ZONES = (0.5, 0.6, 0.7, 0.8, 0.9)
+# a gap between two samples longer than this (seconds) is a dropout, not exercise
+MAX_SAMPLE_GAP = 5.0
+
+# Banister TRIMP weighting factors (a, b) of a * exp(b * HR reserve ratio)
+TRIMP_FACTORS = {"male": (0.64, 1.92), "female": (0.86, 1.67)}
+# Keytel et al. (2005) energy expenditure, kJ/min = c + hr * HR + w * kg + a * age
+CALORIE_FACTORS = {
+    "male": (-55.0969, 0.6309, 0.1988, 0.2017),
+    "female": (-20.4022, 0.4472, -0.1263, 0.074),
+}
+KJ_PER_KCAL = 4.184
+
+
+class WorkloadTracker:
+    """
+    Training aggregates of a monitoring session: time in zone, Banister TRIMP
+    and a calorie estimate.
+
+    Every sample is accounted for on insert, the interval since the previous
+    sample is credited to the previous heart rate, so the summary is an O(1)
+    read. Intervals longer than max_gap are treated as dropouts and skipped.
+    """
+
+    def __init__(
+        self,
+        max_hr: Optional[float] = None,
+        resting_hr: float = 60.0,
+        zones: Iterable[float] = DEFAULT_ZONES,
+        basis: str = "max",
+        age: float = 30.0,
+        weight: float = 70.0,
+        sex: str = "male",
+        max_gap: float = MAX_SAMPLE_GAP,
+    ):
+        """
+        max_hr defaults to 220 - age. zones are the increasing lower bounds of
+        the zones as fractions of max_hr, or of the heart rate reserve
+        (max_hr - resting_hr) with the "reserve" basis. weight is in kg, sex
+        selects the TRIMP and calorie formulas ("male" or "female").
+        """
+        zones = tuple(zones)
+        if basis not in ("max", "reserve"):
+            raise ValueError(f"Unsupported zone basis: {basis}")
+        if sex not in TRIMP_FACTORS:
+            raise ValueError(f"Unsupported sex: {sex}")
+        if list(zones) != sorted(zones) or not zones:
+            raise ValueError("Zones must be increasing fractions")
+        self.max_hr_explicit = max_hr is not None
+        self.max_hr = max_hr if max_hr is not None else 220 - age
+        self.resting_hr = resting_hr
+        if self.max_hr <= resting_hr:
+            raise ValueError("Max heart rate must be greater than resting heart rate")
+        self.zones = zones
+        self.basis = basis
+        self.age = age
+        self.weight = weight
+        self.sex = sex
+        self.max_gap = max_gap
+        if basis == "max":
+            self.thresholds = [f * self.max_hr for f in zones]
+        else:
+            reserve = self.max_hr - resting_hr
+            self.thresholds = [resting_hr + f * reserve for f in zones]
+        self.clear()
+
+    def clear(self):
+        self.started: Optional[float] = None
+        self._last: Optional[tuple[float, float]] = None
+        self.count = 0
+        self._sum = 0.0
+        self.peak: Optional[float] = None
+        self.active = 0.0
+        # seconds below zone 1, then in zones 1 to n
+        self.zone_seconds = [0.0] * (len(self.zones) + 1)
+        self.trimp = 0.0
+        self.calories = 0.0
+
+    def zone(self, hr: float) -> int:
+        """
+        The zone of the heart rate, 0 below the first zone.
+        """
+        return bisect_right(self.thresholds, hr)
+
+    def push(self, timestamp: float, hr: float):
+        """
+        Account a sample. Samples older than the previous one are ignored.
+        """
+        last = self._last
+        if last is not None:
+            if timestamp < last[0]:
+                return
+            dt = timestamp - last[0]
+            if dt <= self.max_gap:
+                self._credit(last[1], dt)
+        else:
+            self.started = timestamp
+        self._last = (timestamp, hr)
+        self.count += 1
+        self._sum += hr
+        if self.peak is None or hr > self.peak:
+            self.peak = hr
+
+    def _credit(self, hr: float, dt: float):
+        self.active += dt
+        self.zone_seconds[self.zone(hr)] += dt
+        minutes = dt / 60
+        ratio = (hr - self.resting_hr) / (self.max_hr - self.resting_hr)
+        ratio = min(max(ratio, 0.0), 1.0)
+        a, b = TRIMP_FACTORS[self.sex]
+        self.trimp += minutes * ratio * a * math.exp(b * ratio)
+        c, k_hr, k_weight, k_age = CALORIE_FACTORS[self.sex]
+        kj = c + k_hr * hr + k_weight * self.weight + k_age * self.age
+        self.calories += max(kj, 0.0) * minutes / KJ_PER_KCAL
+
+    def profile(self) -> dict:
+        return {
+            "max_hr": self.max_hr,
+            "resting_hr": self.resting_hr,
+            "zones": list(self.zones),
+            "basis": self.basis,
+            "age": self.age,
+            "weight": self.weight,
+            "sex": self.sex,
+        }
+
+    def summary(self) -> dict:
+        """
+        The aggregates of the samples pushed since the last clear.
+        """
+        bounds = [0.0] + self.thresholds
+        return {
+            "started": self.started,
+            "duration": self._last[0] - self.started if self._last else 0.0,
+            "active_seconds": round(self.active, 1),
+            "samples": self.count,
+            "avg_hr": round(self._sum / self.count, 1) if self.count else None,
+            "max_hr": self.peak,
+            "zones": [
+                {"zone": i, "min_hr": round(bounds[i]), "seconds": round(s, 1)}
+                for i, s in enumerate(self.zone_seconds)
+            ],
+            "trimp": round(self.trimp, 1),
+            "calories": round(self.calories, 1),
+        }
@@ -1,10 +1,12 @@
 import asyncio
+import itertools
 import math
+import time
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
-from hrm.bt_client import HEART_RATE_SERVICE_UUID, BtClient, upload_file
+from hrm.bt_client import BtClient, DeviceSession, bucket_size_for
 
 
 @pytest.fixture
@@ -12,22 +14,49 @@ def bt_client():
     return BtClient()
 
 
+class FakeUploader:
+    """Uploader recording the uploaded charts, returning url or None on failure."""
+
+    def __init__(self, url="http://fake.url/chart.png"):
+        self.url = url
+        self.uploads = []
+
+    async def upload(self, data, key, mime_type="image/png"):
+        self.uploads.append((data, key))
+        return self.url
+
+    async def upload_file(self, path, key, mime_type="application/octet-stream"):
+        with open(path, "rb") as f:
+            self.uploads.append((f.read(), key))
+        return self.url
+
+
+@pytest.fixture
+def uploader(bt_client):
+    bt_client.uploader = FakeUploader()
+    return bt_client.uploader
+
+
+@pytest.fixture
+def session(bt_client):
+    """A session of a monitored device, registered as the default device."""
+    session = DeviceSession("device_id")
+    bt_client.sessions["device_id"] = session
+    bt_client.default_device = "device_id"
+    return session
+
+
 @pytest.mark.asyncio
 async def test_list_bluetooth_devices(bt_client):
-    fake_device = MagicMock()
-    fake_device.address = "00:11:22:33:44:55"
-    fake_device.name = "TestHRM"
-    fake_device.rssi = -50
-    adv_data = MagicMock()
-    adv_data.service_uuids = [HEART_RATE_SERVICE_UUID]
-    devices = {("dev", 1): (fake_device, adv_data)}
-    with patch(
-        "hrm.bt_client.BleakScanner.discover", new=AsyncMock(return_value=devices)
-    ):
+    devices = {"00:11:22:33:44:55": {"name": "TestHRM", "rssi": -50, "last_seen": 1.0}}
+    with patch.object(
+        bt_client.scanner, "devices", new=AsyncMock(return_value=devices)
+    ) as mock_devices:
         result = await bt_client.list_bluetooth_devices()
-        assert fake_device.address in result
-        assert result[fake_device.address]["name"] == "TestHRM"
-        assert result[fake_device.address]["rssi"] == -50
+        assert result == devices
+        mock_devices.assert_called_once_with(refresh=False, timeout=None)
+        await bt_client.list_bluetooth_devices(refresh=True, timeout=1.0)
+        mock_devices.assert_called_with(refresh=True, timeout=1.0)
 
 
 @pytest.mark.asyncio
@@ -61,19 +90,51 @@ async def test_monitoring_heart_rate_creates_task(bt_client):
 
 
 @pytest.mark.asyncio
-async def test_monitoring_heart_rate_already_connected(bt_client):
+async def test_monitoring_heart_rate_already_monitoring(bt_client):
     with (
-        patch("hrm.bt_client.BleakClient") as MockBleakClient,
+        patch("hrm.bt_client.BleakClient"),
         patch("hrm.bt_client.asyncio.create_task") as mock_create_task,
     ):
-        mock_client = MockBleakClient.return_value
-        mock_client.is_connected = True
+        mock_create_task.return_value.done.return_value = False
         await bt_client.monitoring_heart_rate("device_id", duration=10)
-        mock_create_task.assert_not_called()
+        await bt_client.monitoring_heart_rate("device_id", duration=10)
+        mock_create_task.assert_called_once()
+        mock_create_task.call_args[0][0].close()
+
+
+@pytest.mark.asyncio
+async def test_monitoring_multiple_devices(bt_client):
+    with (
+        patch("hrm.bt_client.BleakClient") as MockBleakClient,
+        patch("hrm.bt_client.asyncio.create_task") as mock_create_task,
+    ):
+        await bt_client.monitoring_heart_rate("device_a", duration=10)
+        await bt_client.monitoring_heart_rate("device_b", duration=10)
+        assert mock_create_task.call_count == 2
+        for call in mock_create_task.call_args_list:
+            call[0][0].close()
+        addresses = [c.args[0] for c in MockBleakClient.call_args_list]
+        assert addresses == ["device_a", "device_b"]
+        # dropouts are reported to the session of the device
+        assert (
+            MockBleakClient.call_args.kwargs["disconnected_callback"]
+            == bt_client.sessions["device_b"].on_disconnect
+        )
+    assert set(bt_client.sessions) == {"device_a", "device_b"}
+    assert bt_client.sessions["device_a"].db is not bt_client.sessions["device_b"].db
+    assert bt_client.get_session() is bt_client.sessions["device_b"]
+    assert bt_client.get_session("device_a") is bt_client.sessions["device_a"]
+    with pytest.raises(ValueError, match="Device device_c is not monitored"):
+        bt_client.get_session("device_c")
+
+
+def test_get_session_without_device(bt_client):
+    with pytest.raises(ValueError, match="No device is monitored"):
+        bt_client.get_session()
 
 
 @pytest.mark.asyncio
-async def test_background_monitor(bt_client):
+async def test_background_monitor(session):
     # Patch client and its methods
     mock_client = MagicMock()
     mock_client.__aenter__ = AsyncMock(return_value=mock_client)
@@ -82,9 +143,9 @@ async def test_background_monitor(bt_client):
     mock_client.start_notify = AsyncMock()
     mock_client.stop_notify = AsyncMock()
     mock_client.disconnect = AsyncMock()
-    bt_client.client = mock_client
-    with patch.object(bt_client.db, "clear") as mock_clear:
-        await bt_client.background_monitor(duration=0.01)
+    session.client = mock_client
+    with patch.object(session.db, "clear") as mock_clear:
+        await session.background_monitor(duration=0.01)
         mock_client.__aenter__.assert_called_once()
         mock_client.start_notify.assert_called_once()
         mock_client.stop_notify.assert_called_once()
@@ -94,31 +155,272 @@ async def test_background_monitor(bt_client):
         mock_client.disconnect.assert_not_called()
 
 
+def mock_ble_client(connect_side_effect=None):
+    client = MagicMock()
+    client.__aenter__ = AsyncMock(side_effect=connect_side_effect, return_value=client)
+    client.__aexit__ = AsyncMock(return_value=None)
+    client.start_notify = AsyncMock()
+    client.stop_notify = AsyncMock()
+    return client
+
+
+@pytest.mark.asyncio
+async def test_background_monitor_reconnects(session):
+    session.client = mock_ble_client()
+
+    async def drop_twice(*args):
+        # the strap drops right after the notifications start, twice
+        if session.client.start_notify.call_count <= 2:
+            session.commit_heart_rate([(time.time(), bytes([0x00, 70]))])
+            session.on_disconnect(session.client)
+
+    session.client.start_notify.side_effect = drop_twice
+    with patch("hrm.bt_client.RECONNECT_MIN_DELAY", 0.01):
+        await session.background_monitor(duration=0.2)
+    assert session.client.__aenter__.call_count == 3
+    assert session.client.stop_notify.call_count == 1
+    assert session.reconnects == 2
+    assert session.state == "stopped"
+    # the samples of every connection are kept in the same series
+    assert len(session.db) == 2
+    assert session.samples_received == 2
+
+
+@pytest.mark.asyncio
+async def test_background_monitor_retries_failed_connection(session):
+    attempts = []
+
+    def fail_first(*args):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise OSError("Device not found")
+
+    session.client = mock_ble_client(fail_first)
+    with patch("hrm.bt_client.RECONNECT_MIN_DELAY", 0.01):
+        await session.background_monitor(duration=0.1)
+    assert len(attempts) == 2
+    assert session.reconnects == 1
+    session.client.stop_notify.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_background_monitor_gives_up_at_deadline(session):
+    session.client = mock_ble_client(OSError("Device not found"))
+    with patch("hrm.bt_client.RECONNECT_MIN_DELAY", 0.02):
+        await session.background_monitor(duration=0.1)
+    # backoff 0.02, 0.04, then the deadline
+    assert 2 <= session.client.__aenter__.call_count <= 4
+    assert session.state == "stopped"
+
+
+@pytest.mark.asyncio
+async def test_get_monitoring_status(bt_client, session):
+    status = bt_client.get_monitoring_status()
+    assert status["state"] == "idle"
+    assert status["last_packet_age"] is None
+    session.client = mock_ble_client()
+    status_while_connected = {}
+
+    async def capture(*args):
+        session.commit_heart_rate([(time.time() - 2, bytes([0x00, 70]))])
+        status_while_connected.update(bt_client.get_monitoring_status("device_id"))
+
+    session.client.start_notify.side_effect = capture
+    session.task = asyncio.create_task(session.background_monitor(duration=0.05))
+    await session.task
+    assert status_while_connected["state"] == "connected"
+    assert status_while_connected["samples_received"] == 1
+    assert status_while_connected["samples_accepted"] == 1
+    assert status_while_connected["last_packet_age"] >= 2
+    assert status_while_connected["monitoring_until"] is not None
+    status = bt_client.get_monitoring_status()
+    assert status["state"] == "stopped"
+    assert status["monitoring_until"] is None
+
+    async def crash():
+        raise RuntimeError("boom")
+
+    session.task = asyncio.create_task(crash())
+    await asyncio.sleep(0)
+    status = bt_client.get_monitoring_status()
+    assert status["state"] == "failed"
+    assert status["error"] == "boom"
+
+
 @pytest.mark.parametrize(
     "flags,expected_hr",
     [
         (0x00, 60),  # 8-bit
-        (0x01, 300),  # 16-bit
+        (0x01, 200),  # 16-bit
     ],
 )
-def test_count_heart_rate(bt_client, flags, expected_hr):
+def test_count_heart_rate(session, flags, expected_hr):
     with (
-        patch.object(bt_client.db, "insert") as mock_insert,
+        patch.object(session.db, "insert") as mock_insert,
         patch("time.time", return_value=123.0),
     ):
         if flags == 0x00:
             data = bytearray([flags, expected_hr])
         else:
             data = bytearray([flags]) + expected_hr.to_bytes(2, "little")
-        bt_client.count_heart_rate(1, data)
+        session.count_heart_rate(1, data)
+        mock_insert.assert_not_called()
+        assert session.ingest.drain() == 1
         mock_insert.assert_called_once_with(123.0, expected_hr)
 
 
+def test_commit_heart_rate_full_measurement(session):
+    # 8-bit HR, contact supported and detected, energy expended, 2 RR intervals
+    data = bytes([0x1E, 72, 0x10, 0x00, 0x00, 0x04, 0x00, 0x02])
+    session.commit_heart_rate([(100.0, data), (101.0, b"\x00")])
+    assert session.db.data == [(100.0, 72)]
+    assert session.rr_db.data == [(99.5, 1000.0), (100.0, 500.0)]
+    assert session.sensor_contact is True
+    assert session.energy_expended == 16
+    assert session.live.latest == {
+        "device_id": "device_id",
+        "time": 100.0,
+        "heart_rate": 72,
+        "rr_intervals": [1000.0, 500.0],
+        "sensor_contact": True,
+        "energy_expended": 16,
+    }
+
+
 @pytest.mark.asyncio
-async def test_get_heart_rate(bt_client):
-    with patch.object(bt_client.db, "avg", return_value=59.1):
+async def test_get_live_heart_rate(bt_client, session):
+    assert bt_client.get_live_heart_rate() == {}
+    with patch("time.time", return_value=123.0):
+        session.count_heart_rate(1, bytearray([0x00, 65]))
+    # queued notifications are committed before answering
+    assert bt_client.get_live_heart_rate("device_id")["heart_rate"] == 65
+
+
+@pytest.mark.asyncio
+async def test_watch_heart_rate(bt_client, session):
+    session.task = asyncio.create_task(asyncio.sleep(10))
+    received = []
+
+    async def on_update(update):
+        received.append(update["heart_rate"])
+
+    async def feed():
+        for hr in (60, 61, 62):
+            await asyncio.sleep(0.01)
+            session.commit_heart_rate([(float(hr), bytes([0x00, hr]))])
+        session.task.cancel()
+
+    feeder = asyncio.create_task(feed())
+    result = await bt_client.watch_heart_rate(duration=5.0, on_update=on_update)
+    await feeder
+    assert received == [60, 61, 62]
+    assert result["updates"] == 3
+    assert result["coalesced"] == 0
+    assert result["latest"]["heart_rate"] == 62
+    # the subscription is closed once the monitoring stops
+    assert len(session.live) == 0
+
+
+@pytest.mark.asyncio
+async def test_watch_heart_rate_duration(bt_client, session):
+    session.task = asyncio.create_task(asyncio.sleep(10))
+    result = await bt_client.watch_heart_rate(duration=0.05)
+    session.task.cancel()
+    assert result == {"updates": 0, "coalesced": 0, "latest": {}}
+
+
+@pytest.mark.asyncio
+async def test_get_heart_rate(bt_client, session):
+    session.db.insert(85.0, 50)
+    session.db.insert(95.0, 59)
+    session.db.insert(96.0, 60)
+    with patch("time.time", return_value=100.0):
         result = await bt_client.get_heart_rate()
-        assert result == {"avg_hr": math.ceil(59.1)}
+        assert result == {"avg_hr": math.ceil(59.5)}
+    with patch("time.time", return_value=200.0):
+        result = await bt_client.get_heart_rate()
+        assert result == {"avg_hr": 0}
+        result = await bt_client.get_heart_rate("device_id")
+        assert result == {"avg_hr": 0}
+
+
+def test_commit_heart_rate_filters_artifacts(bt_client, session):
+    # contact supported, lost for the second sample, then a 0 bpm reading
+    session.commit_heart_rate(
+        [
+            (100.0, bytes([0x16, 72, 0x00, 0x04])),
+            (101.0, bytes([0x14, 70, 0x00, 0x04])),
+            (102.0, bytes([0x00, 0])),
+            (110.0, bytes([0x00, 74])),
+        ]
+    )
+    assert session.db.data == [(100.0, 72), (110.0, 74)]
+    assert session.rr_db.data == [(100.0, 1000.0)]
+    with patch("time.time", return_value=111.0):
+        result = bt_client.get_heart_rate_gaps()
+    assert result == {
+        "gaps": [{"start": 100.0, "end": 110.0, "reason": "invalid"}],
+        "accepted": 2,
+        "rejected": {"no_contact": 1, "invalid": 1, "outlier": 0},
+    }
+
+
+def test_get_session_summary(bt_client, session):
+    session.commit_heart_rate([(float(ts), bytes([0x00, 150])) for ts in range(61)])
+    summary = bt_client.get_session_summary()
+    assert summary["active_seconds"] == 60
+    assert summary["avg_hr"] == 150
+    assert summary["zones"][3] == {"zone": 3, "min_hr": 133, "seconds": 60}
+    assert summary["profile"]["max_hr"] == 190
+    assert summary["trimp"] > 0
+
+
+def test_configure_heart_rate_zones(bt_client, session):
+    session.commit_heart_rate([(float(ts), bytes([0x00, 150])) for ts in range(61)])
+    profile = bt_client.configure_heart_rate_zones(age=40, weight=80)
+    assert profile["max_hr"] == 180
+    assert profile["weight"] == 80
+    # the session so far is recomputed with the new zones
+    summary = bt_client.get_session_summary("device_id")
+    assert summary["zones"][4]["seconds"] == 60
+    profile = bt_client.configure_heart_rate_zones(max_hr=200, basis="reserve")
+    assert profile["max_hr"] == 200
+    assert profile["age"] == 40
+    with pytest.raises(ValueError):
+        bt_client.configure_heart_rate_zones(sex="other")
+    assert bt_client.get_session_summary()["profile"]["max_hr"] == 200
+
+
+def test_get_hrv(bt_client, session):
+    for ts, rr in [(90.0, 800.0), (90.9, 900.0), (91.7, 800.0)]:
+        session.rr_db.insert(ts, rr)
+    with patch("time.time", return_value=100.0):
+        result = bt_client.get_hrv()
+    assert result == {
+        "rmssd": 100.0,
+        "sdnn": 57.7,
+        "pnn50": 100.0,
+        "mean_rr": 833.3,
+        "count": 3,
+    }
+    with patch("time.time", return_value=1000.0):
+        result = bt_client.get_hrv("device_id")
+    assert result["rmssd"] is None
+    assert result["count"] == 0
+
+
+def test_get_hrv_frequency(bt_client, session):
+    with patch("time.time", return_value=400.0):
+        assert bt_client.get_hrv_frequency() == {"lf": None, "hf": None, "lf_hf": None}
+    ts = 100.0
+    while ts < 400.0:
+        rr = 900 + 40 * math.sin(2 * math.pi * 0.25 * ts)
+        session.rr_db.insert(ts, rr)
+        ts += rr / 1000
+    with patch("time.time", return_value=400.0):
+        result = bt_client.get_hrv_frequency(since_from=300.0)
+    assert result["hf"] > result["lf"]
+    assert result["lf_hf"] < 1
 
 
 @pytest.mark.parametrize(
@@ -128,17 +430,89 @@ async def test_get_heart_rate(bt_client):
         ([], []),
     ],
 )
-def test_get_heart_rate_bucket(bt_client, data, expected):
+def test_get_heart_rate_bucket(bt_client, session, data, expected):
     with (
         patch("time.time", return_value=10.0),
         patch.object(
-            bt_client.db, "time_bucket", return_value=[(d[0], d[1]) for d in data]
+            session.db, "time_bucket", return_value=[(d[0], d[1]) for d in data]
         ),
     ):
         result = bt_client.get_heart_rate_bucket(since_from=10.0, bucket_size=1.0)
         assert result == [{"time": d[0], "value": math.ceil(d[1])} for d in data]
 
 
+def test_get_heart_rate_bucket_compact(bt_client, session):
+    session.commit_heart_rate([(100.0, bytes([0x00, 60])), (102.0, bytes([0x00, 70]))])
+    with patch("time.time", return_value=104.5):
+        result = bt_client.get_heart_rate_bucket(
+            since_from=5.0, bucket_size=1.0, compact=True
+        )
+    assert result == {
+        "start": 99.0,
+        "step": 1.0,
+        "values": [None, 60, None, 70, None, None],
+    }
+
+
+def test_get_heart_rate_bucket_last_partial_bucket(bt_client, session):
+    session.commit_heart_rate([(100.0, bytes([0x00, 60])), (104.2, bytes([0x00, 80]))])
+    with patch("time.time", return_value=104.5):
+        result = bt_client.get_heart_rate_bucket(since_from=5.0, bucket_size=1.0)
+    assert result[-1] == {"time": 104.0, "value": 80}
+    # 24 h in 24 points, the last hour is the partial bucket
+    session.commit_heart_rate([(86400.0 + 1000.0, bytes([0x00, 90]))])
+    with patch("time.time", return_value=86400.0 + 1800.0):
+        result = bt_client.get_heart_rate_bucket(
+            since_from=86400.0, bucket_size=1.0, compact=True, max_points=24
+        )
+    assert result["start"] == 3600.0
+    assert result["step"] == 3600
+    assert len(result["values"]) == 24
+    assert result["values"][-1] == 90
+
+
+def test_get_heart_rate_bucket_invalid_size(bt_client, session):
+    for bucket_size in (0.0, -1.0):
+        with pytest.raises(ValueError, match="Bucket size"):
+            bt_client.get_heart_rate_bucket(since_from=10.0, bucket_size=bucket_size)
+
+
+def test_get_heart_rate_bucket_max_points(bt_client, session):
+    session.commit_heart_rate(
+        [(float(ts), bytes([0x00, 60 + ts % 2])) for ts in range(3600)]
+    )
+    with patch("time.time", return_value=3600.0):
+        result = bt_client.get_heart_rate_bucket(
+            since_from=3600.0, bucket_size=1.0, compact=True, max_points=100
+        )
+    assert result["step"] == 60
+    assert len(result["values"]) == 60
+    assert result["values"][0] == 61
+    with patch("time.time", return_value=3600.0):
+        result = bt_client.get_heart_rate_bucket(
+            since_from=600.0, bucket_size=1.0, max_points=100
+        )
+    assert len(result) == 60
+    assert result[1]["time"] - result[0]["time"] == 10
+
+
+@pytest.mark.parametrize(
+    "since_from,max_points,bucket_size,expected",
+    [
+        (60.0, 100, 1.0, 1),
+        (600.0, 100, 1.0, 10),
+        (601.0, 100, 1.0, 10),
+        (3600.0, 50, 1.0, 120),
+        (600.0, 100, 20.0, 30),
+        (30 * 24 * 3600.0, 100, 1.0, 8 * 3600),
+    ],
+)
+def test_bucket_size_for(since_from, max_points, bucket_size, expected):
+    assert bucket_size_for(since_from, max_points, bucket_size) == expected
+    with pytest.raises(ValueError):
+        bucket_size_for(since_from, 0)
+
+
 @pytest.mark.parametrize(
     "data,expected",
     [
@@ -146,109 +520,209 @@ def test_get_heart_rate_bucket(bt_client, data, expected):
         ([(1, 60), (2, 80)], {"max_hr": 80}),
     ],
 )
-def test_evaluate_active_heart_rate(bt_client, data, expected):
-    with (
-        patch("time.time", return_value=100.0),
-        patch.object(bt_client.db, "query", return_value=data),
-    ):
+def test_evaluate_active_heart_rate(bt_client, session, data, expected):
+    for ts, val in data:
+        session.db.insert(ts + 50, val)
+    with patch("time.time", return_value=100.0):
         result = bt_client.evaluate_active_heart_rate()
         assert result == expected
 
 
-@patch("hrm.bt_client.upload_file", return_value="http://fake.url/chart.png")
-@patch("hrm.bt_client.plt")
-def test_build_heart_rate_chart(mock_plt, mock_upload_file, bt_client):
-    # Patch get_heart_rate_bucket to return fake data
-    with patch.object(
-        bt_client,
-        "get_heart_rate_bucket",
-        return_value=[{"time": 1, "value": 60}, {"time": 2, "value": 70}],
+@pytest.mark.asyncio
+async def test_build_heart_rate_chart(bt_client, session, uploader):
+    # Patch _heart_rate_buckets to return fake data
+    with (
+        patch.object(
+            bt_client,
+            "_heart_rate_buckets",
+            return_value=[(1, 60), (2, 70)],
+        ),
+        patch.object(
+            bt_client.renderer, "render", new=AsyncMock(return_value=b"png")
+        ) as mock_render,
     ):
-        url = bt_client.build_heart_rate_chart(since_from=2.0)
+        url = await bt_client.build_heart_rate_chart(since_from=2.0)
         assert url == "http://fake.url/chart.png"
-        mock_plt.figure.assert_called()
-        mock_plt.plot.assert_called()
-        mock_plt.savefig.assert_called()
-        mock_upload_file.assert_called()
-
-    # Test no data case
-    with patch.object(bt_client, "get_heart_rate_bucket", return_value=[]):
-        url = bt_client.build_heart_rate_chart(since_from=2.0)
+        mock_render.assert_called_once_with([1, 2], [60, 70], format="png")
+        assert uploader.uploads[0][0] == b"png"
+        assert uploader.uploads[0][1].endswith(".png")
+
+    # Test no data case, on another window than the cached chart
+    with patch.object(bt_client, "_heart_rate_buckets", return_value=[]):
+        url = await bt_client.build_heart_rate_chart(since_from=20.0)
+        assert url == ""
+    with patch.object(bt_client, "_heart_rate_buckets", return_value=[(1, None)]):
+        url = await bt_client.build_heart_rate_chart(since_from=30.0)
         assert url == ""
 
 
-@patch("hrm.bt_client.upload_file", return_value=None)
-@patch("hrm.bt_client.plt")
-def test_build_heart_rate_chart_upload_fail(mock_plt, mock_upload_file, bt_client):
-    # Patch get_heart_rate_bucket to return fake data
-    with patch.object(
-        bt_client,
-        "get_heart_rate_bucket",
-        return_value=[{"time": 1, "value": 60}, {"time": 2, "value": 70}],
+@pytest.mark.asyncio
+async def test_build_heart_rate_chart_upload_fail(bt_client, session, uploader):
+    uploader.url = None
+    # Patch _heart_rate_buckets to return fake data
+    with (
+        patch.object(
+            bt_client,
+            "_heart_rate_buckets",
+            return_value=[(1, 60), (2, 70)],
+        ),
+        patch.object(
+            bt_client.renderer,
+            "render",
+            new=AsyncMock(side_effect=[b"png", b"<svg>mocked</svg>"]),
+        ) as mock_render,
     ):
-        # Mock plt.savefig to write SVG content to the buffer
-        def fake_savefig(buf, format=None):
-            if hasattr(buf, "write"):
-                buf.write("<svg>mocked</svg>")
-
-        mock_plt.savefig.side_effect = fake_savefig
         # Call the method
-        result = bt_client.build_heart_rate_chart(since_from=2.0)
+        result = await bt_client.build_heart_rate_chart(since_from=2.0)
         assert result.startswith("<svg")
-        mock_upload_file.assert_called()
-        mock_plt.savefig.assert_called()
+        assert len(uploader.uploads) == 1
+        mock_render.assert_called_with([1, 2], [60, 70], format="svg")
 
 
-@patch("hrm.bt_client.upload_file", return_value="http://fake.url/chart.png")
-@patch("hrm.bt_client.plt")
-def test_build_heart_rate_chart_bucket_size(mock_plt, mock_upload_file, bt_client):
-    with patch.object(
-        bt_client,
-        "get_heart_rate_bucket",
-        return_value=[{"time": 1, "value": 60}],
-    ) as mock_bucket:
+@pytest.mark.asyncio
+async def test_build_heart_rate_chart_bucket_size(bt_client, session, uploader):
+    with (
+        patch.object(
+            bt_client,
+            "_heart_rate_buckets",
+            return_value=[(1, 60)],
+        ) as mock_bucket,
+        patch.object(bt_client.renderer, "render", new=AsyncMock(return_value=b"png")),
+    ):
         since = 100.0
-        url = bt_client.build_heart_rate_chart(since_from=since)
+        with patch("time.time", return_value=1000.0):
+            url = await bt_client.build_heart_rate_chart(since_from=since)
         assert url == "http://fake.url/chart.png"
-        mock_bucket.assert_called_once_with(
-            since_from=since, bucket_size=math.ceil(since / 60)
-        )
+        bucket_size = math.ceil(since / 60)
+        mock_bucket.assert_called_once_with(session, 900.0, 50, bucket_size)
+
+
+@pytest.mark.asyncio
+async def test_build_heart_rate_chart_cache_window(bt_client, session, uploader):
+    for ts in range(0, 100):
+        session.db.insert(float(ts), 60)
+    # the clock moves on while the chart is built
+    clock = itertools.count(100.0, 0.6)
+    with (
+        patch("time.time", side_effect=lambda: next(clock)),
+        patch.object(
+            bt_client.renderer, "render", new=AsyncMock(return_value=b"png")
+        ) as mock_render,
+    ):
+        await bt_client.build_heart_rate_chart(since_from=30.0)
+    (cache_key,) = bt_client.chart_cache._entries
+    _, start_time, bucket_size, num_buckets = cache_key
+    times = mock_render.call_args.args[0]
+    assert times == [start_time + i * bucket_size for i in range(num_buckets)]
+
+
+@pytest.mark.asyncio
+async def test_build_heart_rate_chart_cache(bt_client, session, uploader):
+    for ts in range(0, 100):
+        session.db.insert(float(ts), 60 + ts % 10)
+
+    with patch.object(
+        bt_client.renderer, "render", new=AsyncMock(return_value=b"png")
+    ) as mock_render:
+        with patch("time.time", return_value=100.0):
+            url = await bt_client.build_heart_rate_chart(since_from=30.0)
+        assert url == "http://fake.url/chart.png"
+
+        # new samples after the window don't invalidate the chart
+        session.db.insert(100.0, 90)
+        with patch("time.time", return_value=100.0):
+            url = await bt_client.build_heart_rate_chart(since_from=30.0)
+        assert url == "http://fake.url/chart.png"
+        assert mock_render.call_count == 1
+        assert len(uploader.uploads) == 1
+
+        # a late sample inside the window does
+        session.db.insert(95.5, 120)
+        with patch("time.time", return_value=100.0):
+            await bt_client.build_heart_rate_chart(since_from=30.0)
+        assert mock_render.call_count == 2
 
+        # so does a new window, here with a partial last bucket
+        with patch("time.time", return_value=100.5):
+            await bt_client.build_heart_rate_chart(since_from=30.0)
+        assert mock_render.call_count == 3
+        assert len(uploader.uploads) == 3
 
-def test_upload_file_success(monkeypatch):
-    # Set up environment variables
-    monkeypatch.setenv("QINIU_ACCESS_KEY", "fake_key")
-    monkeypatch.setenv("QINIU_SECRET_KEY", "fake_secret")
-    monkeypatch.setenv("QINIU_BUCKET_NAME", "fake_bucket")
-    monkeypatch.setenv("QINIU_BUCKET_DOMAIN", "http://fake.domain")
 
-    # Patch QiniuAuth and QiniuPutFile
+@pytest.mark.asyncio
+async def test_build_heart_rate_chart_without_uploader(bt_client, session):
+    bt_client.uploader = None
     with (
-        patch("hrm.bt_client.QiniuAuth") as MockAuth,
-        patch(
-            "hrm.bt_client.QiniuPutFile", return_value=({"key": "somekey"}, MagicMock())
-        ) as mock_put_file,
+        patch.object(
+            bt_client,
+            "_heart_rate_buckets",
+            return_value=[(1, 60), (2, 70)],
+        ),
+        patch.object(
+            bt_client.renderer, "render", new=AsyncMock(return_value=b"<svg/>")
+        ) as mock_render,
     ):
-        mock_auth_instance = MockAuth.return_value
-        mock_auth_instance.upload_token.return_value = "fake_token"
-        file_path = "/tmp/test.png"
-        url = upload_file(file_path)
-        assert url.startswith("http://fake.domain/")
-        mock_put_file.assert_called_once()
-
-
-def test_upload_file_missing_keys(monkeypatch):
-    # Unset environment variables
-    monkeypatch.delenv("QINIU_ACCESS_KEY", raising=False)
-    monkeypatch.delenv("QINIU_SECRET_KEY", raising=False)
-    monkeypatch.delenv("QINIU_BUCKET_NAME", raising=False)
-    monkeypatch.delenv("QINIU_BUCKET_DOMAIN", raising=False)
-    file_path = "/tmp/test.png"
-    url = upload_file(file_path)
-    assert url is None
-
-
-def test_upload_file_non_png():
-    file_path = "/tmp/test.txt"
-    url = upload_file(file_path)
-    assert url is None
+        result = await bt_client.build_heart_rate_chart(since_from=2.0)
+        assert result == "<svg/>"
+        mock_render.assert_called_once_with([1, 2], [60, 70], format="svg")
+
+
+def test_server_metrics(bt_client, session):
+    session.count_heart_rate(1, bytearray([0x00, 60]))
+    session.commit_heart_rate(
+        [(100.0, bytes([0x00, 60])), (101.0, b"\x00"), (102.0, bytes([0x00, 0]))]
+    )
+    bt_client.metrics.observe_tool("get_heart_rate", 0.001)
+    result = bt_client.server_metrics()
+    assert result["tools"]["get_heart_rate"]["count"] == 1
+    device = result["devices"]["device_id"]
+    # the queued notification was committed first
+    assert device["notifications_total"] == 4
+    assert device["queued"] == 0
+    assert device["malformed_total"] == 1
+    assert device["accepted_total"] == 2
+    assert device["rejected_total"]["invalid"] == 1
+    assert device["db_size"] == 2
+    assert device["db_evictions_total"] == 0
+    assert device["notification_rate"] == 1.0
+    text = bt_client.server_metrics("prometheus")
+    assert 'hrm_device_malformed_total{device="device_id"} 1' in text
+    with pytest.raises(ValueError):
+        bt_client.server_metrics("xml")
+
+
+@pytest.mark.asyncio
+async def test_export_heart_rate(bt_client, session, uploader, tmp_path):
+    bt_client.export_dir = str(tmp_path)
+    now = time.time()
+    session.commit_heart_rate(
+        [(now - 30 + i, bytes([0x00, 60 + i])) for i in range(10)]
+    )
+    result = await bt_client.export_heart_rate(since_from=60)
+    assert result["rows"] == 10
+    assert result["columns"] == ["time", "value"]
+    assert result["url"] == uploader.url
+    assert result["path"].startswith(str(tmp_path)) and result["path"].endswith(".csv")
+    data, key = uploader.uploads[-1]
+    assert key.startswith("hr-") and data.count(b"\n") == 11
+    assert len(data) == result["bytes"]
+
+    result = await bt_client.export_heart_rate(since_from=60, bucket_size=10)
+    assert result["columns"] == ["time", "count", "mean", "min", "max"]
+    assert result["rows"] == 6
+
+    with pytest.raises(ValueError):
+        await bt_client.export_heart_rate(format="xlsx")
+    with pytest.raises(ValueError):
+        await bt_client.export_heart_rate(series="spo2")
+
+
+def test_session_maxlen_from_env(monkeypatch):
+    monkeypatch.setenv("HRM_DB_MAXLEN", "100")
+    monkeypatch.setenv("HRM_RR_DB_MAXLEN", "200")
+    session = DeviceSession("device_id")
+    assert session.db.maxlen == 100
+    assert session.rr_db.maxlen == 200
+    monkeypatch.setenv("HRM_DB_MAXLEN", "0")
+    with pytest.raises(ValueError):
+        DeviceSession("device_id")
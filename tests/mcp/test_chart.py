@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+from hrm.chart import ChartCache, ChartRenderer, decimate, render_chart
+from hrm.ts_db import TsDB
+
+
+def test_render_chart():
+    png = render_chart([1.0, 2.0, 3.0], [60, None, 70], format="png")
+    assert png.startswith(b"\x89PNG")
+    svg = render_chart([1.0, 2.0, 3.0], [60, None, 70], format="svg")
+    assert b"<svg" in svg
+
+
+@pytest.mark.asyncio
+async def test_renderer_bounds_concurrent_renders():
+    executor = ThreadPoolExecutor(max_workers=4)
+    renderer = ChartRenderer(max_concurrent=1, executor=executor)
+    charts = await asyncio.gather(
+        renderer.render([1.0, 2.0], [60, 70]),
+        renderer.render([1.0, 2.0], [60, 70], format="svg"),
+    )
+    assert charts[0].startswith(b"\x89PNG")
+    assert b"<svg" in charts[1]
+    renderer.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_renderer_process_pool():
+    renderer = ChartRenderer(max_workers=1)
+    try:
+        png = await renderer.render([1.0, 2.0], [60, 70])
+        assert png.startswith(b"\x89PNG")
+    finally:
+        renderer.shutdown()
+
+
+def test_chart_cache_lru_and_ttl():
+    db = TsDB()
+    db.insert(10.0, 60.0)
+    cache = ChartCache(maxsize=2, ttl=60.0)
+    with patch("hrm.chart.time.monotonic", return_value=0.0):
+        cache.put("a", db, "chart a")
+        cache.put("b", db, "chart b")
+        assert cache.get("a", db, 10.0) == "chart a"
+        # "b" is the least recently used
+        cache.put("c", db, "chart c", watermark=20.0)
+        assert cache.get("b", db, 10.0) is None
+        assert len(cache) == 2
+    db.insert(30.0, 70.0)
+    with patch("hrm.chart.time.monotonic", return_value=30.0):
+        # "a" was built at latest 10.0, so a window ending at 15.0 may have changed
+        assert cache.get("a", db, 15.0) is None
+        assert cache.get("c", db, 15.0) == "chart c"
+    with patch("hrm.chart.time.monotonic", return_value=61.0):
+        assert cache.get("c", db, 15.0) is None
+    assert len(cache) == 0
+
+
+def test_decimate_keeps_peaks_and_gaps():
+    times = [float(i) for i in range(100)]
+    values = [60.0] * 100
+    values[13] = 150.0
+    values[77] = 40.0
+    values[50] = None
+    out_times, out_values = decimate(times, values, 20)
+    assert len(out_times) <= 30
+    assert out_times == sorted(out_times)
+    assert 150.0 in out_values
+    assert 40.0 in out_values
+    assert None in out_values
+    # short series are left as is
+    assert decimate(times[:10], values[:10], 20) == (times[:10], values[:10])
+
+
+def test_render_svg_within_budget():
+    times = [1.7e9 + i for i in range(86400)]
+    values = [60.0 + (i * 7919) % 50 for i in range(86400)]
+    svg = render_chart(times, values, format="svg", max_svg_bytes=8 * 1024)
+    assert svg.startswith(b"<svg")
+    assert svg.endswith(b"</svg>")
+    assert len(svg) <= 8 * 1024
+    with pytest.raises(ValueError, match="Unsupported chart format"):
+        render_chart(times, values, format="gif")
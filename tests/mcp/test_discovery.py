@@ -0,0 +1,102 @@
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from hrm.discovery import HEART_RATE_SERVICE_UUID, DeviceScanner
+
+
+def advertisement(address, name, rssi, service_uuids=(HEART_RATE_SERVICE_UUID,)):
+    device = MagicMock()
+    device.address = address
+    device.name = name
+    adv_data = MagicMock()
+    adv_data.rssi = rssi
+    adv_data.service_uuids = list(service_uuids)
+    return device, adv_data
+
+
+class FakeScanner:
+    """Stands in for BleakScanner, replays advertisements when started."""
+
+    advertisements = []
+    instances = []
+
+    def __init__(self, detection_callback, service_uuids):
+        self.detection_callback = detection_callback
+        self.service_uuids = service_uuids
+        self.running = False
+        FakeScanner.instances.append(self)
+
+    async def start(self):
+        self.running = True
+        for device, adv_data in self.advertisements:
+            self.detection_callback(device, adv_data)
+
+    async def stop(self):
+        self.running = False
+
+    def advertise(self, device, adv_data):
+        self.detection_callback(device, adv_data)
+
+
+@pytest.fixture
+def scanner():
+    FakeScanner.instances = []
+    FakeScanner.advertisements = [
+        advertisement("00:11:22:33:44:55", "TestHRM", -50),
+        advertisement("66:77:88:99:AA:BB", None, -70),
+        advertisement("CC:DD:EE:FF:00:11", "Speaker", -40, service_uuids=()),
+    ]
+    return DeviceScanner(ttl=60.0, scan_timeout=0.01, scanner_cls=FakeScanner)
+
+
+@pytest.mark.asyncio
+async def test_devices_from_background_scan(scanner):
+    with patch("time.time", return_value=100.0):
+        devices = await scanner.devices()
+    assert devices == {
+        "00:11:22:33:44:55": {"name": "TestHRM", "rssi": -50, "last_seen": 100.0},
+        "66:77:88:99:AA:BB": {"name": "N/A", "rssi": -70, "last_seen": 100.0},
+    }
+    assert scanner.is_running
+    assert FakeScanner.instances[0].service_uuids == [HEART_RATE_SERVICE_UUID]
+
+    # later advertisements update the cache, which is answered without a new scan
+    with patch("time.time", return_value=110.0):
+        FakeScanner.instances[0].advertise(
+            *advertisement("00:11:22:33:44:55", "TestHRM", -45)
+        )
+    with (
+        patch("time.time", return_value=150.0),
+        patch("hrm.discovery.asyncio.sleep") as mock_sleep,
+    ):
+        devices = await scanner.devices()
+        mock_sleep.assert_not_called()
+    assert devices["00:11:22:33:44:55"]["rssi"] == -45
+    assert len(FakeScanner.instances) == 1
+
+    # the device not seen for ttl seconds is evicted
+    with patch("time.time", return_value=165.0):
+        assert list(scanner.cached()) == ["00:11:22:33:44:55"]
+
+    await scanner.stop()
+    assert not scanner.is_running
+    assert not FakeScanner.instances[0].running
+
+
+@pytest.mark.asyncio
+async def test_devices_refresh_drops_unseen(scanner):
+    await scanner.devices()
+
+    # only the device advertising during the forced scan is kept
+    async def sleep(timeout):
+        assert timeout == 0.5
+        FakeScanner.instances[0].advertise(
+            *advertisement("00:11:22:33:44:55", "TestHRM", -52)
+        )
+
+    with patch("hrm.discovery.asyncio.sleep", new=sleep):
+        devices = await scanner.devices(refresh=True, timeout=0.5)
+    assert list(devices) == ["00:11:22:33:44:55"]
+    assert devices["00:11:22:33:44:55"]["rssi"] == -52
+    await scanner.stop()
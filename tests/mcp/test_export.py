@@ -0,0 +1,135 @@
+import csv
+import math
+import sys
+
+import numpy as np
+import pytest
+
+from hrm.export import bucket_columns, export_columns, raw_columns
+from hrm.ts_db import TsDB
+from hrm.ts_store import SegmentStore
+
+
+@pytest.fixture
+def db():
+    db = TsDB(100, value_type="H")
+    for ts in range(10):
+        if ts not in (4, 5):
+            db.insert(1000.0 + ts, 60 + ts)
+    return db
+
+
+def test_raw_csv(db, tmp_path):
+    path = str(tmp_path / "hr.csv")
+    columns = raw_columns(db, 1000.0, 1003.0)
+    size = export_columns(path, columns, "csv")
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        ["time", "value"],
+        ["1000.0", "60"],
+        ["1001.0", "61"],
+        ["1002.0", "62"],
+        ["1003.0", "63"],
+    ]
+    assert size == (tmp_path / "hr.csv").stat().st_size
+    assert not (tmp_path / "hr.csv.tmp").exists()
+
+
+def test_bucket_csv(db, tmp_path):
+    path = str(tmp_path / "hr.csv")
+    # small chunks, the buckets are computed over several ranges
+    columns = bucket_columns(db, 1000.0, 1010.0, 2.0, chunk=2)
+    export_columns(path, columns, "csv")
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["time", "count", "mean", "min", "max"]
+    assert rows[1] == ["1000.0", "2", "60.5", "60.0", "61.0"]
+    # the empty bucket has no stats
+    assert rows[3] == ["1004.0", "0", "", "", ""]
+    assert len(rows) == 6
+
+
+def test_npy(db, tmp_path):
+    path = str(tmp_path / "hr.npy")
+    export_columns(path, raw_columns(db, 1000.0, 1010.0), "npy")
+    data = np.load(path)
+    assert data.dtype.names == ("time", "value")
+    assert data["value"].dtype == np.uint16
+    assert list(data["time"][:3]) == [1000.0, 1001.0, 1002.0]
+    assert len(data) == 8
+
+    export_columns(path, bucket_columns(db, 1000.0, 1010.0, 2.0), "npy")
+    data = np.load(path)
+    assert list(data["count"]) == [2, 2, 0, 2, 2]
+    assert math.isnan(data["mean"][2])
+
+    export_columns(path, raw_columns(db, 2000.0, 2010.0), "npy")
+    assert len(np.load(path)) == 0
+
+
+def test_raw_streamed_from_store(tmp_path):
+    store = SegmentStore(str(tmp_path / "store"), segment_records=4, batch_size=2)
+    db = TsDB(3, value_type="H", store=store)
+    for ts in range(11):
+        db.insert(1000.0 + ts, 60 + ts)
+    columns = raw_columns(db, 1000.0, 1010.0, chunk=3)
+    assert columns.rows == 11
+    path = str(tmp_path / "hr.npy")
+    export_columns(path, columns, "npy")
+    data = np.load(path)
+    assert list(data["time"]) == [1000.0 + ts for ts in range(11)]
+    assert list(data["value"]) == [60 + ts for ts in range(11)]
+
+    path = str(tmp_path / "hr.csv")
+    export_columns(path, raw_columns(db, 1000.0, 1010.0, chunk=3), "csv")
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    assert len(rows) == 12
+    assert rows[-1] == ["1010.0", "70"]
+
+
+def test_bucket_streamed_from_store(tmp_path):
+    store = SegmentStore(str(tmp_path / "store"), segment_records=4, batch_size=2)
+    db = TsDB(3, value_type="H", store=store, rollups=())
+    for ts in range(11):
+        db.insert(1000.0 + ts, 60 + ts)
+    columns = bucket_columns(db, 1000.0, 1012.0, 2.0, chunk=2)
+    assert columns.rows == 6
+    # the buckets are computed as the file is written
+    db.insert(1011.5, 80)
+    path = str(tmp_path / "hr.npy")
+    export_columns(path, columns, "npy")
+    data = np.load(path)
+    assert list(data["count"]) == [2, 2, 2, 2, 2, 1]
+    assert list(data["mean"]) == [60.5, 62.5, 64.5, 66.5, 68.5, 70.0]
+
+
+def test_npy_rows_mismatch(db, tmp_path):
+    # the file is sized from the row count, the chunks must match it
+    for rows in (5, 20):
+        columns = raw_columns(db, 1000.0, 1010.0)._replace(rows=rows)
+        with pytest.raises(ValueError):
+            export_columns(str(tmp_path / "hr.npy"), columns, "npy")
+    assert not list(tmp_path.iterdir())
+
+
+def test_parquet(db, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = str(tmp_path / "hr.parquet")
+    export_columns(path, bucket_columns(db, 1000.0, 1010.0, 2.0), "parquet")
+    table = pq.read_table(path)
+    assert table.column("count").to_pylist() == [2, 2, 0, 2, 2]
+    assert table.column("mean").to_pylist()[2] is None
+
+
+def test_unsupported_format(db, tmp_path):
+    with pytest.raises(ValueError):
+        export_columns(str(tmp_path / "hr.xls"), raw_columns(db, 0, 1), "xls")
+
+
+def test_parquet_without_pyarrow(db, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(ValueError, match="requires pyarrow"):
+        export_columns(str(tmp_path / "hr.parquet"), raw_columns(db, 0, 1), "parquet")
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,66 @@
+import pytest
+
+from hrm.filters import Gap, HeartRateFilter
+
+
+def test_contact_gating_and_range():
+    hr_filter = HeartRateFilter()
+    assert hr_filter.process(0.0, 70, sensor_contact=True) == 70
+    assert hr_filter.process(1.0, 70, sensor_contact=False) is None
+    assert hr_filter.process(2.0, 0) is None
+    assert hr_filter.process(3.0, 300) is None
+    # sensors without contact detection are not gated
+    assert hr_filter.process(4.0, 71, sensor_contact=None) == 71
+    assert hr_filter.accepted == 2
+    assert hr_filter.rejected == {"no_contact": 1, "invalid": 2, "outlier": 0}
+
+    ungated = HeartRateFilter(contact_gating=False)
+    assert ungated.process(0.0, 70, sensor_contact=False) == 70
+
+
+def test_hampel_drops_spikes():
+    hr_filter = HeartRateFilter()
+    values = [70, 71, 72, 71, 140, 72, 73, 35, 72]
+    kept = [hr_filter.process(float(ts), hr) for ts, hr in enumerate(values)]
+    assert kept == [70, 71, 72, 71, None, 72, 73, None, 72]
+    assert hr_filter.rejected["outlier"] == 2
+
+
+def test_hampel_follows_level_change():
+    hr_filter = HeartRateFilter(window=5)
+    for ts in range(5):
+        hr_filter.process(float(ts), 80)
+    kept = [hr_filter.process(float(ts), 130) for ts in range(5, 10)]
+    # the new level is accepted once it is the majority of the window
+    assert kept[:2] == [None, None]
+    assert kept[-1] == 130
+
+    disabled = HeartRateFilter(window=0)
+    disabled.process(0.0, 80)
+    assert disabled.process(1.0, 200) == 200
+    with pytest.raises(ValueError):
+        HeartRateFilter(window=-1)
+
+
+def test_gaps():
+    hr_filter = HeartRateFilter(max_gap=5.0)
+    hr_filter.process(0.0, 70)
+    hr_filter.process(1.0, 70)
+    for ts in range(2, 10):
+        hr_filter.process(float(ts), 0)
+    hr_filter.process(10.0, 70)
+    # no notification at all
+    hr_filter.process(30.0, 70)
+    assert hr_filter.gaps(0.0, 31.0) == [
+        Gap(1.0, 10.0, "invalid"),
+        Gap(10.0, 30.0, "dropout"),
+    ]
+    assert hr_filter.gaps(15.0, 31.0) == [Gap(10.0, 30.0, "dropout")]
+    # the current gap is open
+    hr_filter.process(31.0, 70, sensor_contact=False)
+    assert hr_filter.gaps(25.0, 40.0)[-1] == Gap(30.0, None, "no_contact")
+    assert hr_filter.gaps(25.0, 33.0) == [Gap(10.0, 30.0, "dropout")]
+
+    hr_filter.clear()
+    assert hr_filter.gaps(0.0, 100.0) == []
+    assert hr_filter.accepted == 0
@@ -0,0 +1,99 @@
+import math
+import random
+
+import pytest
+
+from hrm.hrv import HrvWindow, frequency_domain, welch_psd
+from hrm.ts_db import TsDB
+
+
+def beats(rr_of, duration):
+    """Beat times (s) and RR intervals (ms) of a tachogram rr_of(t) in ms."""
+    times, rrs = [], []
+    t = 0.0
+    while t < duration:
+        rr = rr_of(t)
+        t += rr / 1000
+        times.append(t)
+        rrs.append(rr)
+    return times, rrs
+
+
+def reference(rrs):
+    diffs = [b - a for a, b in zip(rrs, rrs[1:])]
+    mean = sum(rrs) / len(rrs)
+    return {
+        "rmssd": math.sqrt(sum(d * d for d in diffs) / len(diffs)),
+        "sdnn": math.sqrt(sum((r - mean) ** 2 for r in rrs) / (len(rrs) - 1)),
+        "pnn50": 100 * sum(abs(d) > 50 for d in diffs) / len(diffs),
+    }
+
+
+def test_empty_window():
+    window = HrvWindow(60)
+    window.push(0.0, 800.0)
+    assert window.rmssd() is None
+    assert window.sdnn() is None
+    assert window.pnn50() is None
+    assert window.mean() == 800.0
+    with pytest.raises(ValueError):
+        HrvWindow(0)
+
+
+def test_window_matches_reference():
+    rng = random.Random(1)
+    times, rrs = beats(lambda t: 800 + rng.gauss(0, 60), 600)
+    window = HrvWindow(120)
+    for ts, rr in zip(times, rrs):
+        window.push(ts, rr)
+    now = times[-1]
+    recent = [rr for ts, rr in zip(times, rrs) if ts >= now - 120]
+    expected = reference(recent)
+    assert window.count() == len(recent)
+    assert window.rmssd() == pytest.approx(expected["rmssd"])
+    assert window.sdnn() == pytest.approx(expected["sdnn"])
+    assert window.pnn50() == pytest.approx(expected["pnn50"])
+
+    # the intervals expire with time
+    assert window.count(now + 200) == 0
+    assert window.rmssd() is None
+
+
+def test_window_attached_to_db():
+    db = TsDB(100, rollups=())
+    db.insert(0.0, 800.0)
+    db.insert(0.8, 900.0)
+    window = db.attach_window(HrvWindow(60))
+    assert window.count() == 2
+    db.insert(1.7, 800.0)
+    assert window.rmssd() == pytest.approx(100.0)
+    assert window.pnn50() == 100.0
+    db.clear()
+    assert window.count() == 0
+    # plain sliding windows are still shared by span
+    assert db.register_window(60) is db.register_window(60)
+
+
+def test_frequency_domain_bands():
+    # respiratory sinus arrhythmia at 0.25 Hz is HF power
+    times, rrs = beats(lambda t: 900 + 40 * math.sin(2 * math.pi * 0.25 * t), 300)
+    hf = frequency_domain(times, rrs)
+    assert hf["lf_hf"] < 0.2
+
+    times, rrs = beats(lambda t: 900 + 40 * math.sin(2 * math.pi * 0.1 * t), 300)
+    assert frequency_domain(times, rrs)["lf_hf"] > 5
+
+
+def test_frequency_domain_too_short():
+    times, rrs = beats(lambda t: 800, 30)
+    assert frequency_domain(times, rrs) is None
+    assert frequency_domain([], []) is None
+
+
+def test_welch_psd_power():
+    # a sine of amplitude 40 ms has a power of 40² / 2 ms²
+    x = [40 * math.sin(2 * math.pi * 0.25 * i / 4) for i in range(1200)]
+    freqs, psd = welch_psd(x, 4.0)
+    df = freqs[1] - freqs[0]
+    assert psd.sum() * df == pytest.approx(800, rel=1e-3)
+    assert freqs[psd.argmax()] == pytest.approx(0.25)
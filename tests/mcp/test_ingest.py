@@ -0,0 +1,38 @@
+import asyncio
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from hrm.ingest import NotificationBuffer
+
+
+def test_put_and_drain():
+    handler = MagicMock()
+    buffer = NotificationBuffer(handler)
+    with patch("time.time", side_effect=[1.0, 2.0]):
+        buffer.put(1, bytearray([0x00, 60]))
+        buffer.put(1, bytearray([0x00, 61]))
+    assert len(buffer) == 2
+    handler.assert_not_called()
+    assert buffer.drain() == 2
+    handler.assert_called_once_with([(1.0, b"\x00<"), (2.0, b"\x00=")])
+    assert len(buffer) == 0
+    # nothing queued, the handler is not called with an empty batch
+    assert buffer.drain() == 0
+    handler.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_run_drains_periodically():
+    batches = []
+    buffer = NotificationBuffer(batches.append, interval=0.01)
+    task = asyncio.create_task(buffer.run())
+    buffer.put(1, bytearray([0x00, 60]))
+    await asyncio.sleep(0.05)
+    assert len(batches) == 1
+    buffer.put(1, bytearray([0x00, 61]))
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    # the pending notification is committed on cancellation
+    assert len(batches) == 2
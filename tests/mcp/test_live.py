@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from hrm.live import LiveFeed
+
+
+def test_publish_fans_out():
+    feed = LiveFeed()
+    first, second = feed.subscribe(), feed.subscribe()
+    feed.publish({"heart_rate": 60})
+    assert feed.latest == {"heart_rate": 60}
+    assert len(first) == len(second) == 1
+    second.close()
+    assert len(feed) == 1
+    feed.publish({"heart_rate": 61})
+    assert len(first) == 2
+    assert len(second) == 1
+
+
+def test_slow_subscriber_is_coalesced():
+    feed = LiveFeed()
+    slow = feed.subscribe(maxsize=2)
+    for hr in range(60, 65):
+        feed.publish({"heart_rate": hr})
+    assert len(slow) == 2
+    assert slow.coalesced == 3
+    assert [u["heart_rate"] for u in slow._queue] == [63, 64]
+
+
+def test_subscription_size():
+    with pytest.raises(ValueError):
+        LiveFeed().subscribe(maxsize=0)
+
+
+@pytest.mark.asyncio
+async def test_get_waits_for_update():
+    feed = LiveFeed()
+    subscription = feed.subscribe()
+    assert await subscription.get(timeout=0.01) is None
+
+    async def publish():
+        await asyncio.sleep(0.01)
+        feed.publish({"heart_rate": 60})
+
+    task = asyncio.create_task(publish())
+    assert await subscription.get(timeout=1.0) == {"heart_rate": 60}
+    await task
+
+
+@pytest.mark.asyncio
+async def test_close_wakes_get():
+    subscription = LiveFeed().subscribe()
+    getter = asyncio.create_task(subscription.get())
+    await asyncio.sleep(0)
+    subscription.close()
+    assert await getter is None
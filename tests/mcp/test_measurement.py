@@ -0,0 +1,69 @@
+import pytest
+
+from hrm.measurement import (
+    HeartRateMeasurement,
+    decode_measurement,
+    encode_measurement,
+    rr_timestamps,
+)
+
+
+@pytest.mark.parametrize(
+    "data,expected",
+    [
+        (bytes([0x00, 60]), HeartRateMeasurement(60)),
+        (bytes([0x01, 0x2C, 0x01]), HeartRateMeasurement(300)),
+        (bytes([0x04, 60]), HeartRateMeasurement(60, sensor_contact=False)),
+        (bytes([0x06, 60]), HeartRateMeasurement(60, sensor_contact=True)),
+        (
+            bytes([0x08, 60, 0x34, 0x12]),
+            HeartRateMeasurement(60, energy_expended=0x1234),
+        ),
+        (
+            bytes([0x10, 60, 0x00, 0x04, 0x00, 0x02]),
+            HeartRateMeasurement(60, rr_intervals=(1000.0, 500.0)),
+        ),
+        (
+            bytearray([0x19, 0x2C, 0x01, 0x01, 0x00, 0x00, 0x04, 0xFF]),
+            HeartRateMeasurement(300, energy_expended=1, rr_intervals=(1000.0,)),
+        ),
+    ],
+)
+def test_decode_measurement(data, expected):
+    assert decode_measurement(data) == expected
+
+
+@pytest.mark.parametrize("data", [b"", bytes([0x01, 60]), bytes([0x08, 60, 0x01])])
+def test_decode_truncated_measurement(data):
+    with pytest.raises(ValueError, match="Truncated heart rate measurement"):
+        decode_measurement(data)
+
+
+@pytest.mark.parametrize(
+    "measurement",
+    [
+        HeartRateMeasurement(60),
+        HeartRateMeasurement(300),
+        HeartRateMeasurement(60, sensor_contact=False),
+        HeartRateMeasurement(0, sensor_contact=True, energy_expended=0x1234),
+        HeartRateMeasurement(72, rr_intervals=(1000.0, 500.0)),
+    ],
+)
+def test_encode_measurement_round_trip(measurement):
+    assert decode_measurement(encode_measurement(measurement)) == measurement
+
+
+def test_encode_measurement_format():
+    assert encode_measurement(HeartRateMeasurement(60)) == bytes([0x00, 60])
+    assert encode_measurement(HeartRateMeasurement(60), uint16=True) == bytes(
+        [0x01, 60, 0x00]
+    )
+    rr = decode_measurement(
+        encode_measurement(HeartRateMeasurement(60, rr_intervals=(833.0,)))
+    ).rr_intervals
+    assert rr == pytest.approx((833.0,), abs=1000 / 1024)
+
+
+def test_rr_timestamps():
+    assert rr_timestamps(10.0, (500.0, 250.0, 1000.0)) == [8.75, 9.0, 10.0]
+    assert rr_timestamps(10.0, ()) == []
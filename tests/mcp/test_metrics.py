@@ -0,0 +1,120 @@
+import asyncio
+import time
+
+import pytest
+
+from hrm.metrics import ArrivalStats, Histogram, LoopLagMonitor, Metrics
+
+
+def test_histogram_quantiles():
+    h = Histogram((0.001, 0.01, 0.1))
+    assert h.quantile(0.5) is None
+    for value in [0.0005] * 90 + [0.05] * 9 + [2.0]:
+        h.observe(value)
+    assert h.counts == [90, 0, 9, 1]
+    assert h.quantile(0.5) == 0.001
+    assert h.quantile(0.95) == 0.1
+    # the +Inf bucket is estimated by the max
+    assert h.quantile(1.0) == 2.0
+    summary = h.summary()
+    assert summary["count"] == 100
+    assert summary["p50_ms"] == 1.0
+    assert summary["max_ms"] == 2000.0
+
+
+def test_arrival_rate_and_jitter():
+    stats = ArrivalStats()
+    assert stats.rate is None
+    stats.observe([0.0, 1.0, 2.0])
+    stats.observe([3.0, 4.0])
+    assert stats.rate == 1.0
+    assert stats.jitter == 0.0
+    # a dropout is not accounted as jitter
+    stats.observe([60.0])
+    assert stats.rate == 1.0
+    stats.observe([60.5, 62.0])
+    assert 0.0 < stats.jitter < 0.1
+    stats.clear()
+    assert stats.rate is None
+
+
+def test_timed_tools():
+    metrics = Metrics()
+
+    @metrics.timed
+    def tool(fail=False):
+        """The tool."""
+        if fail:
+            raise ValueError("failed")
+        return 1
+
+    assert tool.__name__ == "tool" and tool.__doc__ == "The tool."
+    assert tool() == 1
+    with pytest.raises(ValueError):
+        tool(fail=True)
+    snapshot = metrics.snapshot()
+    assert snapshot["tools"]["tool"]["count"] == 2
+    assert snapshot["tools"]["tool"]["errors"] == 1
+    assert snapshot["devices"] == {}
+
+
+@pytest.mark.asyncio
+async def test_timed_async_tool():
+    metrics = Metrics()
+
+    @metrics.timed
+    async def tool():
+        await asyncio.sleep(0.01)
+        return 1
+
+    assert await tool() == 1
+    summary = metrics.snapshot()["tools"]["tool"]
+    assert summary["count"] == 1
+    assert summary["mean_ms"] >= 10
+    # the first call started the event loop lag sampling
+    assert metrics.loop_lag.task is not None
+    metrics.loop_lag.task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_loop_lag():
+    monitor = LoopLagMonitor(interval=0.01)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.015)
+    # block the event loop
+    time.sleep(0.05)
+    await asyncio.sleep(0.02)
+    task.cancel()
+    assert monitor.histogram.count >= 2
+    assert monitor.histogram.max >= 0.03
+
+
+def test_prometheus_text(tmp_path):
+    devices = {
+        'strap "1"': {
+            "state": "connected",
+            "notifications_total": 10,
+            "notification_rate": None,
+            "rejected_total": {"no_contact": 1, "invalid": 0, "outlier": 2},
+            "db_size": 8,
+        }
+    }
+    metrics = Metrics(lambda: devices, dump_path=str(tmp_path / "hrm.prom"))
+    metrics.observe_tool("get_heart_rate", 0.002)
+    text = metrics.prometheus()
+    assert "# TYPE hrm_tool_duration_seconds histogram" in text
+    assert (
+        'hrm_tool_duration_seconds_bucket{tool="get_heart_rate",le="0.001"} 0' in text
+    )
+    assert (
+        'hrm_tool_duration_seconds_bucket{tool="get_heart_rate",le="0.0025"} 1' in text
+    )
+    assert 'hrm_tool_duration_seconds_count{tool="get_heart_rate"} 1' in text
+    assert 'hrm_device_notifications_total{device="strap \\"1\\""} 10' in text
+    assert (
+        'hrm_device_rejected_total{device="strap \\"1\\"",reason="outlier"} 2' in text
+    )
+    assert "hrm_device_notification_rate{" not in text
+    assert "state" not in text
+    metrics.dump()
+    assert (tmp_path / "hrm.prom").read_text().startswith("# HELP hrm_uptime_seconds")
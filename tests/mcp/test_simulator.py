@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from bleak.exc import BleakError
+
+from hrm.bt_client import BtClient
+from hrm.discovery import DeviceScanner
+from hrm.measurement import decode_measurement
+from hrm.simulator import Simulator, StrapProfile, VirtualStrap, run_load
+
+
+def test_strap_measurements():
+    strap = VirtualStrap("SIM-0000", StrapProfile(), seed=1)
+    measurements = [strap.step(1.0) for _ in range(120)]
+    assert all(40 <= m.heart_rate <= 230 for m in measurements)
+    assert all(m.sensor_contact is True for m in measurements)
+    beats = sum(len(m.rr_intervals) for m in measurements)
+    # about one beat per second at a resting heart rate
+    assert 60 <= beats <= 300
+    assert all(200 < rr < 2000 for m in measurements for rr in m.rr_intervals)
+    assert sum(m.energy_expended is not None for m in measurements) == 12
+
+
+def test_strap_contact_loss():
+    profile = StrapProfile(contact_loss=1.0, contact_loss_duration=60)
+    measurement = VirtualStrap("SIM-0000", profile, seed=1).step(1.0)
+    assert measurement.heart_rate == 0
+    assert measurement.sensor_contact is False
+    assert measurement.rr_intervals == ()
+
+    profile = StrapProfile(contact_supported=False)
+    assert VirtualStrap("SIM-0000", profile).step(1.0).sensor_contact is None
+
+
+@pytest.mark.asyncio
+async def test_client_notifications():
+    simulator = Simulator(2, StrapProfile(rate=100, uint16=True), seed=1)
+    payloads = []
+    client = simulator.client("SIM-0001")
+    async with client:
+        assert client.is_connected
+        await client.start_notify("2a37", lambda sender, data: payloads.append(data))
+        await asyncio.sleep(0.1)
+        await client.stop_notify("2a37")
+    assert not client.is_connected
+    assert len(payloads) >= 3
+    assert all(data[0] & 0x01 for data in payloads)
+    assert all(decode_measurement(data).heart_rate > 0 for data in payloads)
+    assert simulator.notifications == len(payloads)
+
+    with pytest.raises(BleakError):
+        await simulator.client("SIM-9999").connect()
+
+
+@pytest.mark.asyncio
+async def test_client_dropout():
+    simulator = Simulator(1, StrapProfile(rate=100, dropout=1.0, dropout_duration=60))
+    dropped = asyncio.Event()
+    client = simulator.client("SIM-0000", disconnected_callback=lambda c: dropped.set())
+    await client.connect()
+    await client.start_notify("2a37", lambda sender, data: None)
+    await asyncio.wait_for(dropped.wait(), 1.0)
+    assert not client.is_connected
+    # the strap stays unreachable for the dropout duration
+    with pytest.raises(BleakError):
+        await client.connect()
+
+
+@pytest.mark.asyncio
+async def test_scanner_discovery():
+    simulator = Simulator(3)
+    scanner = DeviceScanner(scan_timeout=0.01, scanner_cls=simulator.scanner)
+    devices = await scanner.devices()
+    await scanner.stop()
+    assert sorted(devices) == ["SIM-0000", "SIM-0001", "SIM-0002"]
+    assert devices["SIM-0000"]["name"] == "Simulated HRM 0000"
+
+
+@pytest.mark.asyncio
+async def test_bt_client_with_simulator():
+    # at a steady 220 bpm a beat, and its RR interval, comes every 14 notifications
+    profile = StrapProfile(rate=50, resting_hr=220, max_hr=220)
+    simulator = Simulator(2, profile, seed=1)
+    bt_client = BtClient(simulator=simulator)
+    await bt_client.monitoring_heart_rate("SIM-0000", duration=60)
+    await bt_client.monitoring_heart_rate("SIM-0001", duration=60)
+
+    async def notified(count):
+        while any(s.notifications < count for s in simulator.straps.values()):
+            await asyncio.sleep(0.01)
+
+    # stop once every strap sent 15 notifications, however slow the machine is
+    await asyncio.wait_for(notified(15), 30)
+    tasks = [s.task for s in bt_client.sessions.values()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for session in bt_client.sessions.values():
+        assert session.status()["state"] == "stopped"
+        assert session.samples_received >= 15
+        assert len(session.db) == session.hr_filter.accepted
+        assert len(session.rr_db) > 0
+
+
+@pytest.mark.asyncio
+async def test_run_load():
+    result = await run_load(
+        devices=5, duration=1.0, profile=StrapProfile(rate=20), seed=1
+    )
+    assert result["devices"] == 5
+    assert result["notifications"] > 0
+    assert result["samples_received"] == result["notifications"]
+    assert result["tools"]["get_heart_rate"]["count"] > 0
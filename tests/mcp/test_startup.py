@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+# modules only needed to render and upload charts, loaded on first use
+LAZY_MODULES = ("matplotlib", "qiniu")
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Import module in a fresh interpreter with -X importtime, return the
+    cumulative import time in microseconds of every imported module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_server_startup_skips_chart_stack():
+    times = import_times("hrm.server")
+    assert "hrm.server" in times
+    loaded = [name for name in times if name.split(".")[0] in LAZY_MODULES]
+    assert loaded == []
@@ -2,7 +2,7 @@ import time
 
 import pytest
 
-from hrm.ts_db import TsDB
+from hrm.ts_db import Bucket, TsDB
 
 
 def test_insert_and_latest():
@@ -98,7 +98,7 @@ def test_time_bucket():
     db.insert(3.5, 32.0)
     buckets = db.time_bucket(0.0, 4.0, 1.0)
     assert len(buckets) == 4
-    assert buckets == [(0.0, 0.0), (1.0, 11.0), (2.0, 21.0), (3.0, 31.0)]
+    assert buckets == [(0.0, None), (1.0, 11.0), (2.0, 21.0), (3.0, 31.0)]
     buckets = db.time_bucket(1.0, 4.0, 0.5)
     assert len(buckets) == 6
     assert buckets == [
@@ -133,3 +133,225 @@ def test_time_bucket_invalid_bucket_size():
         db.time_bucket(1.0, 2.0, 0)
     with pytest.raises(ValueError, match="Bucket size must be greater than 0"):
         db.time_bucket(1.0, 2.0, -1)
+
+
+def test_query_after_wraparound():
+    db = TsDB(maxlen=5)
+    for i in range(12):
+        db.insert(float(i), float(i * 10))
+    assert db.data == [
+        (7.0, 70.0),
+        (8.0, 80.0),
+        (9.0, 90.0),
+        (10.0, 100.0),
+        (11.0, 110.0),
+    ]
+    assert db.query(8.0, 10.0) == [(8.0, 80.0), (9.0, 90.0), (10.0, 100.0)]
+    assert db.query(0.0, 7.5) == [(7.0, 70.0)]
+    assert db.query(10.5, 20.0) == [(11.0, 110.0)]
+    assert db.query(0.0, 6.0) == []
+
+
+def test_insert_out_of_order():
+    db = TsDB(maxlen=4)
+    db.insert(1.0, 10.0)
+    db.insert(3.0, 30.0)
+    db.insert(2.0, 20.0)
+    assert db.data == [(1.0, 10.0), (2.0, 20.0), (3.0, 30.0)]
+    assert db.latest() == (3.0, 30.0)
+    assert db.query(1.5, 2.5) == [(2.0, 20.0)]
+
+
+def test_integer_value_type():
+    db = TsDB(maxlen=3, value_type="H")
+    db.insert(1.0, 60)
+    db.insert(2.0, 70)
+    assert db.latest() == (2.0, 70)
+    assert db.avg(0.0, 3.0) == pytest.approx(65.0)
+    assert db._vals.itemsize == 2
+    with pytest.raises(OverflowError):
+        db.insert(3.0, -1)
+    assert db.data == [(1.0, 60), (2.0, 70)]
+
+
+def test_sliding_window():
+    db = TsDB()
+    window = db.register_window(10)
+    db.insert(1.0, 70.0)
+    db.insert(5.0, 90.0)
+    db.insert(8.0, 60.0)
+    assert window.mean(10.0) == pytest.approx((70.0 + 90.0 + 60.0) / 3)
+    assert window.max(10.0) == 90.0
+    assert window.min(10.0) == 60.0
+    # the sample at 1.0 falls out of the window
+    db.insert(12.0, 80.0)
+    assert window.count() == 3
+    assert window.min() == 60.0
+    # the sample at 5.0 falls out of the window
+    assert window.max(16.0) == 80.0
+    assert window.mean(16.0) == pytest.approx(70.0)
+    assert window.mean(100.0) == 0
+    assert window.max() is None
+    db.clear()
+    assert window.count() == 0
+
+
+def test_register_window_backfills():
+    db = TsDB()
+    for i in range(20):
+        db.insert(float(i), float(i))
+    window = db.register_window(5)
+    assert window.count() == 6
+    assert window.max() == 19.0
+    assert window.min() == 14.0
+    assert db.register_window(5) is window
+
+
+def test_bucket_stats():
+    db = TsDB()
+    db.insert(1.0, 10.0)
+    db.insert(1.2, 16.0)
+    db.insert(1.5, 12.0)
+    db.insert(3.0, 30.0)
+    buckets = db.bucket_stats(0.0, 4.0, 1.0)
+    assert buckets == [
+        Bucket(0.0, 0, None, None, None),
+        Bucket(1.0, 3, pytest.approx(38.0 / 3), 10.0, 16.0),
+        Bucket(2.0, 0, None, None, None),
+        Bucket(3.0, 1, 30.0, 30.0, 30.0),
+    ]
+
+
+def test_rollup_outlives_raw_buffer():
+    db = TsDB(maxlen=10, rollups=((1, 100), (10, 10)))
+    for i in range(60):
+        db.insert(float(i) + 0.5, float(i))
+    assert len(db) == 10
+    assert db.query(0.0, 10.0) == []
+    buckets = db.bucket_stats(0.0, 30.0, 10.0)
+    assert buckets == [
+        Bucket(0.0, 10, 4.5, 0.0, 9.0),
+        Bucket(10.0, 10, 14.5, 10.0, 19.0),
+        Bucket(20.0, 10, 24.5, 20.0, 29.0),
+    ]
+    # 2 s buckets are served by the 1 s tier
+    assert db.time_bucket(0.0, 4.0, 2.0) == [(0.0, 0.5), (2.0, 2.5)]
+    # unaligned buckets fall back to the raw samples
+    assert db.time_bucket(0.25, 2.25, 1.0) == [(0.25, None), (1.25, None)]
+
+
+def test_rollup_pick_coarsest_tier():
+    db = TsDB(rollups=((1, 10), (10, 10), (60, 10)))
+    # empty tiers are never read
+    assert db._pick_rollup(120.0, 60.0) is None
+    for i in range(201):
+        db.insert(float(i), float(i))
+    # the tiers start at 191, 110 and 0
+    assert db._pick_rollup(120.0, 60.0).resolution == 60
+    assert db._pick_rollup(130.0, 60.0).resolution == 10
+    assert db._pick_rollup(130.0, 30.0).resolution == 10
+    assert db._pick_rollup(195.0, 5.0).resolution == 1
+    assert db._pick_rollup(131.5, 5.0) is None
+    assert db._pick_rollup(131.0, 0.5) is None
+    # no aligned tier reaches back to start: the one reaching the furthest
+    assert db._pick_rollup(60.0, 10.0).resolution == 10
+    assert db._pick_rollup(131.0, 5.0).resolution == 1
+
+
+def test_rollup_head_past_tier_from_raw():
+    # the raw buffer reaches further back than the 1 s tier
+    db = TsDB(maxlen=50, rollups=((1, 10), (10, 10)))
+    for i in range(50):
+        db.insert(float(i) + 0.5, float(i))
+    buckets = db.time_bucket(0.0, 50.0, 1.0)
+    assert buckets == [(float(i), float(i)) for i in range(50)]
+    buckets = db.bucket_stats(0.0, 50.0, 2.0)
+    assert [b.count for b in buckets] == [2] * 25
+    assert buckets[0] == Bucket(0.0, 2, 0.5, 0.0, 1.0)
+    assert buckets[-1] == Bucket(48.0, 2, 48.5, 48.0, 49.0)
+
+
+def test_bucket_chunks():
+    # the raw samples before the 1 s tier and the tier are split in chunks
+    db = TsDB(maxlen=60, rollups=((1, 10), (10, 10)))
+    for i in range(50):
+        db.insert(float(i) + 0.5, float(i))
+    chunks = db.bucket_chunks(0.0, 60.0, 2.0, size=8)
+    # the chunks are a snapshot of the data when called
+    db.insert(55.5, 99.0)
+    chunks = list(chunks)
+    assert [len(chunk) for chunk in chunks] == [8, 8, 8, 6]
+    buckets = [b for chunk in chunks for b in chunk]
+    assert buckets[:25] == db.bucket_stats(0.0, 50.0, 2.0)
+    assert all(b.count == 0 for b in buckets[25:])
+    assert db.bucket_stats(0.0, 60.0, 2.0)[27].count == 1
+
+
+def test_rollup_default_tiers_twelve_hours():
+    db = TsDB()
+    end = 12 * 3600
+    for i in range(end):
+        db.insert(float(i), 60.0)
+    # the 1 s tier holds the last 6 h, the rest comes from the raw samples
+    buckets = db.time_bucket(0.0, float(end), 1.0)
+    assert len(buckets) == end
+    assert all(value == 60.0 for _, value in buckets)
+    buckets = db.bucket_stats(0.0, float(end), 5.0)
+    assert [b.count for b in buckets] == [5] * (end // 5)
+
+
+def test_version():
+    db = TsDB()
+    db.insert(1.0, 10.0)
+    db.insert(5.0, 50.0)
+    version = db.version
+    assert db.unchanged_before(version, 5.0, 4.0)
+    # in-order appends don't change the data before the latest timestamp
+    db.insert(6.0, 60.0)
+    assert db.version == version + 1
+    assert db.unchanged_before(version, 5.0, 5.0)
+    assert not db.unchanged_before(version, 5.0, 6.0)
+    # an out of order insert may change any range
+    db.insert(3.0, 30.0)
+    assert not db.unchanged_before(version, 5.0, 4.0)
+    version = db.version
+    db.clear()
+    assert not db.unchanged_before(version, 6.0, 4.0)
+
+
+def test_evictions():
+    db = TsDB(3, rollups=())
+    for ts in range(5):
+        db.insert(float(ts), 1.0)
+    assert len(db) == 3
+    assert db.evictions == 2
+
+
+def test_chunks():
+    db = TsDB(3, value_type="H", rollups=())
+    for ts in range(5):
+        db.insert(float(ts), 60 + ts)
+    ((ts, vals),) = db.chunks(3.0, 4.0)
+    assert list(ts) == [3.0, 4.0]
+    assert vals.typecode == "H" and list(vals) == [63, 64]
+    assert db.count(3.0, 4.0) == 2
+    # the wrapped ring is read in two slices, each in chunks of size rows
+    chunks = list(db.chunks(0.0, 10.0))
+    assert [list(ts) for ts, _ in chunks] == [[2.0], [3.0, 4.0]]
+    chunks = list(db.chunks(0.0, 10.0, size=1))
+    assert [list(ts) for ts, _ in chunks] == [[2.0], [3.0], [4.0]]
+    assert db.count(0.0, 10.0) == 3
+    assert list(db.chunks(5.0, 10.0)) == [] and db.count(5.0, 10.0) == 0
+
+
+def test_ring_grows_up_to_maxlen():
+    db = TsDB(5000, value_type="H")
+    assert len(db._ts) == len(db._vals) < 5000
+    for ts in range(6000):
+        db.insert(float(ts), ts % 200)
+    assert len(db._ts) == len(db._vals) == 5000
+    assert len(db) == 5000 and db.evictions == 1000
+    assert db.data[0] == (1000.0, 1000 % 200)
+    assert db.latest() == (5999.0, 5999 % 200)
+    # the rollups grow the same way
+    assert db.time_bucket(0.0, 6000.0, 1000.0)[5] == (5000.0, pytest.approx(99.5))
@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from hrm.ts_db import TsDB
+from hrm.ts_store import RECORD, SegmentStore
+
+
+def test_append_and_query(tmp_path):
+    store = SegmentStore(str(tmp_path), batch_size=4)
+    for i in range(10):
+        store.append(float(i), float(i * 10))
+    assert len(store) == 10
+    # 8 records are flushed in two batches, 2 are still buffered
+    assert os.path.getsize(tmp_path / "00000000.seg") == 8 * RECORD.size
+    assert store.query(2.0, 4.0) == [(2.0, 20.0), (3.0, 30.0), (4.0, 40.0)]
+    assert store.query(7.5, 20.0) == [(8.0, 80.0), (9.0, 90.0)]
+    assert store.query(20.0, 30.0) == []
+    with pytest.raises(
+        ValueError, match="Start timestamp must be less than end timestamp"
+    ):
+        store.query(2.0, 2.0)
+    store.close()
+
+
+def test_segments_roll_over(tmp_path):
+    store = SegmentStore(str(tmp_path), segment_records=4, batch_size=2)
+    for i in range(10):
+        store.append(float(i), float(i))
+    store.close()
+    assert sorted(os.listdir(tmp_path)) == [
+        "00000000.seg",
+        "00000001.seg",
+        "00000002.seg",
+    ]
+    assert store.query(3.0, 6.0) == [(3.0, 3.0), (4.0, 4.0), (5.0, 5.0), (6.0, 6.0)]
+    assert store.tail(3) == [(7.0, 7.0), (8.0, 8.0), (9.0, 9.0)]
+    assert store.first() == 0.0
+
+
+def test_reopen_drops_partial_record(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    for i in range(5):
+        store.append(float(i), float(i))
+    store.close()
+    with open(tmp_path / "00000000.seg", "ab") as f:
+        f.write(b"\x00" * 3)
+    store = SegmentStore(str(tmp_path))
+    assert len(store) == 5
+    store.append(5.0, 5.0)
+    store.flush()
+    assert store.query(0.0, 10.0) == [(float(i), float(i)) for i in range(6)]
+    store.close()
+
+
+def test_tsdb_with_store(tmp_path):
+    db = TsDB(maxlen=3, store=SegmentStore(str(tmp_path), batch_size=1))
+    for i in range(6):
+        db.insert(float(i), float(i * 10))
+    db.store.close()
+    # range past the in-memory buffer is served by the store
+    assert db.query(0.0, 2.0) == [(0.0, 0.0), (1.0, 10.0), (2.0, 20.0)]
+    assert db.time_bucket(0.0, 4.0, 2.0) == [(0.0, 5.0), (2.0, 25.0)]
+
+    # a new db is warmed from the store
+    db = TsDB(maxlen=3, store=SegmentStore(str(tmp_path)))
+    assert db.data == [(3.0, 30.0), (4.0, 40.0), (5.0, 50.0)]
+    assert db.avg(0.0, 5.0) == pytest.approx(25.0)
+
+
+def test_tsdb_chunks_from_store(tmp_path):
+    db = TsDB(maxlen=3, value_type="H", store=SegmentStore(str(tmp_path)))
+    for i in range(6):
+        db.insert(float(i), 60 + i)
+    ((ts, vals),) = db.chunks(1.0, 4.0)
+    assert list(ts) == [1.0, 2.0, 3.0, 4.0]
+    assert vals.typecode == "H" and list(vals) == [61, 62, 63, 64]
+    assert db.count(1.0, 4.0) == 4
+
+
+def test_tsdb_reopen_integer_store(tmp_path):
+    db = TsDB(maxlen=3, value_type="H", store=SegmentStore(str(tmp_path)))
+    for i in range(6):
+        db.insert(float(i), 60 + i)
+    db.store.close()
+    # the float values of the store are warmed into the integer column
+    db = TsDB(maxlen=3, value_type="H", store=SegmentStore(str(tmp_path)))
+    assert db.data == [(3.0, 63), (4.0, 64), (5.0, 65)]
+    db.insert(6.0, 66)
+    assert db.latest() == (6.0, 66)
+
+
+def test_store_chunks(tmp_path):
+    store = SegmentStore(str(tmp_path), segment_records=4, batch_size=2)
+    for i in range(11):
+        store.append(float(i), i * 10.0)
+    # 2 full segments, 1 with 2 records and 1 pending record
+    assert store.count(1.0, 9.5) == 9
+    assert store.count(20.0, 30.0) == 0
+    chunks = store.chunks(1.0, 9.5, size=3)
+    # records appended after the call are not returned
+    store.append(11.0, 110.0)
+    store.flush()
+    chunks = [(list(ts), list(vals)) for ts, vals in chunks]
+    assert chunks == [
+        ([1.0, 2.0, 3.0], [10.0, 20.0, 30.0]),
+        ([4.0, 5.0, 6.0], [40.0, 50.0, 60.0]),
+        ([7.0], [70.0]),
+        ([8.0, 9.0], [80.0, 90.0]),
+    ]
+    last = [list(ts) for ts, _ in store.chunks(0.0, 20.0)][-1]
+    assert last == [8.0, 9.0, 10.0, 11.0]
@@ -0,0 +1,166 @@
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from hrm.upload import (
+    LocalDirUploader,
+    QiniuUploader,
+    Uploader,
+    chart_key,
+    uploader_from_env,
+)
+
+
+@pytest.fixture
+def qiniu_uploader():
+    return QiniuUploader(
+        "fake_key", "fake_secret", "fake_bucket", "http://fake.domain/", backoff=0
+    )
+
+
+def test_chart_key():
+    key = chart_key(".png")
+    assert key.endswith(".png")
+    assert key != chart_key(".png")
+
+
+@pytest.mark.asyncio
+async def test_qiniu_upload(qiniu_uploader):
+    with (
+        patch("qiniu.Auth") as MockAuth,
+        patch("qiniu.put_data", return_value=({"key": "a.png"}, MagicMock())) as put,
+    ):
+        MockAuth.return_value.upload_token.return_value = "fake_token"
+        url = await qiniu_uploader.upload(b"png", "a.png")
+        assert url == "http://fake.domain/a.png"
+        put.assert_called_once_with(
+            "fake_token", "a.png", b"png", mime_type="image/png"
+        )
+
+        # the auth and the token are reused by the next uploads
+        await qiniu_uploader.upload(b"png", "b.png")
+        MockAuth.assert_called_once_with("fake_key", "fake_secret")
+        MockAuth.return_value.upload_token.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_qiniu_token_renewed_before_expiry(qiniu_uploader):
+    with (
+        patch("qiniu.Auth") as MockAuth,
+        patch("qiniu.put_data", return_value=({}, MagicMock())),
+        patch("hrm.upload.time.monotonic", return_value=0.0),
+    ):
+        await qiniu_uploader.upload(b"png", "a.png")
+    with (
+        patch("qiniu.put_data", return_value=({}, MagicMock())),
+        patch("hrm.upload.time.monotonic", return_value=3600.0 - 30),
+    ):
+        await qiniu_uploader.upload(b"png", "b.png")
+    assert MockAuth.return_value.upload_token.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_qiniu_upload_retries(qiniu_uploader):
+    retry = MagicMock(status_code=503)
+    retry.need_retry.return_value = True
+    with (
+        patch("qiniu.Auth"),
+        patch(
+            "qiniu.put_data",
+            side_effect=[OSError("reset"), (None, retry), ({}, MagicMock())],
+        ) as put,
+    ):
+        url = await qiniu_uploader.upload(b"png", "a.png")
+        assert url == "http://fake.domain/a.png"
+        assert put.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_qiniu_upload_gives_up(qiniu_uploader):
+    fatal = MagicMock(status_code=400)
+    fatal.need_retry.return_value = False
+    with (
+        patch("qiniu.Auth"),
+        patch("qiniu.put_data", return_value=(None, fatal)) as put,
+    ):
+        assert await qiniu_uploader.upload(b"png", "a.png") is None
+        put.assert_called_once()
+
+    with (
+        patch("qiniu.Auth"),
+        patch("qiniu.put_data", side_effect=OSError("down")) as put,
+    ):
+        assert await qiniu_uploader.upload(b"png", "a.png") is None
+        assert put.call_count == qiniu_uploader.retries + 1
+
+
+@pytest.mark.asyncio
+async def test_qiniu_upload_not_retried_while_in_flight():
+    uploader = QiniuUploader("key", "secret", "bucket", "http://d", timeout=0.01)
+
+    def slow_put(*args, **kwargs):
+        time.sleep(0.1)
+        return {}, MagicMock()
+
+    with patch("qiniu.Auth"), patch("qiniu.put_data", side_effect=slow_put) as put:
+        assert await uploader.upload(b"png", "a.png") == "http://d/a.png"
+        put.assert_called_once()
+
+
+def test_uploader_is_abstract():
+    with pytest.raises(TypeError):
+        Uploader()
+
+
+@pytest.mark.asyncio
+async def test_local_dir_upload(tmp_path):
+    uploader = LocalDirUploader(str(tmp_path / "charts"))
+    url = await uploader.upload(b"png", "a.png")
+    assert (tmp_path / "charts" / "a.png").read_bytes() == b"png"
+    assert url == (tmp_path / "charts" / "a.png").as_uri()
+
+    uploader = LocalDirUploader(str(tmp_path), base_url="http://localhost:8000/")
+    assert await uploader.upload(b"png", "b.png") == "http://localhost:8000/b.png"
+
+
+def test_uploader_from_env(monkeypatch, tmp_path):
+    for name in (
+        "QINIU_ACCESS_KEY",
+        "QINIU_SECRET_KEY",
+        "QINIU_BUCKET_NAME",
+        "QINIU_BUCKET_DOMAIN",
+        "HRM_UPLOAD_DIR",
+    ):
+        monkeypatch.setenv(name, "")
+    assert uploader_from_env() is None
+
+    monkeypatch.setenv("HRM_UPLOAD_DIR", str(tmp_path))
+    assert isinstance(uploader_from_env(), LocalDirUploader)
+
+    monkeypatch.setenv("QINIU_ACCESS_KEY", "fake_key")
+    monkeypatch.setenv("QINIU_SECRET_KEY", "fake_secret")
+    monkeypatch.setenv("QINIU_BUCKET_NAME", "fake_bucket")
+    monkeypatch.setenv("QINIU_BUCKET_DOMAIN", "http://fake.domain")
+    uploader = uploader_from_env()
+    assert isinstance(uploader, QiniuUploader)
+    assert uploader.bucket == "fake_bucket"
+
+
+@pytest.mark.asyncio
+async def test_upload_file(qiniu_uploader, tmp_path):
+    path = tmp_path / "hr.csv"
+    path.write_text("time,value\n")
+    with (
+        patch("qiniu.Auth"),
+        patch("qiniu.put_file", return_value=({}, MagicMock())) as put,
+    ):
+        url = await qiniu_uploader.upload_file(str(path), "hr.csv", "text/csv")
+    assert url == "http://fake.domain/hr.csv"
+    assert put.call_args.args[1:] == ("hr.csv", str(path))
+
+    uploader = LocalDirUploader(str(tmp_path / "exports"))
+    url = await uploader.upload_file(str(path), "hr.csv")
+    assert (tmp_path / "exports" / "hr.csv").read_text() == "time,value\n"
+    # a file already in the directory is not copied onto itself
+    assert await uploader.upload_file(str(tmp_path / "exports" / "hr.csv"), "hr.csv")
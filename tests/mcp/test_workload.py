@@ -0,0 +1,83 @@
+import math
+
+import pytest
+
+from hrm.workload import WorkloadTracker
+
+
+def test_time_in_zone():
+    tracker = WorkloadTracker(max_hr=200)
+    assert tracker.thresholds == [100, 120, 140, 160, 180]
+    for ts, hr in [(0, 90), (1, 110), (2, 110), (3, 150), (4, 190), (5, 190)]:
+        tracker.push(float(ts), hr)
+    summary = tracker.summary()
+    assert [z["seconds"] for z in summary["zones"]] == [1, 2, 0, 1, 0, 1]
+    assert [z["min_hr"] for z in summary["zones"]] == [0, 100, 120, 140, 160, 180]
+    assert summary["duration"] == 5
+    assert summary["active_seconds"] == 5
+    assert summary["samples"] == 6
+    assert summary["avg_hr"] == 140
+    assert summary["max_hr"] == 190
+
+
+def test_reserve_basis():
+    tracker = WorkloadTracker(max_hr=200, resting_hr=50, basis="reserve")
+    assert tracker.thresholds == [125, 140, 155, 170, 185]
+    assert tracker.zone(124) == 0
+    assert tracker.zone(125) == 1
+    assert tracker.zone(199) == 5
+
+
+def test_gaps_and_out_of_order_samples():
+    tracker = WorkloadTracker(max_hr=200)
+    tracker.push(0.0, 150)
+    tracker.push(1.0, 150)
+    # a dropout is not exercise
+    tracker.push(60.0, 150)
+    tracker.push(30.0, 150)
+    tracker.push(61.0, 150)
+    summary = tracker.summary()
+    assert summary["active_seconds"] == 2
+    assert summary["duration"] == 61
+    assert summary["samples"] == 4
+
+
+def test_trimp_and_calories():
+    tracker = WorkloadTracker(max_hr=190, resting_hr=60, age=30, weight=70)
+    for ts in range(0, 601):
+        tracker.push(float(ts), 125)
+    # 10 minutes at half the heart rate reserve
+    assert tracker.trimp == pytest.approx(10 * 0.5 * 0.64 * math.exp(1.92 * 0.5))
+    kj_per_min = -55.0969 + 0.6309 * 125 + 0.1988 * 70 + 0.2017 * 30
+    assert tracker.calories == pytest.approx(10 * kj_per_min / 4.184)
+
+    female = WorkloadTracker(max_hr=190, resting_hr=60, sex="female")
+    female.push(0.0, 125)
+    female.push(5.0, 125)
+    assert 0 < female.trimp < tracker.trimp
+
+
+def test_clear():
+    tracker = WorkloadTracker()
+    tracker.push(0.0, 150)
+    tracker.push(1.0, 150)
+    tracker.clear()
+    summary = tracker.summary()
+    assert summary["samples"] == 0
+    assert summary["avg_hr"] is None
+    assert summary["trimp"] == 0
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"basis": "lactate"},
+        {"sex": "other"},
+        {"zones": (0.7, 0.5)},
+        {"zones": ()},
+        {"max_hr": 50, "resting_hr": 60},
+    ],
+)
+def test_invalid_profile(kwargs):
+    with pytest.raises(ValueError):
+        WorkloadTracker(**kwargs)